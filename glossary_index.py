@@ -0,0 +1,98 @@
+import re
+import unicodedata
+from collections import deque
+
+# 编辑框中每行一条术语，原文和译文之间可用以下分隔符
+_SEPARATORS = re.compile(r'\s*(?:=|\t|→|->)\s*')
+
+
+def normalize_term(text):
+    """全半角统一并忽略大小写，原文和术语按同样的规则规范化后再匹配"""
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+class GlossaryIndex:
+    """
+    预设术语表的多模式匹配索引(Aho-Corasick自动机)
+    构建一次后，每批原文只需线性扫描一遍就能找出其中出现的全部术语，
+    请求时只注入本批用到的条目，不必每批都把整张术语表放进系统提示词
+    """
+
+    def __init__(self, entries):
+        self.entries = {source: target for source, target in entries.items() if normalize_term(source).strip()}
+        self._goto = [{}]       # 状态 -> {字符: 下一状态}
+        self._fail = [0]
+        self._output = [[]]     # 状态 -> 在此结束的(术语原文, 规范化后的长度)
+        for source in self.entries:
+            self._add(normalize_term(source), source)
+        self._build()
+
+    def _add(self, pattern, source):
+        state = 0
+        for c in pattern:
+            next_state = self._goto[state].get(c)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][c] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((source, len(pattern)))
+
+    def _build(self):
+        """按层次遍历计算失败指针，并把失败链上的输出合并进来"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(c, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, texts):
+        """
+        返回在texts中出现过的术语原文，按首次出现的顺序；
+        完全落在更长术语出现位置之内的短术语(如"さくらみこ"中的"みこ")不算出现
+        """
+        found = {}
+        for text in texts:
+            occurrences = []
+            state = 0
+            for i, c in enumerate(normalize_term(text)):
+                while state and c not in self._goto[state]:
+                    state = self._fail[state]
+                state = self._goto[state].get(c, 0)
+                for source, length in self._output[state]:
+                    occurrences.append((i - length + 1, -i, source))
+            # 按起点排序、同起点长的在前，终点不超过此前最远终点的即被更长的术语覆盖
+            covered_until = -1
+            for start, negative_end, source in sorted(occurrences):
+                if -negative_end > covered_until:
+                    found.setdefault(source, start)
+                    covered_until = -negative_end
+        return list(found)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def parse_glossary(text):
+    """解析编辑框中的术语表：每行"原文=译文"(也可用制表符、→或->分隔)，#开头的行为注释"""
+    entries = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = _SEPARATORS.split(line, maxsplit=1)
+        if len(parts) == 2 and parts[0] and parts[1]:
+            entries[parts[0]] = parts[1]
+    return entries
+
+
+def format_glossary(entries):
+    """把术语表转为编辑框和提示词中使用的"原文=译文"文本"""
+    return "\n".join(f"{source}={target}" for source, target in entries.items())
@@ -0,0 +1,78 @@
+import threading
+from contextlib import contextmanager
+
+
+class JobCancelled(Exception):
+    """后台任务被用户取消"""
+
+
+class JobControl:
+    """
+    后台任务的取消/暂停令牌
+    工作线程在处理单元之间(转录段落、翻译批次、总结时间段、下载分片)调用checkpoint()，
+    暂停时在此等待，取消时抛出JobCancelled；登记的子进程(ffmpeg)在取消时直接终止
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def paused(self):
+        return not self._resume_event.is_set()
+
+    def cancel(self):
+        """取消任务并终止登记的子进程，处于暂停中的线程也会被唤醒"""
+        self._cancel_event.set()
+        self._resume_event.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            self._terminate(process)
+
+    def pause(self):
+        if not self.cancelled:
+            self._resume_event.clear()
+
+    def resume(self):
+        self._resume_event.set()
+
+    def checkpoint(self):
+        """暂停时等待继续，已取消时抛出JobCancelled"""
+        self._resume_event.wait()
+        if self.cancelled:
+            raise JobCancelled(f"{self.name}已取消" if self.name else "任务已取消")
+
+    def sleep(self, seconds):
+        """可被取消打断的等待"""
+        self._cancel_event.wait(seconds)
+        self.checkpoint()
+
+    @contextmanager
+    def track_process(self, process):
+        """登记子进程，期间取消任务会终止该进程"""
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            self._terminate(process)
+        try:
+            yield process
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+    @staticmethod
+    def _terminate(process):
+        if process.poll() is None:
+            try:
+                process.kill()
+            except OSError:
+                pass
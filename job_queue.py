@@ -0,0 +1,275 @@
+import itertools
+import threading
+
+from job_control import JobCancelled, JobControl
+
+# 任务状态
+STATUS_PENDING = "等待中"
+STATUS_RUNNING = "进行中"
+STATUS_CANCELLING = "取消中"
+STATUS_DONE = "已完成"
+STATUS_FAILED = "失败"
+STATUS_CANCELLED = "已取消"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class JobStage:
+    """
+    任务的一个处理阶段
+    resource为该阶段占用的资源名，同一资源同时运行的阶段数受JobQueue的resource_limits限制；
+    max_waiting限制已完成本阶段、排队等待下一阶段的任务数，避免预处理跑得太远积压大量音频
+    """
+
+    def __init__(self, name, resource, func, max_waiting=None):
+        self.name = name
+        self.resource = resource
+        self.func = func  # func(job)，抛出异常表示该任务失败
+        self.max_waiting = max_waiting
+
+
+class TranscriptionJob:
+    """队列中的一个文件任务，context用于在各阶段之间传递数据"""
+
+    def __init__(self, job_id, file_path):
+        self.job_id = job_id
+        self.file_path = file_path
+        self.status = STATUS_PENDING
+        self.stage_index = 0   # 下一个要执行的阶段
+        self.current_stage = ""
+        self.running = False
+        self.cancelled = False
+        self.progress = 0
+        self.error = None
+        self.context = {}
+        self.control = JobControl(file_path)  # 阶段内部的取消/暂停令牌
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+
+class JobQueue:
+    """
+    多文件任务队列：每个任务依次经过各阶段，调度按阶段占用的资源进行，
+    不同资源的阶段可以同时处理不同的任务(例如文件N占用模型转录时，文件N+1在CPU上预处理)。
+    同一资源内按队列顺序取任务，调整顺序即调整优先级
+    """
+
+    def __init__(self, stages, resource_limits=None, on_change=None, on_finish=None, log=print):
+        self.stages = stages
+        self.resource_limits = resource_limits or {}
+        self.on_change = on_change  # 任务状态变化时回调(在工作线程中调用)
+        self.on_finish = on_finish  # on_finish(job)，任务完成/失败/取消后回调，用于释放资源
+        self.log = log
+        self.jobs = []
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._workers = []
+        self._paused = False
+
+    def add(self, file_paths):
+        """添加文件，已在队列中且未结束的文件不重复添加，返回新加入的任务"""
+        added = []
+        with self._cond:
+            queued = {job.file_path for job in self.jobs if not job.finished}
+            for file_path in file_paths:
+                if file_path in queued:
+                    continue
+                job = TranscriptionJob(next(self._ids), file_path)
+                self.jobs.append(job)
+                queued.add(file_path)
+                added.append(job)
+            self._cond.notify_all()
+        self._changed()
+        return added
+
+    def move(self, job_id, offset):
+        """调整任务在队列中的位置，offset为负数表示前移"""
+        with self._cond:
+            index = self._index_of(job_id)
+            if index is None:
+                return
+            new_index = min(max(index + offset, 0), len(self.jobs) - 1)
+            self.jobs.insert(new_index, self.jobs.pop(index))
+        self._changed()
+
+    def cancel(self, job_id):
+        """取消任务：未开始的阶段不再执行，正在执行的阶段在下一个检查点停止并终止其ffmpeg子进程"""
+        finished_job = None
+        with self._cond:
+            index = self._index_of(job_id)
+            if index is None:
+                return
+            job = self.jobs[index]
+            if job.finished:
+                return
+            job.cancelled = True
+            job.control.cancel()
+            if job.running:
+                job.status = STATUS_CANCELLING
+            else:
+                job.status = STATUS_CANCELLED
+                finished_job = job
+            self._cond.notify_all()
+        if finished_job:
+            self._finish(finished_job)
+        self._changed()
+
+    def cancel_all(self):
+        for job in list(self.jobs):
+            self.cancel(job.job_id)
+
+    def pause(self):
+        """暂停队列：不再开始新的阶段，正在执行的阶段在下一个检查点暂停"""
+        with self._cond:
+            self._paused = True
+            for job in self.jobs:
+                job.control.pause()
+        self._changed()
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            for job in self.jobs:
+                job.control.resume()
+            self._cond.notify_all()
+        self._changed()
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def clear_finished(self):
+        with self._cond:
+            self.jobs = [job for job in self.jobs if not job.finished]
+        self._changed()
+
+    def is_active(self):
+        return any(worker.is_alive() for worker in self._workers)
+
+    def start(self):
+        """按各资源的并发上限启动工作线程，所有任务结束后线程自动退出"""
+        with self._cond:
+            if self.is_active():
+                self._cond.notify_all()
+                return
+            resources = []
+            for stage in self.stages:
+                if stage.resource not in resources:
+                    resources.append(stage.resource)
+            self._workers = [
+                threading.Thread(target=self._worker, args=(resource,), daemon=True)
+                for resource in resources
+                for _ in range(max(self.resource_limits.get(resource, 1), 1))
+            ]
+            for worker in self._workers:
+                worker.start()
+
+    def join(self):
+        """等待所有工作线程退出，即队列中的任务全部结束"""
+        for worker in list(self._workers):
+            worker.join()
+
+    def snapshot(self):
+        """返回任务列表的当前状态，供界面显示"""
+        with self._cond:
+            return [
+                {
+                    'job_id': job.job_id,
+                    'file_path': job.file_path,
+                    'status': job.status,
+                    'stage': job.current_stage,
+                    'progress': job.progress,
+                    'error': job.error
+                }
+                for job in self.jobs
+            ]
+
+    def set_progress(self, job, progress):
+        job.progress = progress
+        self._changed()
+
+    def _index_of(self, job_id):
+        for index, job in enumerate(self.jobs):
+            if job.job_id == job_id:
+                return index
+        return None
+
+    def _pick(self, resource):
+        """按队列顺序找出下一个可以在该资源上执行的任务阶段"""
+        if self._paused:
+            return None, None
+        for job in self.jobs:
+            if job.finished or job.running or job.cancelled:
+                continue
+            stage = self.stages[job.stage_index]
+            if stage.resource != resource:
+                continue
+            if stage.max_waiting is not None:
+                waiting = sum(1 for other in self.jobs
+                              if not other.finished and not other.running
+                              and other.stage_index == job.stage_index + 1)
+                if waiting >= stage.max_waiting:
+                    continue
+            return job, stage
+        return None, None
+
+    def _worker(self, resource):
+        while True:
+            with self._cond:
+                while True:
+                    job, stage = self._pick(resource)
+                    if job:
+                        break
+                    if all(j.finished for j in self.jobs):
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait()
+                job.running = True
+                job.status = STATUS_RUNNING
+                job.current_stage = stage.name
+                job.progress = 0
+                # 等待数减少，被max_waiting挡住的前序阶段可以继续
+                self._cond.notify_all()
+            self._changed()
+
+            try:
+                stage.func(job)
+                error = None
+            except JobCancelled:
+                error = None
+            except Exception as e:
+                error = e
+
+            with self._cond:
+                job.running = False
+                if job.cancelled:
+                    job.status = STATUS_CANCELLED
+                elif error is not None:
+                    job.status = STATUS_FAILED
+                    job.error = str(error)
+                    self.log(f"任务失败[{stage.name}] {job.file_path}: {error}")
+                else:
+                    job.stage_index += 1
+                    if job.stage_index >= len(self.stages):
+                        job.status = STATUS_DONE
+                        job.current_stage = ""
+                    else:
+                        job.status = STATUS_PENDING
+                finished = job.finished
+                self._cond.notify_all()
+            if finished:
+                self._finish(job)
+            self._changed()
+
+    def _finish(self, job):
+        if self.on_finish:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                self.log(f"任务清理失败 {job.file_path}: {e}")
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
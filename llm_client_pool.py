@@ -0,0 +1,64 @@
+import threading
+
+import httpx
+from openai import OpenAI
+
+
+class OpenAIClientPool:
+    """
+    OpenAI兼容客户端注册表
+    以(服务商, base_url, API密钥)为键复用客户端，同一服务商的所有请求共享一个keep-alive连接池，
+    不必每次调用都重新建立TLS连接；OpenAI客户端本身线程安全，翻译和总结线程可以共用
+    """
+
+    def __init__(self, timeout=300, connect_timeout=10, max_connections=20, max_keepalive_connections=10,
+                 max_retries=2):
+        self.timeout = timeout                  # 单次请求的读取超时(秒)
+        self.connect_timeout = connect_timeout  # 建立连接的超时(秒)
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.max_retries = max_retries          # SDK内部对连接错误等的自动重试次数
+        self._clients = {}
+        self._retired = []  # 被替换下来的旧客户端，可能仍有请求在途，程序关闭时再统一关闭
+        self._lock = threading.Lock()
+
+    def get(self, provider, base_url, api_key):
+        """
+        获取客户端，同一服务商换了密钥时新建客户端；
+        旧客户端上可能还有翻译请求在途(如翻译过程中验证新密钥)，只从注册表移除，不立即关闭
+        """
+        key = (provider, base_url, api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            for old_key in [k for k in self._clients if k[:2] == (provider, base_url)]:
+                self._retired.append(self._clients.pop(old_key))
+
+            http_client = httpx.Client(
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections
+                )
+            )
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                            max_retries=self.max_retries)
+            self._clients[key] = client
+            return client
+
+    def configure(self, **settings):
+        """修改超时和连接池参数，之后的请求按新参数新建客户端，已有客户端同样不打断在途请求"""
+        with self._lock:
+            for name, value in settings.items():
+                setattr(self, name, value)
+            self._retired.extend(self._clients.values())
+            self._clients.clear()
+
+    def close(self):
+        """关闭全部客户端(含被替换下来的)，只在没有请求在途时(如程序退出)调用"""
+        with self._lock:
+            for client in list(self._clients.values()) + self._retired:
+                client.close()
+            self._clients.clear()
+            self._retired.clear()
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# 不影响回复内容、只影响传输方式的请求参数，不计入指纹
+_TRANSPORT_KEYS = ("stream", "stream_options", "timeout")
+
+
+class ReplayMiss(Exception):
+    """回放模式下没有找到该请求的录制结果"""
+
+
+def usage_to_dict(usage):
+    """把SDK返回的usage对象转为可以保存的字典，没有用量信息时各项为0"""
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "total_tokens": getattr(usage, "total_tokens", 0) or 0
+    }
+
+
+class LLMReplayCache:
+    """
+    LLM请求的录制/回放
+    以(服务商, 模型, 消息, 参数)的哈希为指纹，每个请求的原始回复存为目录下的一个JSON文件；
+    record模式正常请求并保存回复，replay模式直接返回保存的回复，不发出网络请求，
+    用于调整时间轴重建、标点处理和输出格式后离线重跑，以及可重复的基准测试
+    """
+
+    MODES = ("off", "record", "replay")
+
+    def __init__(self, cache_dir, mode="off"):
+        if mode not in self.MODES:
+            raise ValueError(f"未知的录制/回放模式: {mode}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    @staticmethod
+    def fingerprint(provider, request):
+        payload = {key: value for key, value in request.items() if key not in _TRANSPORT_KEYS}
+        payload["provider"] = provider
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, fingerprint):
+        # 按指纹前两位分目录，避免单个目录下文件过多
+        return os.path.join(self.cache_dir, fingerprint[:2], f"{fingerprint}.json")
+
+    def load(self, fingerprint):
+        """返回录制的{response, usage, finish_reason}，没有录制时抛出ReplayMiss"""
+        try:
+            with open(self._path(fingerprint), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self.misses += 1
+            raise ReplayMiss(f"回放缓存中没有该请求的录制结果({fingerprint[:12]})，回放模式下不发出网络请求")
+        self.hits += 1
+        return record
+
+    def save(self, fingerprint, provider, request, response_text, usage, finish_reason):
+        """保存一次请求和原始回复，先写临时文件再替换，中断时不会留下半个文件"""
+        path = self._path(fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {
+            "provider": provider,
+            "request": {key: value for key, value in request.items() if key not in _TRANSPORT_KEYS},
+            "response": response_text,
+            "usage": usage,
+            "finish_reason": finish_reason,
+            "recorded_at": time.time()
+        }
+        temp_path = f"{path}.{threading.get_ident()}.tmp"  # 并发翻译时不同线程可能同时写入同一指纹
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
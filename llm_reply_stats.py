@@ -0,0 +1,53 @@
+import json
+import os
+import threading
+
+
+class LLMReplyStats:
+    """
+    按服务商/模型/回复格式(json_object或json_schema)累计的回复质量统计，保存为JSON文件，跨次运行累计
+    记录直接解析、修复后解析、部分恢复、无法恢复和截断的次数，以及因此发出的补充请求、
+    整批重试和拆分次数，用来比较哪些模型、哪种回复格式浪费的重试最多；
+    时间段总结的回复以summary-json_object/summary-json_schema为回复格式单独记录，不混入翻译的统计
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._stats = data
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def make_key(provider, model, mode):
+        return f"{provider}/{model}#{mode}"
+
+    def record(self, provider, model, mode, **counts):
+        """累加provider/model/mode的各项计数，如record("DeepSeek", "deepseek-chat", "json_object", replies=1, parsed=1)"""
+        counts = {name: value for name, value in counts.items() if value}
+        if not counts:
+            return
+        with self._lock:
+            entry = self._stats.setdefault(self.make_key(provider, model, mode), {})
+            for name, value in counts.items():
+                entry[name] = entry.get(name, 0) + value
+            self._save()
+
+    def get(self, provider, model, mode):
+        """返回provider/model/mode的累计计数，没有记录时为空字典"""
+        with self._lock:
+            return dict(self._stats.get(self.make_key(provider, model, mode), {}))
+
+    def _save(self):
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._stats, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass  # 统计只是参考，写入失败不影响翻译
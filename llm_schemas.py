@@ -0,0 +1,81 @@
+from openai import BadRequestError, NotFoundError, UnprocessableEntityError
+
+# 服务商明确表示不支持该回复格式时错误信息中的说法
+_UNSUPPORTED_PHRASES = ("not supported", "unsupported", "does not support", "unavailable", "not available")
+
+
+def _object(properties):
+    """strict模式要求列出全部字段且不允许额外字段"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+def _string_array():
+    return {"type": "array", "items": {"type": "string"}}
+
+
+def json_schema_format(name, schema):
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def translation_response_format(compact=False, glossary=False):
+    """
+    字幕翻译回复的json_schema：translatedSentences中每句为{sentence, relatedInputItems[{timestamp, text}]}，
+    紧凑协议下为{sentence, ids}；glossary为True时(逐批模式)附带[{source, target}]形式的术语表和滚动更新的剧情概要summary
+    """
+    if compact:
+        sentence = _object({
+            "sentence": {"type": "string"},
+            "ids": {"type": "array", "items": {"type": "integer"}}
+        })
+    else:
+        sentence = _object({
+            "sentence": {"type": "string"},
+            "relatedInputItems": {
+                "type": "array",
+                "items": _object({"timestamp": {"type": "string"}, "text": {"type": "string"}})
+            }
+        })
+    properties = {"translatedSentences": {"type": "array", "items": sentence}}
+    if glossary:
+        properties["glossary"] = {
+            "type": "array",
+            "items": _object({"source": {"type": "string"}, "target": {"type": "string"}})
+        }
+        properties["summary"] = {"type": "string"}
+    return json_schema_format("subtitle_translation", _object(properties))
+
+
+def summary_response_format():
+    """时间段总结回复的json_schema，字段与总结提示词中的格式一致"""
+    return json_schema_format("segment_summary", _object({
+        "segment_summary": {"type": "string"},
+        "start_time": {"type": "string"},
+        "end_time": {"type": "string"},
+        "topic_description": {"type": "string"},
+        "conversation_flow": {"type": "string"},
+        "speakers_analysis": {"type": "string"},
+        "key_points": _string_array(),
+        "emotional_tone": {"type": "string"}
+    }))
+
+
+def is_schema_unsupported(error):
+    """
+    服务商或模型明确不支持json_schema回复格式时返回True，
+    schema本身写错("Invalid schema ...")等其他参数错误不算，以免因为一次无关的报错关掉结构化输出
+    """
+    message = str(error).lower()
+    if isinstance(error, NotFoundError):
+        # OpenRouter：没有哪个上游端点支持请求中的参数(如response_format)
+        return "no endpoints found that can handle the requested parameters" in message
+    if not isinstance(error, (BadRequestError, UnprocessableEntityError)):
+        return False
+    if "invalid schema" in message:
+        return False
+    return (any(word in message for word in ("response_format", "json_schema"))
+            and any(phrase in message for phrase in _UNSUPPORTED_PHRASES))
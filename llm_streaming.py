@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+
+import httpx
+from openai import APITimeoutError
+
+
+class StreamStalled(Exception):
+    """流式响应超过规定时间没有收到新的token"""
+
+
+class SentenceStreamParser:
+    """
+    增量JSON解析器：逐段喂入流式返回的文本，translatedSentences数组中的每个对象一闭合就解析并返回，
+    不必等整个回复结束。只跟踪字符串/转义和括号层级，不校验其余语法；
+    单个对象解析失败时跳过，由完整回复的解析兜底
+    """
+
+    def __init__(self, array_key="translatedSentences", clean=None):
+        self.array_key = array_key
+        self.clean = clean          # 单个对象直接解析失败时的清理函数，如clean_json_string
+        self._text = ""
+        self._pos = 0
+        self._stack = []            # 当前所在的容器，'{'或'['
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None    # 最近闭合的字符串，遇到冒号时即为键名
+        self._last_key = None
+        self._array_depth = None    # 进入目标数组后，数组内部的层级
+        self._array_done = False
+        self._item_start = None
+
+    @property
+    def text(self):
+        """目前收到的完整文本"""
+        return self._text
+
+    def feed(self, chunk):
+        """喂入一段文本，返回本段中闭合的句子对象列表"""
+        self._text += chunk
+        text = self._text
+        completed = []
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ':':
+                self._last_key = self._last_string
+            elif c in '{[':
+                if (c == '[' and self._array_depth is None and not self._array_done
+                        and self._stack == ['{'] and self._last_key == self.array_key):
+                    self._array_depth = len(self._stack) + 1
+                elif c == '{' and self._array_depth is not None and len(self._stack) == self._array_depth:
+                    self._item_start = i
+                self._stack.append(c)
+            elif c in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if self._array_depth is None:
+                    continue
+                if c == '}' and self._item_start is not None and len(self._stack) == self._array_depth:
+                    item = self._parse_item(text[self._item_start:i + 1])
+                    if item is not None:
+                        completed.append(item)
+                    self._item_start = None
+                elif c == ']' and len(self._stack) < self._array_depth:
+                    self._array_depth = None
+                    self._array_done = True
+        self._pos = len(text)
+        return completed
+
+    def _parse_item(self, item_text):
+        item = _loads_object(item_text, self.clean)
+        return item if isinstance(item, dict) else None
+
+
+def _loads_object(item_text, clean=None):
+    """解析单个对象文本，合法的JSON直接解析，失败时才经clean清理后再试，仍失败返回None"""
+    try:
+        return json.loads(item_text)
+    except ValueError:
+        if not clean:
+            return None
+    try:
+        return json.loads(clean(item_text))
+    except ValueError:
+        return None
+
+
+def salvage_sentence_objects(text, clean=None, key="sentence"):
+    """
+    从截断或格式有误的回复中找出所有完整的句子对象，作为整体json.loads失败后的兜底：
+    从每个'{'开始单独跟踪字符串和括号层级直到对象闭合，直接解析失败时清理后再解析，含key键的对象即为句子；
+    不要求外层结构完整，某个对象里引号错乱也只丢失这一个对象，后面的对象从各自的'{'重新开始；按出现顺序返回
+    """
+    sentences = []
+    covered_until = -1      # 已恢复句子的结束位置，句子内部嵌套的对象不再单独尝试
+    start = text.find('{')
+    while start != -1:
+        if start > covered_until:
+            end = _find_object_end(text, start)
+            if end is not None:
+                item = _loads_object(text[start:end + 1], clean)
+                if isinstance(item, dict) and key in item:
+                    sentences.append(item)
+                    covered_until = end
+        start = text.find('{', start + 1)
+    return sentences
+
+
+def _find_object_end(text, start):
+    """返回从start处'{'开始的对象闭合'}'的位置，文本在闭合前结束时返回None"""
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in '{[':
+            depth += 1
+        elif c in '}]':
+            depth -= 1
+            if depth == 0:
+                return i if c == '}' else None
+    return None
+
+
+def stream_chat_completion(client, stall_timeout=60, connect_timeout=10, on_text=None, **request):
+    """
+    以流式方式调用chat.completions并拼接完整回复，返回(回复文本, usage, 结束原因)，服务商不返回用量时usage为None
+    on_text(text)在每段正文到达时调用；超过stall_timeout秒没有收到新token(含推理内容)时中止本次请求并抛出StreamStalled，
+    连接完全无数据由httpx读取超时发现，服务商只发保活注释不出token的情况由看门狗线程关闭响应
+    """
+    request.setdefault('stream_options', {"include_usage": True})
+    try:
+        stream = client.chat.completions.create(
+            stream=True,
+            timeout=httpx.Timeout(stall_timeout, connect=connect_timeout),
+            **request
+        )
+    except APITimeoutError as e:
+        raise StreamStalled(f"等待响应超过{stall_timeout}秒") from e
+
+    last_activity = [time.monotonic()]
+    done = threading.Event()
+    stalled = threading.Event()
+
+    def watchdog():
+        while not done.wait(min(1.0, stall_timeout / 4)):
+            if time.monotonic() - last_activity[0] > stall_timeout:
+                stalled.set()
+                stream.close()
+                return
+
+    threading.Thread(target=watchdog, daemon=True).start()
+
+    parts = []
+    usage = None
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            text = choice.delta.content if choice.delta else None
+            reasoning = getattr(choice.delta, 'reasoning_content', None) if choice.delta else None
+            if text or reasoning:
+                last_activity[0] = time.monotonic()
+            if text:
+                parts.append(text)
+                if on_text:
+                    on_text(text)
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    except (httpx.TimeoutException, APITimeoutError) as e:
+        raise StreamStalled(f"超过{stall_timeout}秒没有收到新的token") from e
+    except Exception:
+        if stalled.is_set():
+            raise StreamStalled(f"超过{stall_timeout}秒没有收到新的token")
+        raise
+    finally:
+        done.set()
+        stream.close()
+
+    if stalled.is_set():
+        raise StreamStalled(f"超过{stall_timeout}秒没有收到新的token")
+    return "".join(parts), usage, finish_reason
@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SAMPLING_RATE = 16000
+
+# 每个工作进程各自持有的模型
+_worker_model = None
+
+
+def split_audio_at_silence(audio, chunk_seconds, vad_parameters, min_chunks=1):
+    """
+    按VAD检测到的静音位置把音频切成若干块，返回[(起始采样点, 结束采样点), ...]
+    每块长度接近chunk_seconds，切点取目标位置附近最近的静音段中点，避免把一句话切断
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    total = len(audio)
+    num_chunks = max(int(np.ceil(total / (chunk_seconds * SAMPLING_RATE))), min_chunks, 1)
+    if num_chunks == 1:
+        return [(0, total)]
+
+    speech = get_speech_timestamps(audio, VadOptions(**vad_parameters))
+    # 候选切点：相邻两段语音之间静音的中点
+    candidates = [(prev['end'] + nxt['start']) // 2 for prev, nxt in zip(speech, speech[1:])]
+
+    cuts = []
+    last_cut = 0
+    for k in range(1, num_chunks):
+        target = total * k // num_chunks
+        valid = [c for c in candidates if c > last_cut]
+        cut = min(valid, key=lambda c: abs(c - target)) if valid else target
+        if cut <= last_cut or cut >= total:
+            continue
+        cuts.append(cut)
+        last_cut = cut
+
+    bounds = [0] + cuts + [total]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def build_worker_specs(workers, device, compute_type, cpu_threads, cuda_available):
+    """
+    生成工作进程配置：有GPU时第一个进程用GPU，其余作为CPU辅助进程(int8)；纯CPU时平分线程
+    """
+    use_gpu = device in ("cuda", "auto") and cuda_available
+    cpu_workers = workers - 1 if use_gpu else workers
+    threads_per_cpu_worker = cpu_threads or max((os.cpu_count() or 1) // max(cpu_workers, 1), 1)
+
+    specs = []
+    if use_gpu:
+        specs.append({'device': 'cuda', 'compute_type': compute_type, 'cpu_threads': cpu_threads})
+    for _ in range(cpu_workers):
+        specs.append({
+            'device': 'cpu',
+            'compute_type': 'int8' if use_gpu or compute_type == 'default' else compute_type,
+            'cpu_threads': threads_per_cpu_worker
+        })
+    return specs
+
+
+def _init_worker(model_path, device, compute_type, cpu_threads):
+    """工作进程初始化，加载本进程自己的模型"""
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(
+        model_size_or_path=model_path,
+        device=device,
+        compute_type=compute_type,
+        cpu_threads=cpu_threads
+    )
+
+
+def _transcribe_chunk(chunk_index, chunk_audio, offset_seconds, transcribe_options):
+    """在工作进程中转录一块音频，时间戳加上该块的全局偏移后返回"""
+    segments, _ = _worker_model.transcribe(audio=chunk_audio, **transcribe_options)
+    results = [
+        {
+            'start': s.start + offset_seconds,
+            'end': s.end + offset_seconds,
+            'text': s.text
+        }
+        for s in segments
+    ]
+    return chunk_index, results
+
+
+def transcribe_in_parallel(audio, model_path, worker_specs, transcribe_options, chunks, start_chunk=0,
+                           progress_callback=None, log=print, checkpoint=None):
+    """
+    把split_audio_at_silence切好的块交给多个各自持有模型的进程并发转录，逐块产出(块序号, 该块全局时间轴的段落列表)，
+    某块及其之前的块都完成后立即按块顺序产出，start_chunk之前的块视为已完成，不再转录
+    每种设备配置一个单进程池，块通过共享队列动态分配，GPU进程更快时自然会领到更多块
+    checkpoint在每块开始前调用，可在其中等待暂停或抛出异常取消，正在转录的块会先完成，
+    已完成的连续前缀全部产出后再抛出异常；调用方中途停止迭代时不再领取新块
+    """
+    log(f"音频已在静音处切分为{len(chunks)}块，由{len(worker_specs)}个进程并行转录")
+
+    pending = queue.Queue()
+    for index in range(start_chunk, len(chunks)):
+        pending.put((index, chunks[index]))
+
+    total_samples = len(audio)
+    chunk_results = {}
+    done_samples = chunks[start_chunk - 1][1] if start_chunk else 0
+    lock = threading.Lock()
+    errors = []
+    stopped = []  # checkpoint抛出的取消异常，原样抛给调用方
+    finished = queue.Queue()  # 工作线程每完成一块放入块序号，退出时放入None
+    abandoned = threading.Event()  # 调用方已停止迭代
+    context = multiprocessing.get_context("spawn")  # CUDA在fork出的子进程中无法使用
+
+    def run_worker(spec):
+        nonlocal done_samples
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker,
+                                     initargs=(model_path, spec['device'], spec['compute_type'],
+                                               spec['cpu_threads'])) as pool:
+                while not errors and not stopped and not abandoned.is_set():
+                    if checkpoint:
+                        try:
+                            checkpoint()
+                        except Exception as e:
+                            stopped.append(e)
+                            return
+                    try:
+                        index, (start, end) = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        _, results = pool.submit(_transcribe_chunk, index, audio[start:end],
+                                                 start / SAMPLING_RATE, transcribe_options).result()
+                    except Exception as e:
+                        errors.append(e)
+                        return
+                    with lock:
+                        chunk_results[index] = results
+                        done_samples += end - start
+                        if progress_callback:
+                            progress_callback(min(100, int(done_samples / total_samples * 100)))
+                    finished.put(index)
+        finally:
+            finished.put(None)
+
+    threads = [threading.Thread(target=run_worker, args=(spec,), daemon=True) for spec in worker_specs]
+    for t in threads:
+        t.start()
+
+    # 按块顺序产出，块内段落本身已是全局时间；后面的块先完成时先留在chunk_results中等前面的块
+    running = len(threads)
+    next_index = start_chunk
+    try:
+        while next_index < len(chunks):
+            with lock:
+                results = chunk_results.pop(next_index, None)
+            if results is not None:
+                yield next_index, results
+                next_index += 1
+            elif running:
+                if finished.get() is None:
+                    running -= 1
+            elif stopped:
+                raise stopped[0]
+            else:
+                raise Exception(f"并行转录失败: {errors[0] if errors else '工作进程提前退出'}")
+    finally:
+        abandoned.set()
+        for t in threads:
+            t.join()
@@ -0,0 +1,191 @@
+import email.utils
+import random
+import threading
+import time
+
+from openai import (APIConnectionError, APIStatusError, AuthenticationError, BadRequestError,
+                    NotFoundError, PermissionDeniedError, RateLimitError, UnprocessableEntityError)
+
+from llm_streaming import StreamStalled
+
+# 这些错误原样重试不会成功，直接失败
+NON_RETRYABLE_ERRORS = (AuthenticationError, PermissionDeniedError, BadRequestError,
+                        NotFoundError, UnprocessableEntityError)
+
+
+class TokenBucket:
+    """每分钟容量为per_minute的令牌桶，持续匀速补充；per_minute为0表示不限制"""
+
+    def __init__(self, per_minute=0):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """距离桶中够取amount还需要等待的秒数"""
+        if not self.per_minute:
+            return 0
+        amount = min(amount, self.per_minute)  # 超过容量的单次请求只要求桶满
+        return max(0.0, (amount - self.level) * 60 / self.per_minute)
+
+
+class ProviderRateLimiter:
+    """
+    单个服务商的限流器：请求数(RPM)和token数(TPM)两个令牌桶，
+    服务商返回Retry-After等提示时整个服务商暂停到提示的时间，翻译和总结线程一起遵守
+    """
+
+    def __init__(self, name, rpm=0, tpm=0):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, rpm, tpm):
+        with self._lock:
+            if self.requests.per_minute != rpm:
+                self.requests = TokenBucket(rpm)
+            if self.tokens.per_minute != tpm:
+                self.tokens = TokenBucket(tpm)
+
+    def acquire(self, estimated_tokens=0, sleep=time.sleep):
+        """等待直到可以发出一个预计消耗estimated_tokens的请求，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.requests.refill(now)
+                self.tokens.refill(now)
+                delay = max(self.blocked_until - now,
+                            self.requests.wait_time(1),
+                            self.tokens.wait_time(estimated_tokens))
+                if delay <= 0:
+                    if self.requests.per_minute:
+                        self.requests.level -= 1
+                    if self.tokens.per_minute:
+                        self.tokens.level -= min(estimated_tokens, self.tokens.per_minute)
+                    return waited
+            sleep(delay)
+            waited += delay
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """请求完成后按实际用量修正TPM桶"""
+        with self._lock:
+            if self.tokens.per_minute and actual_tokens:
+                self.tokens.level -= actual_tokens - min(estimated_tokens, self.tokens.per_minute)
+
+    def defer(self, seconds):
+        """服务商要求等待时，seconds秒内不再发出新请求"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def retry_after_seconds(error):
+    """从错误响应的retry-after-ms/retry-after头中读取服务商建议的等待秒数，没有时返回None"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return max(float(headers['retry-after-ms']) / 1000, 0.0)
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            retry_at = email.utils.parsedate_to_datetime(value)
+            return max(retry_at.timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """认证、权限、参数错误和额度用尽不重试；限流、超时、连接错误和5xx重试"""
+    if isinstance(error, NON_RETRYABLE_ERRORS):
+        return False
+    if isinstance(error, RateLimitError):
+        return getattr(error, 'code', None) != 'insufficient_quota'
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or error.status_code in (408, 409, 429)
+    return True
+
+
+class RateLimiterRegistry:
+    """
+    按服务商共享的限流器和统一的重试策略：失败后指数退避加随机抖动，
+    有Retry-After提示时按提示等待，不可重试的错误立即失败
+    """
+
+    def __init__(self, max_attempts=4, base_delay=2.0, max_delay=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider, rpm=0, tpm=0):
+        with self._lock:
+            limiter = self._limiters.get(provider)
+            if limiter is None:
+                limiter = self._limiters[provider] = ProviderRateLimiter(provider, rpm, tpm)
+            else:
+                limiter.configure(rpm, tpm)
+            return limiter
+
+    def backoff_delay(self, attempt):
+        """第attempt次失败后的等待时间，full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, provider, request, estimated_tokens=0, rpm=0, tpm=0, max_attempts=None,
+             describe=str, log=print, sleep=time.sleep):
+        """
+        通过限流器执行request()，request返回(结果, 实际token消耗)；
+        失败时按策略重试，最后一次失败或不可重试的错误原样抛出
+        """
+        limiter = self.get(provider, rpm, tpm)
+        max_attempts = max_attempts or self.max_attempts
+        for attempt in range(1, max_attempts + 1):
+            waited = limiter.acquire(estimated_tokens, sleep)
+            if waited >= 1:
+                log(f"{provider} 达到速率限制，等待了 {waited:.1f} 秒")
+            try:
+                result, used_tokens = request()
+            except Exception as e:
+                hint = retry_after_seconds(e)
+                if hint is not None:
+                    limiter.defer(hint)
+                if not is_retryable(e):
+                    log(f"{describe(e)}，该错误重试无效，不再重试")
+                    raise
+                if attempt == max_attempts:
+                    if max_attempts > 1:
+                        log(f"{describe(e)}，重试{max_attempts - 1}次后仍失败")
+                    raise
+                delay = hint if hint is not None else self.backoff_delay(attempt)
+                log(f"{describe(e)}，{delay:.1f}秒后重试...")
+                if hint is None:
+                    sleep(delay)  # 有提示时由limiter.acquire统一等待
+                continue
+            limiter.settle(estimated_tokens, used_tokens)
+            return result
+
+
+def describe_llm_error(error):
+    """把LLM调用异常转为中文日志描述"""
+    if isinstance(error, StreamStalled):
+        return f"流式响应停滞: {str(error)}"
+    if isinstance(error, AuthenticationError):
+        return f"身份验证失败: {str(error)}"
+    if isinstance(error, RateLimitError):
+        return f"请求频率限制: {str(error)}"
+    if isinstance(error, (APIStatusError, APIConnectionError)):
+        return f"API服务错误: {str(error)}"
+    return f"未知错误: {str(error)}"
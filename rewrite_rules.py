@@ -0,0 +1,181 @@
+import json
+import re
+
+# 译文标点处理的默认规则，与原先写死的str.replace链等价
+# 主程序原链中'？'先被替换为空格，其后的'？'→'吗'从不生效，这里不再列出
+_PUNCTUATION_RULES = [
+    {"pattern": "，", "replacement": " ", "regex": False},
+    {"pattern": "。", "replacement": " ", "regex": False},
+    {"pattern": "、", "replacement": " ", "regex": False},
+    {"pattern": "“", "replacement": "「", "regex": False},
+    {"pattern": "”", "replacement": "」", "regex": False},
+    {"pattern": "《", "replacement": "『", "regex": False},
+    {"pattern": "》", "replacement": "』", "regex": False},
+    {"pattern": "！", "replacement": " ", "regex": False},
+]
+GUI_DEFAULT_RULES = _PUNCTUATION_RULES + [
+    {"pattern": "？", "replacement": " ", "regex": False},
+]
+TRANSONLY_DEFAULT_RULES = _PUNCTUATION_RULES + [
+    {"pattern": "吗？", "replacement": "吗", "regex": False},
+    {"pattern": "？", "replacement": "吗", "regex": False},
+]
+
+_REGEX_PREFIX = "re:"
+_ARROW = "=>"
+_decoder = json.JSONDecoder()
+
+
+class RewriteRules:
+    """
+    译文改写规则(字面量或正则)，构建时编译一次，之后对每行文本只扫描一遍
+    从左到右扫描，同一位置按规则顺序取第一条能匹配的规则，替换结果不再参与匹配；
+    全部是单字符字面量时直接用str.translate，否则合并为一个正则的多选分支
+    """
+
+    def __init__(self, rules):
+        self.rules = [dict(rule) for rule in rules if rule.get("pattern")]
+        self._table = None
+        self._pattern = None
+        self._literals = {}   # 字面量 -> 替换文本
+        self._compiled = {}   # 分组名 -> (规则自身编译后的正则, 替换模板)
+        # 没有正则规则且模式和替换都不含换行时，批量改写可以把多行拼在一起扫描，之后按换行拆回各行
+        self._joinable = all(not rule.get("regex") and "\n" not in rule["pattern"] and "\n" not in rule["replacement"]
+                             for rule in self.rules)
+
+        if all(not rule.get("regex") and len(rule["pattern"]) == 1 for rule in self.rules):
+            table = {}
+            for rule in self.rules:
+                table.setdefault(rule["pattern"], rule["replacement"])
+            self._table = str.maketrans(table)
+            return
+
+        branches = []
+        for number, rule in enumerate(self.rules, 1):
+            if rule.get("regex"):
+                try:
+                    compiled = re.compile(rule["pattern"])
+                except re.error as e:
+                    raise ValueError(f"第{number}条规则的正则表达式无效: {rule['pattern']} ({e})")
+                group = f"_r{number}"
+                self._compiled[group] = (compiled, rule["replacement"])
+                # 模式内部的反向引用请使用命名组，合并后编号分组的序号会变化
+                branches.append(f"(?P<{group}>{rule['pattern']})")
+            elif rule["pattern"] not in self._literals:
+                self._literals[rule["pattern"]] = rule["replacement"]
+                branches.append(re.escape(rule["pattern"]))
+        try:
+            self._pattern = re.compile("|".join(branches))
+        except re.error as e:
+            raise ValueError(f"规则合并后无法编译: {e}")
+        self._replace = self._replace_literal if not self._compiled else self._replace_mixed
+
+    def _replace_literal(self, match):
+        return self._literals[match.group()]
+
+    def _replace_mixed(self, match):
+        group = match.lastgroup
+        if group is None:
+            return self._literals[match.group()]
+        compiled, replacement = self._compiled[group]
+        # 在原文的同一位置用规则自身的正则重新匹配，替换模板中的分组编号才对得上
+        return compiled.match(match.string, match.start()).expand(replacement)
+
+    def apply(self, text):
+        if self._table is not None:
+            return text.translate(self._table)
+        return self._pattern.sub(self._replace, text)
+
+    def apply_many(self, texts):
+        """批量改写多行文本；没有正则规则时拼成一个字符串只扫描一次"""
+        if not self.rules:
+            return list(texts)
+        if self._joinable:
+            return self.apply("\n".join(texts)).split("\n") if texts else []
+        return [self.apply(text) for text in texts]
+
+    def rewrite_ass_lines(self, lines, style=None):
+        """
+        改写ASS对话行的文本部分(第9个逗号之后)，时间轴和样式保持不变；
+        指定style时只改写该样式的行，格式不对的行原样保留
+        """
+        targets = []
+        texts = []
+        for i, line in enumerate(lines):
+            parts = line.split(',', 9)  # ASS格式有9个逗号分隔的字段
+            if len(parts) == 10 and (style is None or parts[3].strip() == style):
+                targets.append((i, ','.join(parts[:9])))
+                texts.append(parts[9])
+        result = list(lines)
+        for (i, metadata), text in zip(targets, self.apply_many(texts)):
+            result[i] = f"{metadata},{text}"
+        return result
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def _quote(text):
+    return json.dumps(text, ensure_ascii=False)
+
+
+def _format_side(text, pattern=False):
+    """首尾有空白、为空或可能被误解析的内容用JSON字符串的形式加引号"""
+    if (not text or text != text.strip() or text.startswith('"') or _ARROW in text
+            or (pattern and (text.startswith('#') or text.startswith(_REGEX_PREFIX)))):
+        return _quote(text)
+    return text
+
+
+def _parse_side(text, number):
+    if text.startswith('"'):
+        try:
+            value, end = _decoder.raw_decode(text)
+        except json.JSONDecodeError:
+            raise ValueError(f"第{number}行的引号不完整: {text}")
+        return value, text[end:].lstrip()
+    end = text.find(_ARROW)
+    if end < 0:
+        return text.strip(), ""
+    return text[:end].strip(), text[end:]
+
+
+def parse_rules(text):
+    """
+    解析编辑框中的规则：每行"模式 => 替换"，以re:开头的模式为正则表达式，#开头的行为注释；
+    首尾有空格或为空的内容用双引号括起(如 ， => " ")，替换为空表示删除
+    """
+    rules = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        regex = line.startswith(_REGEX_PREFIX)
+        if regex:
+            line = line[len(_REGEX_PREFIX):].lstrip()
+        pattern, rest = _parse_side(line, number)
+        if not rest.startswith(_ARROW):
+            raise ValueError(f"第{number}行缺少 => : {line}")
+        rest = rest[len(_ARROW):].strip()
+        if rest.startswith('"'):
+            replacement, tail = _parse_side(rest, number)
+            if tail:
+                raise ValueError(f"第{number}行的替换内容后有多余字符: {tail}")
+        else:
+            replacement = rest
+        if not pattern:
+            raise ValueError(f"第{number}行的模式为空")
+        if "\n" in replacement:
+            raise ValueError(f"第{number}行的替换内容含有换行，ASS字幕中换行请写作\\N")
+        rules.append({"pattern": pattern, "replacement": replacement, "regex": regex})
+    RewriteRules(rules)  # 提前检查正则能否编译
+    return rules
+
+
+def format_rules(rules):
+    """把规则列表转为编辑框中的文本，parse_rules(format_rules(rules))与原列表一致"""
+    lines = []
+    for rule in rules:
+        prefix = _REGEX_PREFIX if rule.get("regex") else ""
+        lines.append(f"{prefix}{_format_side(rule['pattern'], pattern=True)} => {_format_side(rule['replacement'])}")
+    return "\n".join(lines)
@@ -0,0 +1,35 @@
+import re
+
+# 汉字、假名、谚文和全角符号大致每字一个token，其余文本大致每4个字符一个token
+_WIDE_CHARS = re.compile(r'[　-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]')
+
+
+def estimate_tokens(text):
+    """不依赖分词器的token粗略估算，只用于批次划分和预算调校，偏保守"""
+    if not text:
+        return 0
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def iter_budget_batches(lines, max_lines, token_budget, line_tokens):
+    """
+    按token预算划分批次：累计的line_tokens(line)超过token_budget或行数达到max_lines时产出一批，
+    单行超过预算时单独成批；lines可以是逐行产生的迭代器(流水线模式)，token_budget为0时只按行数划分
+    """
+    batch = []
+    batch_tokens = 0
+    for line in lines:
+        tokens = line_tokens(line)
+        if batch and token_budget and batch_tokens + tokens > token_budget:
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(line)
+        batch_tokens += tokens
+        if len(batch) >= max_lines:
+            yield batch
+            batch = []
+            batch_tokens = 0
+    if batch:
+        yield batch
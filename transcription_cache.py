@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class TranscriptionCache:
+    """
+    按内容寻址的听写结果缓存
+    键为解码后音频数据的哈希加上模型路径、转录参数(语言/beam/VAD)和推理方式，值为原始段落列表，
+    同一份音频重复听写时直接用缓存段落重建字幕；总大小超过上限时按最近使用时间淘汰
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes  # 缓存总大小上限，0表示不限制
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(audio, model_path, transcribe_options, decoding_mode=None):
+        """由PCM数据和影响结果的参数(含批量推理/分块并行等推理方式)生成缓存键"""
+        hasher = hashlib.blake2b(digest_size=32)
+        hasher.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+        params = {
+            'samples': len(audio),
+            'model': os.path.abspath(model_path) if model_path else '',
+            'transcribe': transcribe_options,
+            'mode': decoding_mode or {}
+        }
+        hasher.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def get(self, key):
+        """返回缓存的段落列表，未命中返回None；命中时刷新最近使用时间"""
+        path = self._entry_path(key)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    segments = json.load(f)['segments']
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+            os.utime(path)
+            self.hits += 1
+            return segments
+
+    def put(self, key, segments):
+        """写入一条缓存，先写临时文件再替换，避免中途退出留下损坏的条目"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._entry_path(key)
+        tmp_path = path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'segments': [
+                    {'start': seg['start'], 'end': seg['end'], 'text': seg['text']} for seg in segments
+                ]}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._enforce_limit(keep=path)
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                os.remove(path)
+
+    def stats(self):
+        """返回本次运行的命中/未命中次数，以及磁盘上的条目数和总大小"""
+        with self._lock:
+            entries = self._entries()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes
+            }
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _entries(self):
+        """[(路径, 大小, 最近使用时间), ...]，按最近使用时间从旧到新排序"""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def _enforce_limit(self, keep):
+        """总大小超过上限时从最久未使用的条目开始删除，刚写入的条目保留"""
+        if not self.max_bytes:
+            return
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
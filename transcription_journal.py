@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import time
+
+
+class TranscriptionJournal:
+    """
+    听写任务的断点续传日志(JSON Lines)
+    记录已完成的预处理产物和已产出的转录段落，键为输入文件+模型+转录参数+推理方式，
+    参数变化时旧日志自动作废；程序中途退出后重新开始同一任务可从最后完成的解码窗口继续
+    续传保证：音频在静音处切成固定的解码窗口，各窗口从零上下文独立解码，每个窗口的段落全部提交后
+    再写一条窗口记录作为高水位；续传时只保留高水位之前的段落，未完成窗口中已提交的段落丢弃后
+    从该窗口开头重新解码，因此续传后的字幕与一次跑完时逐字节一致
+    """
+
+    def __init__(self, journal_path, job_key):
+        self.journal_path = journal_path
+        self.job_key = job_key
+        self.artifacts = {}   # 阶段名 -> 产物文件路径
+        self.segments = []    # 已提交的转录段落
+        self.completed_windows = 0  # 已完整提交的解码窗口数(高水位)
+        self.done = False
+        self._file = None
+        self._last_sync = 0
+
+    @staticmethod
+    def make_job_key(file_path, model_options, transcribe_options, decoding_mode=None):
+        """由输入文件(路径/大小/修改时间)、模型参数、转录参数和推理方式(批量/并行/内存直读)生成任务键"""
+        stat = os.stat(file_path)
+        payload = {
+            'file': os.path.abspath(file_path),
+            'size': stat.st_size,
+            'mtime': int(stat.st_mtime),
+            'model': model_options,
+            'transcribe': transcribe_options,
+            'mode': decoding_mode or {}
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def open(self):
+        """加载同一任务的已有日志，任务键不一致或日志损坏时重新开始，返回是否为续传"""
+        resumed = False
+        if os.path.exists(self.journal_path):
+            resumed = self._load()
+        if not resumed:
+            self.artifacts = {}
+            self.segments = []
+            self.completed_windows = 0
+            self.done = False
+
+        # 重写一遍有效记录，丢弃中断时可能残留的半行；先写临时文件再替换，重写途中退出不会丢失已提交的记录
+        temp_path = self.journal_path + '.tmp'
+        self._file = open(temp_path, 'w', encoding='utf-8')
+        self._write({'type': 'header', 'key': self.job_key})
+        for stage, path in self.artifacts.items():
+            self._write({'type': 'artifact', 'stage': stage, 'path': path})
+        for segment in self.segments:
+            self._write({'type': 'segment', 'start': segment['start'], 'end': segment['end'], 'text': segment['text']})
+        if self.completed_windows:
+            self._write({'type': 'window', 'count': self.completed_windows})
+        if self.done:
+            self._write({'type': 'done'})
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(temp_path, self.journal_path)
+        # 之后追加写入
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        return resumed
+
+    def _load(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return False
+        if not lines:
+            return False
+
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            return False
+        if header.get('type') != 'header' or header.get('key') != self.job_key:
+            return False
+
+        pending = []  # 最后一条窗口记录之后的段落，所在窗口未完成
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 最后一行可能在写入时被中断，之后的内容都不可信
+                break
+            if record['type'] == 'artifact':
+                self.artifacts[record['stage']] = record['path']
+            elif record['type'] == 'segment':
+                pending.append({'start': record['start'], 'end': record['end'], 'text': record['text']})
+            elif record['type'] == 'window':
+                self.segments.extend(pending)
+                pending = []
+                self.completed_windows = record['count']
+            elif record['type'] == 'done':
+                self.done = True
+        return True
+
+    def get_artifact(self, stage):
+        """返回已完成阶段的产物路径，文件已不存在时视为未完成"""
+        path = self.artifacts.get(stage)
+        if path and os.path.exists(path):
+            return path
+        return None
+
+    def commit_artifact(self, stage, path):
+        """记录一个已完成的预处理阶段"""
+        self.artifacts[stage] = path
+        self._write({'type': 'artifact', 'stage': stage, 'path': path}, sync=True)
+
+    def commit_segment(self, segment):
+        """提交一段转录结果"""
+        self.segments.append(segment)
+        self._write({'type': 'segment', 'start': segment['start'], 'end': segment['end'], 'text': segment['text']})
+
+    def commit_window(self, index):
+        """第index个解码窗口的段落已全部提交，推进高水位"""
+        self.completed_windows = index + 1
+        self._write({'type': 'window', 'count': self.completed_windows}, sync=True)
+
+    def mark_done(self):
+        self.done = True
+        self._write({'type': 'done'}, sync=True)
+
+    def close(self, remove=False):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def _write(self, record, sync=False):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        # 每条记录都刷到系统缓冲区，程序崩溃不丢；定期fsync防止断电丢失
+        if sync or time.time() - self._last_sync >= 5:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.time()
@@ -0,0 +1,91 @@
+import json
+
+
+class TranslationHistory:
+    """
+    逐批翻译的对话历史：只原样保留最近一轮(本批原文和AI回复)，更早的轮次折叠成术语表和剧情概要。
+    术语表取自AI回复中的glossary字段(原文 -> 译文)，随提示词发送以保持人名和术语译法一致；
+    概要取自AI回复中的summary字段，AI每批在上一版概要的基础上滚动更新，只保留最新一版；
+    历史总token数受预算限制，超出时先丢弃最久没有再出现的术语，仍超出再去掉最近一轮的原文和回复，最后去掉概要
+    """
+
+    def __init__(self, token_budget=4000, estimate=len, max_terms=300):
+        self.token_budget = token_budget  # 0表示不限制
+        self.estimate = estimate          # estimate(text)返回token估算值
+        self.max_terms = max_terms
+        self.glossary = {}
+        self.summary = ""
+        self.recent = []
+
+    def add_exchange(self, user_content, assistant_content):
+        """登记一轮翻译：回复中的术语并入术语表，概要替换为回复中的新概要，最近一轮替换为本轮"""
+        parsed = self._parse(assistant_content)
+        summary = parsed.get('summary') if isinstance(parsed, dict) else None
+        if isinstance(summary, str) and summary.strip():
+            self.summary = summary.strip()
+        for source, target in self._extract_glossary(parsed).items():
+            # 再次出现的术语移到末尾，淘汰时最后被丢弃
+            self.glossary.pop(source, None)
+            self.glossary[source] = target
+        while len(self.glossary) > self.max_terms:
+            self.glossary.pop(next(iter(self.glossary)))
+        self.recent = [
+            {"role": "user", "content": user_content},
+            {"role": "assistant", "content": assistant_content}
+        ]
+        self._enforce_budget()
+
+    def messages(self):
+        """需要原样放在本批请求之前的历史消息"""
+        return list(self.recent)
+
+    def glossary_prompt(self):
+        """附加在系统提示词后的术语表，没有术语时为空字符串"""
+        if not self.glossary:
+            return ""
+        terms = "\n".join(f"{source} → {target}" for source, target in self.glossary.items())
+        return f"\n\n**前文已确定的人名和术语译法，请保持一致：**\n{terms}"
+
+    def summary_prompt(self):
+        """附加在系统提示词后的前文概要，没有概要时为空字符串"""
+        if not self.summary:
+            return ""
+        return f"\n\n**前文剧情概要：**\n{self.summary}"
+
+    def token_count(self):
+        return (self.estimate(self.summary_prompt()) + self.estimate(self.glossary_prompt())
+                + sum(self.estimate(message['content']) for message in self.recent))
+
+    def _enforce_budget(self):
+        if not self.token_budget:
+            return
+        while self.glossary and self.token_count() > self.token_budget:
+            self.glossary.pop(next(iter(self.glossary)))
+        # 最近一轮本身超出预算时先去掉原文，仍超出则不带历史
+        if self.token_count() > self.token_budget and len(self.recent) == 2:
+            self.recent = self.recent[1:]
+        if self.token_count() > self.token_budget:
+            self.recent = []
+        if self.token_count() > self.token_budget:
+            self.summary = ""
+
+    @staticmethod
+    def _parse(assistant_content):
+        try:
+            return json.loads(assistant_content) if isinstance(assistant_content, str) else assistant_content
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _extract_glossary(parsed):
+        glossary = parsed.get('glossary') if isinstance(parsed, dict) else None
+        if isinstance(glossary, dict):
+            return {str(k).strip(): str(v).strip() for k, v in glossary.items() if str(k).strip() and str(v).strip()}
+        if isinstance(glossary, list):
+            # 兼容[{"source": "...", "target": "..."}]形式
+            return {
+                str(item.get('source', '')).strip(): str(item.get('target', '')).strip()
+                for item in glossary
+                if isinstance(item, dict) and str(item.get('source', '')).strip() and str(item.get('target', '')).strip()
+            }
+        return {}
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+
+
+class TranslationJournal:
+    """
+    翻译任务的断点续传日志(JSON Lines)
+    每完成一批就提交该批处理后的ASS行和翻译日志，键为字幕内容+服务商/模型+提示词哈希，
+    批次以其原文行的哈希标识，批次划分变化时只有边界相同的批次能复用；
+    重试后仍失败的批次也记录下来，重新开始时只请求缺失和失败的批次
+    """
+
+    def __init__(self, journal_path, job_key):
+        self.journal_path = journal_path
+        self.job_key = job_key
+        self.batches = {}  # 批次键 -> {'index', 'lines', 'log'}
+        self.failed = {}   # 批次键 -> 批次序号
+        self._file = None
+
+    @staticmethod
+    def make_job_key(dialogue_lines, provider, model, system_prompt, options=None):
+        """由字幕内容、服务商、模型、提示词和影响译文格式的选项生成任务键"""
+        hasher = hashlib.sha256()
+        for line in dialogue_lines:
+            hasher.update(line.rstrip('\r\n').encode('utf-8'))
+            hasher.update(b'\n')
+        payload = {
+            'subtitle': hasher.hexdigest(),
+            'provider': provider,
+            'model': model,
+            'prompt': hashlib.sha256((system_prompt or '').encode('utf-8')).hexdigest(),
+            'options': options or {}
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_batch_key(batch_lines):
+        hasher = hashlib.sha256()
+        for line in batch_lines:
+            hasher.update(line.rstrip('\r\n').encode('utf-8'))
+            hasher.update(b'\n')
+        return hasher.hexdigest()[:32]
+
+    def open(self):
+        """加载同一任务的已有日志，任务键不一致或日志损坏时重新开始，返回是否为续传"""
+        resumed = False
+        if os.path.exists(self.journal_path):
+            resumed = self._load()
+        if not resumed:
+            self.batches = {}
+            self.failed = {}
+
+        # 重写一遍有效记录，丢弃中断时可能残留的半行；先写临时文件再替换，重写途中退出不会丢失已提交的批次
+        temp_path = self.journal_path + '.tmp'
+        self._file = open(temp_path, 'w', encoding='utf-8')
+        self._write({'type': 'header', 'key': self.job_key})
+        for batch_key, record in self.batches.items():
+            self._write({'type': 'batch', 'batch': batch_key, **record})
+        for batch_key, index in self.failed.items():
+            self._write({'type': 'failed', 'batch': batch_key, 'index': index})
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(temp_path, self.journal_path)
+        # 之后追加写入
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+        return resumed
+
+    def _load(self):
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            return False
+        if not lines:
+            return False
+
+        try:
+            header = json.loads(lines[0])
+        except json.JSONDecodeError:
+            return False
+        if header.get('type') != 'header' or header.get('key') != self.job_key:
+            return False
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 最后一行可能在写入时被中断，之后的内容都不可信
+                break
+            if record['type'] == 'batch':
+                self.batches[record['batch']] = {'index': record['index'], 'lines': record['lines'], 'log': record['log']}
+                self.failed.pop(record['batch'], None)
+            elif record['type'] == 'failed':
+                self.failed[record['batch']] = record['index']
+        return True
+
+    def get_batch(self, batch_key):
+        """返回已完成批次的记录，未完成返回None"""
+        return self.batches.get(batch_key)
+
+    def commit_batch(self, batch_key, index, lines, log_lines):
+        """提交一个已完成的批次"""
+        record = {'index': index, 'lines': lines, 'log': log_lines}
+        self.batches[batch_key] = record
+        self.failed.pop(batch_key, None)
+        self._write({'type': 'batch', 'batch': batch_key, **record}, sync=True)
+
+    def commit_failed(self, batch_key, index):
+        """记录一个重试后仍失败的批次"""
+        self.failed[batch_key] = index
+        self._write({'type': 'failed', 'batch': batch_key, 'index': index}, sync=True)
+
+    def close(self, remove=False):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def _write(self, record, sync=False):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
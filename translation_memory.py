@@ -0,0 +1,138 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+class TranslationMemory:
+    """
+    本地翻译记忆(SQLite)
+    以(预设, 服务商, 模型, 提示词哈希, 规范化原文)为键保存单行字幕的译文，
+    重复出现的台词(片头、口头禅、赞助商口播、うん/そうそう之类的短反应)直接复用，不再发给AI；
+    不同预设互不共享，条目数超过上限时按最近使用时间淘汰
+    """
+
+    def __init__(self, db_path, max_entries=50000):
+        self.db_path = db_path
+        self.max_entries = max_entries  # 条目数上限，0表示不限制
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory ("
+            "preset TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL, prompt_hash TEXT NOT NULL, "
+            "source TEXT NOT NULL, translation TEXT NOT NULL, "
+            "use_count INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL, "
+            "PRIMARY KEY (preset, provider, model, prompt_hash, source))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_scope(preset, provider, model, system_prompt):
+        """同一作用域内的译文才能互相复用，提示词改动后旧译文自动失效"""
+        prompt_hash = hashlib.blake2b((system_prompt or "").encode('utf-8'), digest_size=16).hexdigest()
+        return (preset or "", provider or "", model or "", prompt_hash)
+
+    @staticmethod
+    def normalize(text):
+        """全半角统一、合并空白，去掉ASS换行和特效标签"""
+        text = re.sub(r'\{[^}]*\}', '', text).replace('\\N', ' ').replace('\\n', ' ')
+        text = unicodedata.normalize('NFKC', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    def lookup(self, scope, texts):
+        """返回{原文: 译文}，只包含命中的原文；命中的条目刷新最近使用时间"""
+        sources = {self.normalize(text): text for text in texts if self.normalize(text)}
+        if not sources:
+            return {}
+        found = {}
+        with self._lock:
+            keys = list(sources)
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT source, translation FROM memory "
+                    f"WHERE preset=? AND provider=? AND model=? AND prompt_hash=? "
+                    f"AND source IN ({','.join('?' * len(chunk))})",
+                    (*scope, *chunk)
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE memory SET use_count=use_count+1, last_used=? "
+                    "WHERE preset=? AND provider=? AND model=? AND prompt_hash=? AND source=?",
+                    [(time.time(), *scope, source) for source in found]
+                )
+                self._conn.commit()
+            hit_count = sum(1 for text in texts if self.normalize(text) in found)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+        return {text: found[self.normalize(text)] for text in texts if self.normalize(text) in found}
+
+    def store(self, scope, pairs):
+        """写入[(原文, 译文), ...]，同一原文以最新译文为准"""
+        now = time.time()
+        rows = [(*scope, self.normalize(source), translation, now)
+                for source, translation in pairs if self.normalize(source) and translation]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO memory (preset, provider, model, prompt_hash, source, translation, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (preset, provider, model, prompt_hash, source) "
+                "DO UPDATE SET translation=excluded.translation, last_used=excluded.last_used",
+                rows
+            )
+            self._enforce_limit()
+            self._conn.commit()
+
+    def clear(self, preset=None):
+        """清空全部记忆，传入preset时只清空该预设"""
+        with self._lock:
+            if preset is None:
+                self._conn.execute("DELETE FROM memory")
+            else:
+                self._conn.execute("DELETE FROM memory WHERE preset=?", (preset,))
+            self._conn.commit()
+
+    def rename_preset(self, old_name, new_name):
+        """预设改名时把该预设的记忆一并改名，新名称下已有的同键条目被覆盖"""
+        with self._lock:
+            self._conn.execute("UPDATE OR REPLACE memory SET preset=? WHERE preset=?", (new_name, old_name))
+            self._conn.commit()
+
+    def stats(self, preset=None):
+        """返回本次运行的命中/未命中行数，以及总条目数和指定预设的条目数"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+            preset_entries = self._conn.execute(
+                "SELECT COUNT(*) FROM memory WHERE preset=?", (preset or "",)
+            ).fetchone()[0]
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'preset_entries': preset_entries,
+                'max_entries': self.max_entries
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _enforce_limit(self):
+        """条目数超过上限时删除最久未使用的条目"""
+        if not self.max_entries:
+            return
+        count = self._conn.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self._conn.execute(
+            "DELETE FROM memory WHERE rowid IN (SELECT rowid FROM memory ORDER BY last_used LIMIT ?)",
+            (count - self.max_entries,)
+        )
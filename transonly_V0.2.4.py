@@ -10,10 +10,15 @@ from faster_whisper import WhisperModel
 from tqdm import tqdm
 import ffmpeg
 import json
-import time
 from crypto_utils import CryptoUtils
+from llm_client_pool import OpenAIClientPool
+from llm_streaming import stream_chat_completion
+from rate_limiter import RateLimiterRegistry, describe_llm_error
+from llm_replay import LLMReplayCache, ReplayMiss, usage_to_dict
+from token_budget import estimate_tokens
+from rewrite_rules import RewriteRules, TRANSONLY_DEFAULT_RULES
 import re
-from openai import OpenAI, AuthenticationError, RateLimitError, APIError
+from openai import AuthenticationError, RateLimitError
 import requests
 from datetime import timedelta
 import ctypes
@@ -84,30 +89,51 @@ class TranslationApp:
                 "api_url": "https://api.deepseek.com",
                 "valid_url": "https://api.deepseek.com/v1",
                 "model_options": ["deepseek-chat", "deepseek-reasoner"],
-                "is_available_url": "https://api.deepseek.com/user/balance"
+                "is_available_url": "https://api.deepseek.com/user/balance",
+                "rpm": 0,  # 每分钟请求数上限，0表示不限制
+                "tpm": 0   # 每分钟token数上限，0表示不限制
             },
             "Genimi": {
                 "api_url": "https://generativelanguage.googleapis.com/v1beta/openai/", 
                 "valid_url": "https://generativelanguage.googleapis.com/v1beta/openai/",               
-                "model_options": ["gemini-2.5-pro","gemini-2.5-flash"]                
+                "model_options": ["gemini-2.5-pro","gemini-2.5-flash"],
+                "rpm": 0,
+                "tpm": 0
             },
             "OpenAI": {
                 "api_url": "https://api.openai.com",
                 "valid_url": "https://api.openai.com/models",
                 "model_options": ["gpt-5", "gpt-4.1"],
-                "is_available_url": "https://api.openai.com/dashboard/billing/credit_grants"
+                "is_available_url": "https://api.openai.com/dashboard/billing/credit_grants",
+                "rpm": 0,
+                "tpm": 0
             },
             "OpenRouter": {
                 "api_url": "https://openrouter.ai/api/v1",
                 "valid_url": "https://openrouter.ai/api/v1",
                 "model_options": ["gpt-4o", "gpt-5", "gpt-4.1", "gpt-4.1-mini", "gpt-4o-mini", "gemini-2.5-flash", "gemini-2.5-pro"],
-                "is_available_url": "https://openrouter.ai/api/v1/credits"
+                "is_available_url": "https://openrouter.ai/api/v1/credits",
+                "rpm": 0,
+                "tpm": 0
             }            
         }
         
         # 加密工具
         self.crypto = CryptoUtils()
 
+        # LLM客户端连接池参数（仅配置文件）
+        self.llm_timeout = 300  # 单次请求读取超时(秒)
+        self.llm_connect_timeout = 10
+        self.llm_max_connections = 20
+        self.llm_max_keepalive = 10
+        self.streaming_response = False  # 流式接收AI回复，及早发现停滞的请求
+        self.llm_stall_timeout = 60  # 流式模式下超过该秒数没有新token则中止重试
+        # LLM请求录制/回放：off不启用，record保存每个请求的原始回复，replay只用保存的回复离线重跑
+        self.llm_replay_mode = "off"
+        self.llm_replay_dir = "llm_replay"
+        # 预设名 -> 译文改写规则[{pattern, replacement, regex}]，没有设置的预设使用默认的标点处理（仅配置文件）
+        self.rewrite_rules = {}
+
         # 创建选项卡
         self.create_notebook()  
                
@@ -117,6 +143,26 @@ class TranslationApp:
 
         # 加载配置
         self.load_config() 
+
+        # 按服务商复用的LLM客户端，翻译和总结线程共享连接池；重试统一由限流器负责，SDK内部不再重试
+        self.llm_clients = OpenAIClientPool(
+            timeout=self.llm_timeout,
+            connect_timeout=self.llm_connect_timeout,
+            max_connections=self.llm_max_connections,
+            max_keepalive_connections=self.llm_max_keepalive,
+            max_retries=0
+        )
+        # 按服务商共享的RPM/TPM限流器，所有LLM请求经call_llm发出
+        self.rate_limits = RateLimiterRegistry()
+        try:
+            self.llm_replay = LLMReplayCache(self.llm_replay_dir, self.llm_replay_mode)
+        except ValueError as e:
+            self.log(f"{str(e)}，可选值为 off/record/replay，已按off处理")
+            self.llm_replay = LLMReplayCache(self.llm_replay_dir)
+        if self.llm_replay.recording:
+            self.log(f"LLM录制模式已启用，每个请求的原始回复保存到 {self.llm_replay_dir}")
+        elif self.llm_replay.replaying:
+            self.log(f"LLM回放模式已启用，翻译和总结只使用 {self.llm_replay_dir} 中录制的回复，不发出网络请求")
         self.update_preset_menu()   
         self.update_provider_menu()
         self.update_model_menu()        
@@ -468,6 +514,10 @@ class TranslationApp:
 
             total_token_usage = 0 
 
+            # 改写规则只编译一次，之后每批直接套用；配置为空列表表示不做任何改写
+            rewriter = RewriteRules(self.rewrite_rules[self.current_preset] if self.current_preset in self.rewrite_rules
+                                    else TRANSONLY_DEFAULT_RULES)
+
             for batch_num in range(total_batches):
                 start_idx = batch_num * batch_size
                 end_idx = min((batch_num + 1) * batch_size, len(dialogue_lines))
@@ -485,27 +535,9 @@ class TranslationApp:
                 # 重建ASS字幕行            
                 current_batch_lines, translation_line = self.reconstruct_ass_from_response(translated_batch, context) 
 
-                processed_lines = []            
-                translated_lines = []
+                # 对文本部分套用改写规则，时间轴和样式不变，格式不对的行保持原样
                 translated_lines = [str(line).strip() for line in current_batch_lines if str(line).strip()]
-                for line in translated_lines:
-                    if line.strip():
-                        # 分离时间轴部分和文本部分
-                        parts = line.split(',', 9)  # ASS格式有9个逗号分隔的字段
-                        if len(parts) == 10:
-                            # 前9部分是时间轴和样式信息，第10部分是文本
-                            metadata = ','.join(parts[:9])
-                            text_content = parts[9]
-                            
-                            # 对文本部分进行标点符号替换
-                            processed_text = text_content.replace('，', ' ').replace('。', ' ').replace('、', ' ').replace('“', '「').replace('”', '」').replace('《', '『').replace('》', '』').replace('！', ' ').replace('吗？', '吗').replace('？', '吗')
-                            
-                            # 重新组合成完整的ASS行
-                            processed_line = f"{metadata},{processed_text}"
-                            processed_lines.append(processed_line)
-                        else:
-                            # 如果格式不对，保持原样
-                            processed_lines.append(line)
+                processed_lines = rewriter.rewrite_ass_lines(translated_lines)
 
                 with open(output_file_readytogo, 'a', encoding='utf-8') as f:
                     f.write('\n'.join(processed_lines))
@@ -533,6 +565,8 @@ class TranslationApp:
 
     def ask_is_available(self):
         """查询当前API密钥余额状态"""
+        if self.llm_replay.replaying:
+            return "回放模式未查询"
         try:
             selected_provider = self.provider_var.get()
             provider_config = self.providers.get(selected_provider, self.providers["DeepSeek"])
@@ -619,10 +653,7 @@ class TranslationApp:
         return cleaned_string
 
     def call_ai_translation_api(self, content):
-        """调用AI翻译API，包含重试机制"""
-        max_retries = 3
-        retry_delay = 5  # 秒
-
+        """调用AI翻译API，经服务商限流器发出，失败时按错误类型退避重试"""
         self.max_history = 10
         self.conversation_history = []           
         # 获取当前服务商配置
@@ -640,82 +671,87 @@ class TranslationApp:
         else:
             ai_model = self.ai_model
 
-        for attempt in range(max_retries):
-            # 全都用OpenAI SDK库调用            
+        # 全都用OpenAI SDK库调用            
+        client = self.llm_clients.get(selected_provider, api_url, self.current_api_key)
+        if self.conversation_history:
+            # 构建包含历史的消息列表
+            messages = [{"role": "system", "content": self.system_prompt}]
+            # 添加历史消息
+            messages.extend(self.conversation_history)
+            # 添加当前用户消息
+            messages.append({"role": "user", "content": content})
+        else:
+            messages = [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": content}            
+            ] 
+        request = {
+            "model": ai_model,
+            "messages": messages,
+            # "reasoning_effort": "medium",
+            # "tools": translate_tool,
+            "response_format": {"type": "json_object"},
+            "temperature": self.temperature
+        }
+        if "gemini" not in self.ai_model:
+            request["max_tokens"] = 8192
+
+        # 译文和回填的原文大致与本批原文等长，预计用量按提示加一份本批原文估算
+        estimated_tokens = sum(estimate_tokens(message['content']) for message in messages) + estimate_tokens(content)
+        try:
+            response_text, usage, _ = self.request_llm(selected_provider, client, request, estimated_tokens)
+        except Exception:
+            return None, 0
+        cleaned_string, total_tokens = self.clean_json_string(response_text), usage["total_tokens"]
+        # 记录回复到对话历史                
+        self.add_to_conversation_history("assistant", cleaned_string)               
+        return cleaned_string, total_tokens
+
+    def request_llm(self, provider, client, request, estimated_tokens=0, log=None):
+        """
+        发出一次对话补全请求，返回(回复文本, token用量字典, finish_reason)
+        录制模式下保存原始回复，回放模式下直接返回录制的回复，不经过限流器也不发出网络请求
+        """
+        log = log or self.log
+        fingerprint = LLMReplayCache.fingerprint(provider, request)
+        if self.llm_replay.replaying:
             try:
-                client = OpenAI(api_key=self.current_api_key, base_url=api_url)
-                if self.conversation_history:
-                    # 构建包含历史的消息列表
-                    messages = [{"role": "system", "content": self.system_prompt}]
-                    # 添加历史消息
-                    messages.extend(self.conversation_history)
-                    # 添加当前用户消息
-                    messages.append({"role": "user", "content": content})
-                else:
-                    messages = [
-                            {"role": "system", "content": self.system_prompt},
-                            {"role": "user", "content": content}            
-                    ] 
-                if "gemini" in self.ai_model:
-                    response = client.chat.completions.create(
-                        model=ai_model,
-                        messages=messages, 
-                        # reasoning_effort="medium",                      
-                        # tools=translate_tool, 
-                        response_format={"type": "json_object"},                    
-                        temperature=self.temperature,                        
-                        stream=False
-                    ) 
-                else:
-                    response = client.chat.completions.create(
-                        model=ai_model,
-                        messages=messages, 
-                        max_tokens=8192,                                           
-                        temperature=self.temperature,
-                        response_format={"type": "json_object"},
-                        stream=False
-                    )                     
-                # 记录回复到对话历史                
-                cleaned_string = self.clean_json_string(response.choices[0].message.content)
-                self.add_to_conversation_history("assistant", cleaned_string)               
-                return cleaned_string, response.usage.total_tokens
-
-            except AuthenticationError as e:
-                if attempt < max_retries - 1:
-                    self.log(f"身份验证失败: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"身份验证失败: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-            except RateLimitError as e:
-                if attempt < max_retries - 1:
-                    self.log(f"请求频率限制: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"请求频率限制: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-            except APIError as e:
-                if attempt < max_retries - 1:
-                    self.log(f"API服务错误: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"API服务错误: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    self.log(f"未知错误: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"未知错误: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-        
-        self.log(f"重试{max_retries}次后仍失败")
-        return None
-    
+                record = self.llm_replay.load(fingerprint)
+            except ReplayMiss as e:
+                log(str(e))
+                raise
+            return record["response"], record["usage"], record["finish_reason"]
+
+        def send():
+            if self.streaming_response:
+                response_text, usage, finish_reason = stream_chat_completion(
+                    client, stall_timeout=self.llm_stall_timeout, connect_timeout=self.llm_connect_timeout, **request
+                )
+            else:
+                response = client.chat.completions.create(stream=False, **request)
+                response_text, usage = response.choices[0].message.content, response.usage
+                finish_reason = response.choices[0].finish_reason
+            usage = usage_to_dict(usage)
+            return (response_text, usage, finish_reason), usage["total_tokens"]
+
+        result = self.call_llm(provider, send, estimated_tokens, log=log)
+        if self.llm_replay.recording:
+            self.llm_replay.save(fingerprint, provider, request, *result)
+        return result
+
+    def call_llm(self, provider, request, estimated_tokens=0, max_attempts=None, log=None):
+        """所有LLM请求的统一出口：按服务商配置的RPM/TPM限流，失败时指数退避重试，不可重试的错误立即抛出"""
+        provider_config = self.providers.get(provider, {})
+        return self.rate_limits.call(
+            provider, request,
+            estimated_tokens=estimated_tokens,
+            rpm=provider_config.get("rpm", 0),
+            tpm=provider_config.get("tpm", 0),
+            max_attempts=max_attempts,
+            describe=describe_llm_error,
+            log=log or self.log
+        )
+
     def update_provider_menu(self):
         """更新服务商下拉菜单"""
         if self.provider_menu:
@@ -1007,27 +1043,25 @@ class TranslationApp:
             ]
             
             # 调用API
-            client = OpenAI(api_key=self.current_api_key, base_url=api_url)
-            if "gemini" in self.ai_model:
-                response = client.chat.completions.create(
-                    model=ai_model,
-                    messages=messages, 
-                    # reasoning_effort="medium",
-                    response_format={"type": "json_object"},                    
-                    temperature=0.7,                        
-                    stream=False
-                )
-            else:
-                response = client.chat.completions.create(
-                    model=ai_model,
-                    messages=messages, 
-                    max_tokens=8192,                                           
-                    temperature=0.7,
-                    response_format={"type": "json_object"},
-                    stream=False                
-                )
+            client = self.llm_clients.get(selected_provider, api_url, self.current_api_key)
+            request = {
+                "model": ai_model,
+                "messages": messages,
+                # "reasoning_effort": "medium",
+                "response_format": {"type": "json_object"},
+                "temperature": 0.7
+            }
+            if "gemini" not in self.ai_model:
+                request["max_tokens"] = 8192
+
+            # 总结输出较短，预计用量按提示加约2000 token估算；总结结果是单个对象，流式只用于及早发现停滞
+            estimated_tokens = sum(estimate_tokens(message['content']) for message in messages) + 2000
+            response_text, _, _ = self.request_llm(
+                selected_provider, client, request, estimated_tokens,
+                log=lambda message: self.root.after(0, lambda: self.log_segment(message))
+            )
             # 清理并解析json响应
-            cleaned_string = self.clean_json_string(response.choices[0].message.content)
+            cleaned_string = self.clean_json_string(response_text)
             function_args = json.loads(cleaned_string)
             
             # 返回完整的时间段总结结果
@@ -1210,7 +1244,8 @@ class TranslationApp:
         api_url = provider_config["valid_url"]  
        
         try:
-            client = OpenAI(api_key=api_key, base_url=api_url)
+            client = self.llm_clients.get(current_provider, api_url, api_key)
+            # 验证在界面线程上进行，不经过限流器：RPM用尽或Retry-After推迟时限流器会等待，界面会卡住
             models = client.models.list()
             
             if models and len(list(models)) > 0:
@@ -1406,6 +1441,22 @@ class TranslationApp:
                     # 加载预设信息
                     self.presets = config.get('presets', {})
                     self.current_preset = config.get('current_preset')
+
+                    # 加载LLM客户端连接池参数
+                    self.llm_timeout = config.get('llm_timeout', 300)
+                    self.llm_connect_timeout = config.get('llm_connect_timeout', 10)
+                    self.llm_max_connections = config.get('llm_max_connections', 20)
+                    self.llm_max_keepalive = config.get('llm_max_keepalive', 10)
+                    self.streaming_response = config.get('streaming_response', False)
+                    self.llm_stall_timeout = config.get('llm_stall_timeout', 60)
+                    self.llm_replay_mode = config.get('llm_replay_mode', "off")
+                    self.llm_replay_dir = config.get('llm_replay_dir', "llm_replay")
+                    self.rewrite_rules = config.get('rewrite_rules', {})
+
+                    # 加载各服务商的RPM/TPM限制
+                    for provider_name, limits in config.get('provider_rate_limits', {}).items():
+                        if provider_name in self.providers:
+                            self.providers[provider_name].update(limits)
                     
                     # 更新UI
                     self.api_key_entry.delete(0, tk.END)
@@ -1439,7 +1490,20 @@ class TranslationApp:
                 'system_prompt': self.system_prompt,
                 'presets': self.presets,
                 'current_preset': self.current_preset,
-                'provider': self.provider_var.get()
+                'provider': self.provider_var.get(),
+                'llm_timeout': self.llm_timeout,
+                'llm_connect_timeout': self.llm_connect_timeout,
+                'llm_max_connections': self.llm_max_connections,
+                'llm_max_keepalive': self.llm_max_keepalive,
+                'streaming_response': self.streaming_response,
+                'llm_stall_timeout': self.llm_stall_timeout,
+                'llm_replay_mode': self.llm_replay_mode,
+                'llm_replay_dir': self.llm_replay_dir,
+                'rewrite_rules': self.rewrite_rules,
+                'provider_rate_limits': {
+                    name: {'rpm': provider.get('rpm', 0), 'tpm': provider.get('tpm', 0)}
+                    for name, provider in self.providers.items()
+                }
             }
             with open(config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, ensure_ascii=False, indent=2)            
@@ -59,15 +59,35 @@ from tkinter import ttk, filedialog, messagebox, font
 import threading
 import queue
 import torch
-from faster_whisper import WhisperModel
-from tqdm import tqdm
+from faster_whisper import BatchedInferencePipeline, decode_audio
+from whisper_model_manager import WhisperModelManager
+from parallel_transcribe import build_worker_specs, split_audio_at_silence, transcribe_in_parallel
+from transcription_journal import TranscriptionJournal
+from transcription_cache import TranscriptionCache
+from translation_journal import TranslationJournal
+from translation_memory import TranslationMemory
+from token_budget import estimate_tokens, iter_budget_batches
+from translation_history import TranslationHistory
+from job_queue import JobQueue, JobStage, FINISHED_STATUSES
+from job_control import JobControl, JobCancelled
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import ffmpeg
 import json
 import yt_dlp
 import time
 from crypto_utils import CryptoUtils
+from llm_client_pool import OpenAIClientPool
+from llm_streaming import SentenceStreamParser, salvage_sentence_objects, stream_chat_completion
+from llm_reply_stats import LLMReplyStats
+from llm_schemas import translation_response_format, summary_response_format, is_schema_unsupported
+from glossary_index import GlossaryIndex, parse_glossary, format_glossary
+from rewrite_rules import RewriteRules, GUI_DEFAULT_RULES, parse_rules, format_rules
+from rate_limiter import RateLimiterRegistry, describe_llm_error
+from llm_replay import LLMReplayCache, ReplayMiss, usage_to_dict
 import re
-from openai import OpenAI, AuthenticationError, RateLimitError, APIError
+from openai import AuthenticationError, RateLimitError
 import requests
 import ctypes
 import subprocess
@@ -124,11 +144,16 @@ class TranscriptionApp:
         self.language = "日语"
         self.is_split = "Yes"        
         self.is_vad_filter = tk.BooleanVar(value=True)
+        self.is_stream_audio = tk.BooleanVar(value=True)  # ffmpeg直接解码为PCM送入模型，不落地临时音频
         self.set_beam_size = 5
         self.beam_size_off = False
         
         # 预设管理
         self.presets = {}
+        self.glossaries = {}  # 预设名 -> {原文: 译文}，每批只注入原文中出现的条目
+        self._glossary_index = None  # (术语表, GlossaryIndex)，术语表替换后重新构建
+        self.rewrite_rules = {}  # 预设名 -> 译文改写规则列表，没有设置的预设使用默认的标点处理
+        self._rewriter = None  # (规则列表, RewriteRules)，规则替换后重新编译
         self.current_preset = "Default"
         self.preset_menu = None
         self.preset_combo = None       
@@ -137,10 +162,32 @@ class TranscriptionApp:
         # 模型路径变量
         self.model_path_var = tk.StringVar()
         self.model_path = ""
+
+        # Whisper推理参数（可随预设保存）
+        self.whisper_device_var = tk.StringVar(value="auto")
+        self.whisper_compute_type_var = tk.StringVar(value="default")
+        self.whisper_cpu_threads_var = tk.StringVar(value="0")  # 0表示由CTranslate2自动决定
+        self.whisper_num_workers_var = tk.StringVar(value="1")
+        self.is_batched_inference = tk.BooleanVar(value=False)  # 批量推理模式
+        self.whisper_batch_size_var = tk.StringVar(value="16")
+        self.parallel_workers_var = tk.StringVar(value="0")  # 分块并行进程数，0或1表示不启用
+        self.parallel_chunk_minutes = 10  # 分块并行时每块的目标时长（仅配置文件）
+        self.transcribe_window_minutes = 10  # 顺序/批量推理时每个解码窗口的目标时长，断点续传以窗口为单位（仅配置文件）
+
+        # 常驻模型回收策略（仅配置文件）
+        self.whisper_max_models = 1
+        self.whisper_idle_timeout = 600  # 秒
+        self.whisper_memory_budget_mb = 0  # 0表示不限制
+
+        # 听写结果缓存：同一份音频和参数不再重复转录
+        self.is_transcription_cache = tk.BooleanVar(value=True)
+        self.transcription_cache_dir = "transcription_cache"  # 仅配置文件
+        self.transcription_cache_max_mb = 1024  # 缓存总大小上限，0表示不限制（仅配置文件）
         
         # AI翻译配置
         self.enable_ai_translation = tk.BooleanVar(value=False)
         self.enable_segment_summary = tk.BooleanVar(value=False)
+        self.enable_pipeline = tk.BooleanVar(value=False)  # 边听写边翻译/总结
         self.api_keys = {}  # 存储不同服务商的API密钥
         self.current_api_key = ""  # 当前服务商的API密钥
         self.api_key_status_cache = {}  # API密钥状态缓存
@@ -148,6 +195,20 @@ class TranscriptionApp:
         self.temperature = 1.3
         self.system_prompt = "你是一个专业的翻译助手，请将以下日文字幕翻译成中文，保持原有的格式和结构。"
         self.batch_size = 80  # 每批次字幕行数
+        self.translation_token_budget = 6000  # 每批预计输出token上限，留出max_tokens=8192的余量，0表示只按行数分批（仅配置文件）
+        self.model_token_budgets = {}  # 按模型覆盖上面的预算，如{"gemini-2.5-pro": 20000}（仅配置文件）
+        self.history_token_budget = 4000  # 逐批翻译时对话历史(术语表和最近一轮)的token上限，0表示不限制（仅配置文件）
+        self.is_concurrent_translation = tk.BooleanVar(value=False)  # 多批次同时翻译
+        self.translation_concurrency_var = tk.StringVar(value="4")  # 当前服务商的同时在途批次数
+        self.context_overlap_lines = 5  # 并发翻译时附带的上一批原文行数（仅配置文件）
+        self.is_streaming_response = tk.BooleanVar(value=False)  # 流式接收AI回复，句子一闭合就写出
+        self.is_translation_memory = tk.BooleanVar(value=False)  # 重复出现的字幕行直接复用以往译文
+        self.is_compact_protocol = tk.BooleanVar(value=False)  # 用行号代替时间戳收发字幕，AI只回填行号
+        self.is_structured_output = tk.BooleanVar(value=False)  # 服务商支持时用json_schema约束回复结构
+        self.schema_unsupported_models = set()  # 本次运行中拒绝过json_schema的(服务商, 模型)，不写入配置
+        self.translation_memory_path = "translation_memory.db"  # 仅配置文件
+        self.translation_memory_max_entries = 50000  # 条目数上限，0表示不限制（仅配置文件）
+        self.llm_reply_stats_path = "llm_reply_stats.json"  # 按服务商/模型累计的回复解析统计（仅配置文件）
 
         # 服务商配置
         self.provider_var = tk.StringVar(value="DeepSeek")
@@ -155,18 +216,30 @@ class TranscriptionApp:
             "DeepSeek": {
                 "api_url": "https://api.deepseek.com",                
                 "model_options": ["deepseek-chat", "deepseek-reasoner"],
-                "is_available_url": "https://api.deepseek.com/user/balance"
+                "is_available_url": "https://api.deepseek.com/user/balance",
+                "max_concurrency": 4,
+                "rpm": 0,  # 每分钟请求数上限，0表示不限制
+                "tpm": 0,  # 每分钟token数上限，0表示不限制
+                "json_schema": False  # 是否支持json_schema结构化输出，只支持json_object
             },
             "Gemini": {
                 "api_url": "https://generativelanguage.googleapis.com/v1beta/openai/",                              
                 "model_options": ["gemini-2.5-pro","gemini-2.5-flash",
-                                  "gemini-3-flash","gemini-3-pro"]                
+                                  "gemini-3-flash","gemini-3-pro"],
+                "max_concurrency": 4,
+                "rpm": 0,  # 每分钟请求数上限，0表示不限制
+                "tpm": 0,  # 每分钟token数上限，0表示不限制
+                "json_schema": True  # 是否支持json_schema结构化输出
             },
             "OpenAI": {
                 "api_url": "https://api.openai.com",
                 "model_options": ["gpt-4o", "gpt-5", "gpt-4.1", 
                                   "gpt-4.1-mini", "gpt-4o-mini"],
-                "is_available_url": "https://api.openai.com/dashboard/billing/credit_grants"
+                "is_available_url": "https://api.openai.com/dashboard/billing/credit_grants",
+                "max_concurrency": 4,
+                "rpm": 0,  # 每分钟请求数上限，0表示不限制
+                "tpm": 0,  # 每分钟token数上限，0表示不限制
+                "json_schema": True  # 是否支持json_schema结构化输出
             },
             "OpenRouter": {
                 "api_url": "https://openrouter.ai/api/v1",
@@ -174,13 +247,27 @@ class TranscriptionApp:
                                   "openai/gpt-4.1-mini", "openai/gpt-4o-mini", 
                                   "google/gemini-2.5-flash", "google/gemini-2.5-pro",
                                   "google/gemini-3-flash","google/gemini-3-pro"],
-                "is_available_url": "https://openrouter.ai/api/v1/credits"
+                "is_available_url": "https://openrouter.ai/api/v1/credits",
+                "max_concurrency": 4,
+                "rpm": 0,  # 每分钟请求数上限，0表示不限制
+                "tpm": 0,  # 每分钟token数上限，0表示不限制
+                "json_schema": False  # 是否支持json_schema结构化输出，取决于具体模型，按需在配置文件中开启
             }
         }
         
         # 加密工具
         self.crypto = CryptoUtils()
 
+        # LLM客户端连接池参数（仅配置文件）
+        self.llm_timeout = 300  # 单次请求读取超时(秒)
+        self.llm_connect_timeout = 10
+        self.llm_max_connections = 20
+        self.llm_max_keepalive = 10
+        self.llm_stall_timeout = 60  # 流式模式下超过该秒数没有新token则中止重试
+        # LLM请求录制/回放（仅配置文件）：off不启用，record保存每个请求的原始回复，replay只用保存的回复离线重跑
+        self.llm_replay_mode = "off"
+        self.llm_replay_dir = "llm_replay"
+
         # 创建选项卡
         self.create_notebook()
         
@@ -204,8 +291,61 @@ class TranscriptionApp:
         self.download_log_queue = queue.Queue()
         self.last_download_log_update_time = 0
         
-        # 初始化模型（在实际使用时可改为按需加载）
+        # 初始化模型管理器，模型在实际使用时按需加载并常驻
         self.model = None
+        self.model_manager = WhisperModelManager(
+            max_models=self.whisper_max_models,
+            idle_timeout=self.whisper_idle_timeout,
+            memory_budget_mb=self.whisper_memory_budget_mb,
+            log=self.log
+        )
+        self.transcription_cache = TranscriptionCache(
+            self.transcription_cache_dir,
+            max_bytes=self.transcription_cache_max_mb * 1024 * 1024
+        )
+        self.translation_memory = TranslationMemory(
+            self.translation_memory_path,
+            max_entries=self.translation_memory_max_entries
+        )
+        self.llm_reply_stats = LLMReplyStats(self.llm_reply_stats_path)
+
+        # 正在运行的后台任务的取消/暂停令牌 [(任务类型, JobControl), ...]
+        self.job_controls = []
+        self.job_controls_lock = threading.Lock()
+
+        # 按服务商复用的LLM客户端，翻译和总结线程共享连接池；重试统一由限流器负责，SDK内部不再重试
+        self.llm_clients = OpenAIClientPool(
+            timeout=self.llm_timeout,
+            connect_timeout=self.llm_connect_timeout,
+            max_connections=self.llm_max_connections,
+            max_keepalive_connections=self.llm_max_keepalive,
+            max_retries=0
+        )
+        # 按服务商共享的RPM/TPM限流器，所有LLM请求经call_llm发出
+        self.rate_limits = RateLimiterRegistry()
+        try:
+            self.llm_replay = LLMReplayCache(self.llm_replay_dir, self.llm_replay_mode)
+        except ValueError as e:
+            self.log(f"{str(e)}，可选值为 off/record/replay，已按off处理")
+            self.llm_replay = LLMReplayCache(self.llm_replay_dir)
+        if self.llm_replay.recording:
+            self.log(f"LLM录制模式已启用，每个请求的原始回复保存到 {self.llm_replay_dir}")
+        elif self.llm_replay.replaying:
+            self.log(f"LLM回放模式已启用，翻译和总结只使用 {self.llm_replay_dir} 中录制的回复，不发出网络请求")
+
+        # 多文件任务队列：预处理占用CPU，听写占用模型，翻译和总结各自占用一路API，不同资源的阶段可以同时进行
+        self.job_queue = JobQueue(
+            stages=[
+                JobStage("提取音频", "cpu", self.run_job_extract, max_waiting=1),
+                JobStage("语音增强", "cpu", self.run_job_enhance, max_waiting=1),
+                JobStage("听写", "model", self.run_job_transcribe),
+                JobStage("AI翻译", "translation", self.run_job_translate),
+                JobStage("分段总结", "summary", self.run_job_summary)
+            ],
+            on_change=lambda: self.progress_queue.put(("jobs", None)),
+            on_finish=self.release_job_resources,
+            log=self.log
+        )
 
         # 启动下载日志队列检查
         self.root.after(100, self.check_download_log_queue)
@@ -247,7 +387,24 @@ class TranscriptionApp:
         model_frame.pack(pady=10, padx=10, fill="x")
         
         ttk.Button(model_frame, text="选择模型文件夹", command=self.browse_model_folder).grid(row=0, column=0, padx=5)
-        ttk.Label(model_frame, textvariable=self.model_path_var, width=50, font=("苹方 中等", 10)).grid(row=0, column=1, padx=5, sticky="w")
+        ttk.Label(model_frame, textvariable=self.model_path_var, width=50, font=("苹方 中等", 10)).grid(row=0, column=1, columnspan=7, padx=5, sticky="w")
+
+        # 推理设备和精度
+        ttk.Label(model_frame, text="设备:", font=("苹方 中等", 10)).grid(row=1, column=0, padx=5, sticky="w")
+        ttk.Combobox(model_frame, textvariable=self.whisper_device_var, values=["auto", "cuda", "cpu"],
+                     width=6, state="readonly", font=("苹方 中等", 10)).grid(row=1, column=1, padx=5, sticky="w")
+        ttk.Label(model_frame, text="精度:", font=("苹方 中等", 10)).grid(row=1, column=2, padx=5, sticky="w")
+        ttk.Combobox(model_frame, textvariable=self.whisper_compute_type_var,
+                     values=["default", "int8", "int8_float16", "float16", "float32"],
+                     width=12, state="readonly", font=("苹方 中等", 10)).grid(row=1, column=3, padx=5, sticky="w")
+        ttk.Label(model_frame, text="CPU线程:", font=("苹方 中等", 10)).grid(row=1, column=4, padx=5, sticky="w")
+        ttk.Entry(model_frame, textvariable=self.whisper_cpu_threads_var, width=4, font=("苹方 中等", 10)).grid(row=1, column=5, padx=5, sticky="w")
+        ttk.Label(model_frame, text="并行数:", font=("苹方 中等", 10)).grid(row=1, column=6, padx=5, sticky="w")
+        ttk.Entry(model_frame, textvariable=self.whisper_num_workers_var, width=4, font=("苹方 中等", 10)).grid(row=1, column=7, padx=5, sticky="w")
+        ttk.Button(model_frame, text="模型状态", command=self.show_model_status).grid(row=1, column=8, padx=5)
+        ttk.Checkbutton(model_frame, text="听写缓存", variable=self.is_transcription_cache,
+                        command=self.on_transcription_cache_toggle).grid(row=1, column=9, padx=5, sticky="w")
+        ttk.Button(model_frame, text="缓存统计", command=self.show_cache_stats).grid(row=1, column=10, padx=5)
         
         # 文件选择框架
         file_frame = ttk.LabelFrame(self.transcription_frame, text="文件选择")
@@ -256,6 +413,30 @@ class TranscriptionApp:
         ttk.Button(file_frame, text="选择媒体文件", command=self.browse_media_file).grid(row=0, column=0, padx=5)
         ttk.Label(file_frame, textvariable=self.input_file, font=("苹方 中等", 10)).grid(row=0, column=1, sticky="w")     
 
+        # 任务队列框架
+        job_frame = ttk.LabelFrame(self.transcription_frame, text="任务队列")
+        job_frame.pack(pady=10, padx=10, fill="x")
+
+        ttk.Button(job_frame, text="添加文件", command=self.add_files_to_queue).grid(row=0, column=0, padx=5)
+        ttk.Button(job_frame, text="添加文件夹", command=self.add_folder_to_queue).grid(row=0, column=1, padx=5)
+        ttk.Button(job_frame, text="上移", command=lambda: self.move_selected_jobs(-1)).grid(row=0, column=2, padx=5)
+        ttk.Button(job_frame, text="下移", command=lambda: self.move_selected_jobs(1)).grid(row=0, column=3, padx=5)
+        ttk.Button(job_frame, text="取消任务", command=self.cancel_selected_jobs).grid(row=0, column=4, padx=5)
+        ttk.Button(job_frame, text="清除已结束", command=self.clear_finished_jobs).grid(row=0, column=5, padx=5)
+        ttk.Button(job_frame, text="开始队列", command=self.start_job_queue).grid(row=0, column=6, padx=5)
+
+        self.job_tree = ttk.Treeview(job_frame, columns=("file", "stage", "status", "progress"),
+                                     show="headings", height=5)
+        self.job_tree.heading("file", text="文件")
+        self.job_tree.heading("stage", text="阶段")
+        self.job_tree.heading("status", text="状态")
+        self.job_tree.heading("progress", text="进度")
+        self.job_tree.column("file", width=600)
+        self.job_tree.column("stage", width=100, anchor="center")
+        self.job_tree.column("status", width=100, anchor="center")
+        self.job_tree.column("progress", width=80, anchor="center")
+        self.job_tree.grid(row=1, column=0, columnspan=8, padx=5, pady=5, sticky="we")
+
         # 听写语言选择框架
         language_frame = ttk.LabelFrame(self.transcription_frame, text="听写参数设置")
         language_frame.pack(pady=10, padx=10, fill="x")
@@ -269,6 +450,16 @@ class TranscriptionApp:
         ttk.Checkbutton(language_frame, text="VAD开关", variable=self.is_vad_filter, 
                        command=self.on_VAD_toggle).grid(row=0, column=4, padx=5, sticky="w")
 
+        ttk.Checkbutton(language_frame, text="内存直读音频", variable=self.is_stream_audio,
+                       command=self.on_stream_audio_toggle).grid(row=0, column=5, padx=5, sticky="w")
+
+        ttk.Checkbutton(language_frame, text="批量推理", variable=self.is_batched_inference,
+                       command=self.on_batched_inference_toggle).grid(row=0, column=6, padx=5, sticky="w")
+        ttk.Label(language_frame, text="批大小:", font=("苹方 中等", 10)).grid(row=0, column=7, padx=5, sticky="w")
+        ttk.Entry(language_frame, textvariable=self.whisper_batch_size_var, width=4, font=("苹方 中等", 10)).grid(row=0, column=8, padx=5, sticky="w")
+        ttk.Label(language_frame, text="分块并行进程:", font=("苹方 中等", 10)).grid(row=0, column=9, padx=5, sticky="w")
+        ttk.Entry(language_frame, textvariable=self.parallel_workers_var, width=4, font=("苹方 中等", 10)).grid(row=0, column=10, padx=5, sticky="w")
+
         # 字幕后处理勾选框
         ai_frame = ttk.LabelFrame(self.transcription_frame, text="听写后处理选项")
         ai_frame.pack(pady=10, padx=10, fill="x")
@@ -279,14 +470,22 @@ class TranscriptionApp:
         ttk.Checkbutton(ai_frame, text="AI分段总结", variable=self.enable_segment_summary, 
                        command=self.on_segment_summary_toggle).grid(row=0, column=5, padx=5, sticky="w")
 
+        ttk.Checkbutton(ai_frame, text="边听写边处理", variable=self.enable_pipeline,
+                       command=self.on_pipeline_toggle).grid(row=0, column=6, padx=5, sticky="w")
+
         # 进度条
         self.progress = ttk.Progressbar(self.transcription_frame, orient="horizontal", length=500, mode="determinate")
         self.progress.pack(pady=20)
         
         # 控制按钮
-        self.start_btn = ttk.Button(self.transcription_frame, text="开始任务", command=self.start_transcription)
+        control_frame = ttk.Frame(self.transcription_frame)
+        control_frame.pack(pady=10)
+        self.start_btn = ttk.Button(control_frame, text="开始任务", command=self.start_transcription)
         
-        self.start_btn.pack(pady=10)
+        self.start_btn.grid(row=0, column=0, padx=5)
+        ttk.Button(control_frame, text="暂停", command=self.pause_transcription_jobs).grid(row=0, column=1, padx=5)
+        ttk.Button(control_frame, text="继续", command=self.resume_transcription_jobs).grid(row=0, column=2, padx=5)
+        ttk.Button(control_frame, text="取消", command=self.cancel_transcription_jobs).grid(row=0, column=3, padx=5)
         
         # 日志输出
         self.log_text = tk.Text(self.transcription_frame, height=10, state=tk.DISABLED, font=("苹方 中等", 11))
@@ -323,6 +522,20 @@ class TranscriptionApp:
         self.temperature_label = ttk.Label(provider_frame, text=f"{self.temperature:.1f}", font=("苹方 中等", 10))
         self.temperature_label.grid(row=0, column=6, padx=5, sticky="w")
 
+        ttk.Checkbutton(provider_frame, text="并发翻译", variable=self.is_concurrent_translation,
+                        command=self.on_concurrent_translation_toggle).grid(row=0, column=7, padx=5, sticky="w")
+        ttk.Label(provider_frame, text="并发数:", font=("苹方 中等", 10)).grid(row=0, column=8, padx=5, sticky="w")
+        ttk.Entry(provider_frame, textvariable=self.translation_concurrency_var, width=4, font=("苹方 中等", 10)).grid(row=0, column=9, padx=5, sticky="w")
+        ttk.Checkbutton(provider_frame, text="流式输出", variable=self.is_streaming_response,
+                        command=self.on_streaming_response_toggle).grid(row=0, column=10, padx=5, sticky="w")
+        ttk.Checkbutton(provider_frame, text="翻译记忆", variable=self.is_translation_memory,
+                        command=self.on_translation_memory_toggle).grid(row=0, column=11, padx=5, sticky="w")
+        ttk.Button(provider_frame, text="记忆统计", command=self.show_translation_memory_stats).grid(row=0, column=12, padx=5)
+        ttk.Checkbutton(provider_frame, text="紧凑协议", variable=self.is_compact_protocol,
+                        command=self.on_compact_protocol_toggle).grid(row=0, column=13, padx=5, sticky="w")
+        ttk.Checkbutton(provider_frame, text="结构化输出", variable=self.is_structured_output,
+                        command=self.on_structured_output_toggle).grid(row=0, column=14, padx=5, sticky="w")
+
         # API设置框架
         api_frame = ttk.LabelFrame(self.ai_translation_frame, text="API设置")
         api_frame.pack(pady=10, padx=10, fill="x")
@@ -474,6 +687,9 @@ class TranscriptionApp:
         self.audio_format_combo.grid(row=1, column=1, padx=5, sticky="w")
         # 下载按钮
         ttk.Button(format_frame, text="开始下载", command=self.youtube_download).grid(row=1, column=2, padx=5)
+        ttk.Button(format_frame, text="暂停", command=lambda: self.control_jobs(("download",), "pause")).grid(row=1, column=3, padx=5)
+        ttk.Button(format_frame, text="继续", command=lambda: self.control_jobs(("download",), "resume")).grid(row=1, column=4, padx=5)
+        ttk.Button(format_frame, text="取消下载", command=lambda: self.control_jobs(("download",), "cancel")).grid(row=1, column=5, padx=5)
             
         # 初始化格式列表和映射
         self.video_formats = []
@@ -503,6 +719,7 @@ class TranscriptionApp:
         ttk.Button(looping_frame, text="导入图片", command=self.import_looping_image).grid(row=0, column=0, padx=5, sticky="w")
         ttk.Button(looping_frame, text="导入音频", command=self.import_looping_audio).grid(row=0, column=1, padx=5, sticky="w")
         ttk.Button(looping_frame, text="生成视频", command=self.generate_looping_video).grid(row=0, column=2, padx=5, sticky="w")        
+        ttk.Button(looping_frame, text="停止生成", command=lambda: self.control_jobs(("looping",), "cancel")).grid(row=0, column=3, padx=5, sticky="w")
 
         # 下载日志框
         log_frame = ttk.LabelFrame(self.common_tools_frame, text="常用工具日志")
@@ -549,6 +766,7 @@ class TranscriptionApp:
             return     
         
         def looping_generate():
+            control = self.start_job_control("looping")
             try:
                 # 获取音频时长
                 audio_info = ffmpeg.probe(audio_path)
@@ -568,7 +786,7 @@ class TranscriptionApp:
                 input_audio = ffmpeg.input(audio_path) 
 
                 # 使用ffmpeg生成一图流视频
-                (
+                process = (
                     ffmpeg
                     .output(
                         input_video,
@@ -589,13 +807,22 @@ class TranscriptionApp:
                         vsync='cfr',
                         threads=0
                     )
-                    .run(overwrite_output=True)
+                    .run_async(overwrite_output=True)
                 )
+                with control.track_process(process):
+                    process.wait()
+                control.checkpoint()
+                if process.returncode != 0:
+                    raise Exception(f"ffmpeg返回错误码{process.returncode}")
                 
                 normalized_output_path = output_path.replace('/', '\\')
                 self.log_download(f"视频生成完成，已保存至: {normalized_output_path}")
+            except JobCancelled:
+                self.log_download("已停止生成视频")
             except Exception as e:
                 self.log_download(f"生成视频出错: {str(e)}")
+            finally:
+                self.finish_job_control("looping", control)
 
         threading.Thread(target=looping_generate, daemon=True).start()                
 
@@ -843,11 +1070,18 @@ class TranscriptionApp:
         self.log_download(f"准备下载: {url}")        
         
         def run_download():
+            control = self.start_job_control("download")
+
+            def progress_hook(d):
+                # 每个分片/数据块回调时检查暂停和取消
+                control.checkpoint()
+                self.download_progress_hook(d)
+
             try:
                 ydl_opts = {
                     'format': format_str,
                     'outtmpl': os.path.join(save_path, '%(title)s.%(ext)s'),
-                    'progress_hooks': [self.download_progress_hook],
+                    'progress_hooks': [progress_hook],
                     'merge_output_format': 'mkv', 
                     'quiet': True,
                     'no_warnings': True,
@@ -859,7 +1093,13 @@ class TranscriptionApp:
                 
                 self.root.after(0, lambda: self.log_download("下载完成！"))                
             except Exception as e:
-                self.root.after(0, lambda: self.log_download(f"下载出错: {str(e)}"))
+                if control.cancelled:
+                    # yt-dlp保留.part文件，再次下载同一视频时会续传
+                    self.root.after(0, lambda: self.log_download("下载已取消，已下载的部分下次可续传"))
+                else:
+                    self.root.after(0, lambda: self.log_download(f"下载出错: {str(e)}"))
+            finally:
+                self.finish_job_control("download", control)
         threading.Thread(target=run_download, daemon=True).start()
 
     def download_progress_hook(self, d):
@@ -979,114 +1219,136 @@ class TranscriptionApp:
             self.log("用户取消解密，翻译任务未启动")
             return
     
-    def run_batch_translation(self):
-        """执行分批翻译并且对AI返回结果进行时间轴重建和所有批次结果叠加最终输出可用ASS文件"""
+    def run_batch_translation(self, subtitle_file=None, line_queue=None, control=None):
+        """
+        执行分批翻译并且对AI返回结果进行时间轴重建和所有批次结果叠加最终输出可用ASS文件
+        传入line_queue时为流水线模式：从队列逐行接收听写结果，攒满一批就立即翻译，收到None表示听写结束
+        每批开始前检查暂停和取消，取消时已完成的批次保留在输出文件中
+        翻译已有字幕文件时每完成一批就提交到断点续传日志，重新翻译同一文件时只请求缺失和失败的批次
+        全部批次翻译成功时返回True，出错、取消或有批次重试后仍失败时返回False
+        """
+        translated_batch = None
+        journal = None
+        # 本次完成的批次：批次序号 -> (处理后的ASS行, 翻译日志)，结束时与日志中已完成的批次一起组装输出
+        completed = {}
+        failed_batches = []
+        control = self.start_job_control("translation", control)
         try:
-            subtitle_file = self.subtitle_file_var.get()
-            with open(subtitle_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            # 找到第一个 Dialogue 行出现的位置
-            first_dialogue_index = -1
-            # 1. 遍历列表，找到第一个Dialogue行的索引
-            for i, line in enumerate(lines):
-                if line.strip().startswith('Dialogue:'):
-                    first_dialogue_index = i
-                    break
-                    
-            # 2. 根据索引分割列表
-            if first_dialogue_index == -1:
-                # 文件中没有Dialogue行，整个文件都是头部
-                header_lines = lines
-                dialogue_lines = []
-            else:
-                # 分别存储头部信息和原文用于最后输出
-                header_lines = lines[:first_dialogue_index]
-                dialogue_lines = lines[first_dialogue_index:]
-
-            # 分批处理
+            subtitle_file = subtitle_file or self.subtitle_file_var.get()
             batch_size = int(self.batch_size_entry.get())
-            total_batches = (len(dialogue_lines) + batch_size - 1) // batch_size
-            self.log(f"字幕共 {len(dialogue_lines)} 行，分为 {total_batches} 批翻译")
+            # 每批行数不超过batch_size，同时预计输出token不超过当前模型的预算，长句密集的批次会自动变小
+            token_budget = self.get_translation_token_budget()
+            budget_text = f"、预计输出不超过 {token_budget} token" if token_budget else ""
 
-            # 初始化对话历史和token消耗统计
-            self.conversation_history = [] 
-            total_token_usage = 0  
-   
             # 输出文件路径
             base_name = os.path.splitext(os.path.basename(subtitle_file))[0]
             output_dir = os.path.dirname(subtitle_file)
             output_file_readytogo = os.path.join(output_dir, f"{base_name}_readytogo.ass")
             output_file_translation_log = os.path.join(output_dir, f"{base_name}_translation_log.txt")
+
+            if line_queue is None:
+                with open(subtitle_file, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+                header_lines, dialogue_lines = self.split_ass_header(lines)
+
+                # 分批处理
+                batches = list(iter_budget_batches(dialogue_lines, batch_size, token_budget, self.estimate_line_output_tokens))
+                total_batches = len(batches)
+                self.log(f"字幕共 {len(dialogue_lines)} 行，按每批最多 {batch_size} 行{budget_text}分为 {total_batches} 批翻译")
+
+                journal = self.open_translation_journal(subtitle_file, base_name, dialogue_lines)
+                indexed_batches = [(batch_num, batch_lines) for batch_num, batch_lines in enumerate(batches)
+                                   if journal.get_batch(TranslationJournal.make_batch_key(batch_lines)) is None]
+                if len(indexed_batches) < total_batches:
+                    self.log(f"断点续传：{total_batches - len(indexed_batches)} 批已在上次完成，本次只翻译剩余的 {len(indexed_batches)} 批")
+            else:
+                # 流水线模式下字幕还在生成，头部与听写写出的一致，原文在接收过程中逐行收集
+                header_lines = self.create_ass_header().splitlines(keepends=True)
+                dialogue_lines = []
+                batches = None
+                total_batches = None
+                self.log(f"流水线翻译已就绪，每收到最多 {batch_size} 行{budget_text}的字幕翻译一批")
+                indexed_batches = enumerate(iter_budget_batches(self.iter_queued_lines(line_queue, dialogue_lines), batch_size,
+                                                                token_budget, self.estimate_line_output_tokens))
+
+            # 初始化对话历史和token消耗统计
+            self.translation_history = TranslationHistory(self.history_token_budget, estimate_tokens)
+            total_token_usage = 0  
+
+            # 翻译过程中逐批追加写出，便于随时查看进度，结束时再整体重写一次
             with open(output_file_readytogo, 'w', encoding='utf-8') as f:
                 # 写入原始ASS头部
                 f.writelines(header_lines)    
                 f.write('\n')
 
-            for batch_num in range(total_batches):
-                start_idx = batch_num * batch_size
-                end_idx = min((batch_num + 1) * batch_size, len(dialogue_lines))
-                
-                batch_lines = dialogue_lines[start_idx:end_idx]
-                api_input, context = self.prepare_input_for_api(batch_lines)
-                batch_text = json.dumps(api_input, indent=2, ensure_ascii=False) 
-                self.log(f"正在翻译第 {batch_num + 1}/{total_batches} 批")
-
-                # 调用AI翻译API
-                translated_batch, token_usage = self.call_ai_translation_api(batch_text) 
-                total_token_usage += token_usage # 统计总token消耗
-
-                # 重建ASS字幕行            
-                current_batch_lines, translation_line = self.reconstruct_ass_from_response(translated_batch, context) 
-                
-                # 如果json解析失败，重试翻译本批次，最多重试三次
-                for retry in range(3):
-                    if current_batch_lines is None: # 检查是否为 None
-                        self.log(f"第 {batch_num + 1} 批次解析失败，正在重试 (第 {retry + 1} 次)...")
-                        translated_batch, token_usage = self.call_ai_translation_api(batch_text)
-                        current_batch_lines, translation_line = self.reconstruct_ass_from_response(translated_batch, context)
-                    else:
-                        # 记录回复到对话历史 
-                        self.add_to_conversation_history("assistant", translated_batch) 
-                        break
-                
-                # 如果重试后仍然失败，则跳过当前批次
-                if current_batch_lines is None:
-                    self.log(f"第 {batch_num + 1} 批次翻译和重建ASS失败，跳过此批次。")
-                    continue # 跳过当前批次，继续处理下一批次
-
-                processed_lines = []            
-                translated_lines = [str(line).strip() for line in current_batch_lines if str(line).strip()]
-                for line in translated_lines:
-                    if line.strip():
-                        # 分离时间轴部分和文本部分
-                        parts = line.split(',', 9)  # ASS格式有9个逗号分隔的字段
-                        if len(parts) == 10:
-                            # 前9部分是时间轴和样式信息，第10部分是文本
-                            metadata = ','.join(parts[:9])
-                            text_content = parts[9]
-                            
-                            # 对文本部分进行标点符号替换
-                            processed_text = text_content.replace('，', ' ').replace('。', ' ').replace('、', ' ').replace('“', '「').replace('”', '」').replace('《', '『').replace('》', '』').replace('！', ' ').replace('？', ' ').replace('？', '吗')
-                            
-                            # 重新组合成完整的ASS行
-                            processed_line = f"{metadata},{processed_text}"
-                            processed_lines.append(processed_line)
-                        else:
-                            # 如果格式不对，保持原样
-                            processed_lines.append(line)
-
+            def write_translated_lines(processed_lines, translation_line):
+                if not processed_lines:
+                    return
                 with open(output_file_readytogo, 'a', encoding='utf-8') as f:
                     f.write('\n'.join(processed_lines))
                     f.write('\n')  # 添加换行分隔不同批次                  
 
-                with open(output_file_translation_log, 'a', encoding='utf-8') as f: 
-                    f.write('\n'.join(translation_line))
-                    f.write('\n')  # 添加换行分隔不同批次
+                if journal is None:
+                    with open(output_file_translation_log, 'a', encoding='utf-8') as f: 
+                        f.write('\n'.join(translation_line))
+                        f.write('\n')  # 添加换行分隔不同批次
+
+            concurrency = self.get_translation_concurrency() if self.is_concurrent_translation.get() else 1
+            if concurrency > 1:
+                # 并发模式不使用对话历史，改为每批附带上一批末尾的原文作为上下文，各批次可以同时请求
+                self.log(f"并发翻译已启用，同时翻译 {concurrency} 批，每批附带上一批末尾 {self.context_overlap_lines} 行原文作为上下文")
+                results = self.iter_concurrent_translations(indexed_batches, total_batches, concurrency, control, batches)
+                streamed = None
+            else:
+                # 逐批翻译时批次顺序就是写出顺序，流式输出模式下每句译文一返回就直接写入
+                streamed = ([], [])
 
-            with open(output_file_readytogo, 'a', encoding='utf-8') as f:
-                f.write('\n')
-                # 写入处理后的翻译内容
-                f.writelines(dialogue_lines)
+                def stream_sink(processed_lines, translation_line):
+                    write_translated_lines(processed_lines, translation_line)
+                    streamed[0].extend(processed_lines)
+                    streamed[1].extend(translation_line)
+
+                line_sink = stream_sink if self.is_streaming_response.get() else None
+                results = ((batch_num, batch_lines,
+                            self.translate_batch(batch_num, batch_lines, total_batches, control=control, line_sink=line_sink))
+                           for batch_num, batch_lines in indexed_batches)
+
+            # 结果按批次顺序写入
+            for batch_num, batch_lines, (processed_lines, translation_line, token_usage, translated_batch) in results:
+                total_token_usage += token_usage # 统计总token消耗
+                batch_key = TranslationJournal.make_batch_key(batch_lines)
+                if streamed is not None:
+                    # 流式写出的句子与剩余句子(含翻译记忆命中和补充请求的行)合并成完整批次；
+                    # 进行中的输出文件按返回顺序追加，批次内可能不按时间排列，最终输出按开始时间重新排序
+                    streamed_lines, streamed_log = streamed[0][:], streamed[1][:]
+                    del streamed[0][:], streamed[1][:]
+                    if processed_lines is not None:
+                        write_translated_lines(processed_lines, translation_line)
+                        processed_lines = sorted(
+                            streamed_lines + processed_lines,
+                            key=lambda line: self.ass_time_to_seconds(line.split(',', 2)[1])
+                        )
+                        translation_line = streamed_log + translation_line
+                elif processed_lines is not None:
+                    write_translated_lines(processed_lines, translation_line)
+                if processed_lines is None:
+                    # 跳过失败的批次，继续处理下一批次，记入日志以便下次只重试这些批次
+                    failed_batches.append((batch_num, batch_lines))
+                    if journal:
+                        journal.commit_failed(batch_key, batch_num)
+                    continue
+                completed[batch_num] = (processed_lines, translation_line)
+                if journal:
+                    journal.commit_batch(batch_key, batch_num, processed_lines, translation_line)
+
+            self.write_translation_output(output_file_readytogo, output_file_translation_log, header_lines,
+                                          dialogue_lines, batches, completed, journal)
+            self.log_failed_batches(failed_batches, total_batches)
+            self.log_reply_stats()
+            if journal:
+                # 全部批次完成后删除日志，有失败批次时保留，下次只重试失败的批次
+                journal.close(remove=not failed_batches)
+                journal = None
             total_balance = self.ask_is_available()
             normalized_path = output_file_readytogo.replace('/', '\\')
             if self.provider_var.get() == "DeepSeek":
@@ -1095,95 +1357,904 @@ class TranscriptionApp:
                 self.log(f"翻译完成，结果已保存到: {normalized_path}, token消耗为{total_token_usage}, 余额为{total_balance}美元")
             else:
                 self.log(f"翻译完成，结果已保存到: {normalized_path}, token消耗为{total_token_usage}")
+            return not failed_batches
 
+        except JobCancelled:
+            if journal:
+                self.write_translation_output(output_file_readytogo, output_file_translation_log, header_lines,
+                                              dialogue_lines, batches, completed, journal)
+                self.log("翻译已取消，已完成的批次保留在输出文件和断点续传日志中，重新翻译时从未完成的批次继续")
+            else:
+                self.log("翻译已取消，已完成的批次保留在输出文件中")
+            return False
         except Exception as e:
             self.log(f"翻译失败: {str(e)}")
             self.log(f"错误内容: {translated_batch}") 
+            if journal:
+                self.log("已完成的批次保留在断点续传日志中，重新翻译时从未完成的批次继续")
+            return False
+        finally:
+            if journal:
+                journal.close()
+            self.finish_job_control("translation", control)
+
+    def open_translation_journal(self, subtitle_file, base_name, dialogue_lines):
+        """打开字幕旁的翻译断点续传日志，字幕内容、服务商、模型和提示词一致时加载已完成的批次"""
+        journal_path = os.path.join(os.path.dirname(subtitle_file), f"{base_name}_translate_journal.jsonl")
+        # 日志中保存的是改写后的行，改写规则变化时重新开始
+        job_key = TranslationJournal.make_job_key(dialogue_lines, self.provider_var.get(), self.ai_model,
+                                                  self.system_prompt + format_glossary(self.current_glossary()),
+                                                  {'rewrite_rules': self.current_rewrite_rules()})
+        journal = TranslationJournal(journal_path, job_key)
+        if journal.open() and (journal.batches or journal.failed):
+            self.log(f"检测到未完成的翻译任务，已完成 {len(journal.batches)} 批，上次失败 {len(journal.failed)} 批")
+        return journal
+
+    def write_translation_output(self, output_file_readytogo, output_file_translation_log, header_lines,
+                                 dialogue_lines, batches, completed, journal=None):
+        """
+        把本次和日志中已完成的批次按顺序组装成最终字幕，写入临时文件后一次替换，
+        中途失败不会留下半个文件；流水线模式下没有完整的批次列表和断点续传日志，按本次完成的批次序号组装
+        """
+        translated, log_lines = [], []
+        for batch_num in (range(len(batches)) if batches is not None else sorted(completed)):
+            if batch_num in completed:
+                processed_lines, translation_line = completed[batch_num]
+            else:
+                if journal is None:
+                    continue
+                record = journal.get_batch(TranslationJournal.make_batch_key(batches[batch_num]))
+                if record is None:
+                    continue
+                processed_lines, translation_line = record['lines'], record['log']
+            translated.extend(processed_lines)
+            log_lines.extend(translation_line)
+
+        content = ''.join(header_lines) + '\n'
+        if translated:
+            content += '\n'.join(translated) + '\n'
+        content += '\n' + ''.join(dialogue_lines)
+        for path, text in ((output_file_readytogo, content), (output_file_translation_log, '\n'.join(log_lines) + '\n')):
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temp_path, path)
+
+    def log_failed_batches(self, failed_batches, total_batches=None):
+        """列出重试后仍失败、被跳过的批次及其时间范围"""
+        if not failed_batches:
+            return
+        total_text = f"/{total_batches}" if total_batches else ""
+        self.log(f"以下 {len(failed_batches)} 批重试后仍失败，已跳过：")
+        for batch_num, batch_lines in failed_batches:
+            start = self.parse_ass_dialogue(batch_lines[0])
+            end = self.parse_ass_dialogue(batch_lines[-1])
+            span = f"{start['Start']} - {end['End']}" if start and end else "时间未知"
+            self.log(f"  第 {batch_num + 1}{total_text} 批({len(batch_lines)} 行，{span})")
+        self.log("重新开始翻译同一字幕时只会请求这些批次和未完成的批次")
+
+    def translate_batch(self, batch_num, batch_lines, total_batches=None, context_lines=None, control=None, line_sink=None):
+        """
+        翻译一批字幕并完成时间轴重建和标点替换，返回(处理后的ASS行, 翻译日志, token消耗, AI原始返回)，失败时ASS行为None
+        context_lines为None时沿用对话历史；并发模式下传入上一批末尾的原文行，不读写对话历史
+        传入line_sink时每句译文一返回就重建并交给line_sink(处理后的ASS行, 翻译日志)写出，返回值只包含尚未写出的句子
+        """
+        if control:
+            control.checkpoint()
+
+        # 翻译记忆命中的行直接预填，只把未命中的行发给AI
+        memory_lines, memory_log = [], []
+        memory_scope = None
+        if self.is_translation_memory.get():
+            memory_scope = self.translation_memory_scope()
+            batch_lines, memory_lines, memory_log = self.apply_translation_memory(batch_lines, memory_scope)
+            if memory_lines:
+                self.log(f"第 {batch_num + 1} 批有 {len(memory_lines)} 行命中翻译记忆")
+            if not any(line.startswith('Dialogue:') for line in batch_lines):
+                return self.postprocess_translated_lines(memory_lines), memory_log, 0, None
+
+        if total_batches:
+            self.log(f"正在翻译第 {batch_num + 1}/{total_batches} 批")
+        else:
+            self.log(f"正在翻译第 {batch_num + 1} 批")
 
-    def call_ai_translation_api(self, content):
-        """调用AI翻译API，包含重试机制"""
-        max_retries = 3
-        retry_delay = 5  # 秒
-        self.max_history = 10 # 最多保存10条历史记录
+        current_batch_lines, translation_line, token_usage, translated_batch = self.request_batch_translation(
+            f"第 {batch_num + 1} 批", batch_lines, context_lines, line_sink, memory_scope)
+
+        # 拆分到单行后重试仍然失败，则跳过当前批次
+        if current_batch_lines is None:
+            self.log(f"第 {batch_num + 1} 批次翻译和重建ASS失败，跳过此批次。")
+            return None, None, token_usage, translated_batch
+
+        if memory_lines:
+            # 命中记忆的行与AI译文按开始时间合并
+            current_batch_lines = sorted(
+                current_batch_lines + memory_lines,
+                key=lambda line: self.ass_time_to_seconds(line.split(',', 2)[1])
+            )
+            translation_line = translation_line + memory_log
+        return self.postprocess_translated_lines(current_batch_lines), translation_line, token_usage, translated_batch
+
+    def request_batch_translation(self, label, batch_lines, context_lines=None, line_sink=None, memory_scope=None,
+                                  check_coverage=True):
+        """
+        请求翻译一组字幕行并重建ASS，返回(ASS行, 翻译日志, token消耗, AI原始返回)，失败时ASS行为None
+        输出被截断(finish_reason为length)或JSON解析失败时，先从回复中恢复所有完整的句子，只把没有覆盖到的行补充请求；
+        一句也没有恢复时把尚未写出的行对半拆分后递归翻译，只剩一行时才原样重试，最多重试三次
+        解析成功后检查译文覆盖了哪些原文行，check_coverage为True时把AI漏掉的行单独补充请求一次
+        """
+        compact = self.is_compact_protocol.get()
+        api_input, context = self.prepare_input_for_api(batch_lines, compact)
+        batch_text = self.format_api_input(api_input, compact)
+        # 预设术语表只注入本批原文中出现的条目
+        term_prompt = self.build_term_prompt(label, [entry['Text'] for entry in context.values()])
+        estimated_output = sum(self.estimate_line_output_tokens(line, compact) for line in batch_lines)
+        estimated_prompt = self.estimate_prompt_tokens(batch_text, context_lines, term_prompt)
+
+        # 已写出句子覆盖的时间戳，重试和拆分时同一句不再重复写出
+        streamed = set()
+
+        def emit_sentence(sentence_obj):
+            try:
+                sentence_obj = self.expand_sentence_obj(sentence_obj, context)
+                related_timestamps = [item['timestamp'] for item in sentence_obj['relatedInputItems']]
+                if related_timestamps[0] in streamed:
+                    return
+                sentence_lines, sentence_log = self.reconstruct_ass_from_response(
+                    {'translatedSentences': [sentence_obj]}, context)
+            except (KeyError, IndexError, TypeError):
+                return  # 不完整的句子留给完整回复处理
+            if sentence_lines:
+                streamed.update(related_timestamps)
+                line_sink(self.postprocess_translated_lines(sentence_lines), sentence_log)
+
+        on_sentence = emit_sentence if line_sink else None
+
+        provider, model = self.provider_var.get(), self.ai_model
+        total_token_usage = 0
+        for retry in range(4):
+            translated_batch, token_usage, reply_info = self.call_ai_translation_api(
+                batch_text, context_lines, on_sentence, compact, term_prompt)
+            total_token_usage += token_usage
+            if translated_batch is None:
+                # 接口本身已经重试过，拆分也无济于事
+                self.llm_reply_stats.record(provider, model, self.response_format_mode(provider, model), request_failures=1)
+                return None, None, total_token_usage, translated_batch
+
+            history_text = ""
+            if context_lines is None:
+                history_text = (f"(其中历史约 {self.translation_history.token_count()} token，"
+                                f"术语 {len(self.translation_history.glossary)} 条，"
+                                f"概要 {len(self.translation_history.summary)} 字)")
+            mode = reply_info['response_format']
+            self.log(f"{label}: {len(api_input)} 行，预计提示约 {estimated_prompt} token{history_text}、输出约 {estimated_output} token；"
+                     f"实际提示 {reply_info['prompt_tokens']} token、输出 {reply_info['completion_tokens']} token")
+
+            # 重建ASS字幕行            
+            current_batch_lines, translation_line = self.reconstruct_ass_from_response(translated_batch, context, streamed)
+            truncated = reply_info['finish_reason'] == "length"
+            if current_batch_lines is not None and not truncated:
+                raw_valid = reply_info.get('raw_valid', True)
+                # 对照本批原文检查覆盖情况，AI跳过的行在重建时会被直接丢弃
+                covered = self.covered_input_keys(translated_batch, context) | streamed
+                missing_lines = [entry['Line'] for key, entry in context.items() if key not in covered]
+                self.llm_reply_stats.record(
+                    provider, model, mode, replies=1, parsed=int(raw_valid), repaired=int(not raw_valid),
+                    input_lines=len(context), covered_lines=len(context) - len(missing_lines)
+                )
+                # 记录本轮到对话历史，回复中的术语并入术语表
+                if context_lines is None:
+                    self.translation_history.add_exchange(batch_text, translated_batch)
+                if memory_scope is not None:
+                    self.learn_translation_memory(memory_scope, translated_batch, context)
+                if missing_lines:
+                    if not check_coverage:
+                        self.log(f"{label}仍有 {len(missing_lines)} 行未被译文覆盖：" + "、".join(
+                            context[key]['Text'] for key in context if key not in covered))
+                        return current_batch_lines, translation_line, total_token_usage, translated_batch
+                    self.llm_reply_stats.record(provider, model, mode,
+                                                coverage_followups=1, missing_lines=len(missing_lines))
+                    current_batch_lines, translation_line, token_usage = self.request_missing_lines(
+                        label, batch_lines, missing_lines, len(context), current_batch_lines, translation_line,
+                        line_sink, memory_scope
+                    )
+                    total_token_usage += token_usage
+                return current_batch_lines, translation_line, total_token_usage, translated_batch
+
+            # 整体解析失败或被截断：先恢复回复中所有完整的句子，只把没有覆盖到的行重新请求
+            reason = "输出被截断" if truncated else "解析失败"
+            sentences = self.salvage_translated_sentences(translated_batch, context)
+            salvaged_lines, salvaged_log = self.reconstruct_ass_from_response(
+                {'translatedSentences': sentences}, context, streamed)
+            covered = set(streamed)
+            for sentence_obj in sentences:
+                covered.update(item['timestamp'] for item in sentence_obj['relatedInputItems'])
+            remaining_lines = [entry['Line'] for key, entry in context.items() if key not in covered]
+            salvaged_count = len(covered) - len(streamed)
+            self.llm_reply_stats.record(
+                provider, model, mode, replies=1, truncated=int(truncated),
+                salvaged=int(salvaged_count > 0), unrecoverable=int(salvaged_count == 0),
+                salvaged_lines=salvaged_count
+            )
+            if salvaged_count:
+                if memory_scope is not None:
+                    self.learn_translation_memory(memory_scope, {'translatedSentences': sentences}, context)
+                if not remaining_lines:
+                    self.log(f"{label}{reason}，已从回复中恢复全部 {salvaged_count} 行")
+                    return salvaged_lines, salvaged_log, total_token_usage, translated_batch
+                self.log(f"{label}{reason}，从回复中恢复了 {salvaged_count} 行，剩余 {len(remaining_lines)} 行补充请求")
+                self.llm_reply_stats.record(provider, model, mode, followups=1, followup_lines=len(remaining_lines))
+                result = self.request_batch_translation(f"{label}-补", remaining_lines, context_lines, line_sink, memory_scope)
+                total_token_usage += result[2]
+                if result[0] is None:
+                    self.log(f"{label}-补 翻译失败，跳过未覆盖的 {len(remaining_lines)} 行")
+                    return salvaged_lines, salvaged_log, total_token_usage, translated_batch
+                # 恢复的句子与补充请求的译文按开始时间合并
+                merged_lines = sorted(
+                    salvaged_lines + result[0],
+                    key=lambda line: self.ass_time_to_seconds(line.split(',', 2)[1])
+                )
+                return merged_lines, salvaged_log + result[1], total_token_usage, translated_batch
+
+            if not remaining_lines:
+                return [], [], total_token_usage, translated_batch
+            if len(remaining_lines) > 1:
+                half = len(remaining_lines) // 2
+                parts = (remaining_lines[:half], remaining_lines[half:])
+                self.log(f"{label}{reason}，拆分为 {len(parts[0])} 行和 {len(parts[1])} 行两部分重新翻译")
+                self.llm_reply_stats.record(provider, model, mode, splits=1)
+                # 并发模式下后半部分以前半部分末尾的原文作为上下文
+                part_contexts = (context_lines, None if context_lines is None else parts[0][-self.context_overlap_lines:])
+                results = [
+                    self.request_batch_translation(f"{label}-{i + 1}", part, part_context, line_sink, memory_scope)
+                    for i, (part, part_context) in enumerate(zip(parts, part_contexts))
+                ]
+                total_token_usage += sum(result[2] for result in results)
+                for i, result in enumerate(results):
+                    if result[0] is None:
+                        self.log(f"{label}-{i + 1} 翻译失败，跳过这部分")
+                succeeded = [result for result in results if result[0] is not None]
+                if not succeeded:
+                    return None, None, total_token_usage, translated_batch
+                return (
+                    [line for result in succeeded for line in result[0]],
+                    [line for result in succeeded for line in result[1]],
+                    total_token_usage,
+                    translated_batch
+                )
+            if retry < 3:
+                self.log(f"{label}{reason}，正在重试 (第 {retry + 1} 次)...")
+                self.llm_reply_stats.record(provider, model, mode, retries=1)
+        return None, None, total_token_usage, translated_batch
 
+    def covered_input_keys(self, translated_batch, context):
+        """返回AI回复中能重建出字幕的句子所覆盖的原文行键(时间戳，紧凑协议下为行号)"""
+        try:
+            parsed_response = json.loads(translated_batch) if isinstance(translated_batch, str) else translated_batch
+            sentences = parsed_response.get('translatedSentences') or []
+        except (ValueError, AttributeError):
+            return set()
+        covered = set()
+        for sentence_obj in sentences:
+            try:
+                related_items = self.expand_sentence_obj(sentence_obj, context)['relatedInputItems']
+                keys = [item['timestamp'] for item in related_items]
+            except (KeyError, TypeError):
+                continue
+            # 与reconstruct_ass_from_response一致：首尾行都能对应上才会生成字幕
+            if keys and keys[0] in context and keys[-1] in context:
+                covered.update(key for key in keys if key in context)
+        return covered
+
+    def request_missing_lines(self, label, batch_lines, missing_lines, input_count, current_lines, translation_line,
+                              line_sink=None, memory_scope=None):
+        """
+        AI漏译的行单独补充请求一次，每行附带前面几行原文作为上下文，译文与已有结果按开始时间合并，
+        返回(合并后的ASS行, 翻译日志, 补充请求的token消耗)
+        """
+        covered_count = input_count - len(missing_lines)
+        self.log(f"{label}译文覆盖 {covered_count}/{input_count} 行({covered_count / input_count:.0%})，"
+                 f"漏译的 {len(missing_lines)} 行单独补充请求")
+
+        # 每个漏译行前面的几行原文作为上下文，只供理解语境
+        neighbor_count = self.context_overlap_lines or 2
+        missing = set(missing_lines)
+        neighbor_lines = []
+        for i, line in enumerate(batch_lines):
+            if line not in missing:
+                continue
+            for neighbor in batch_lines[max(0, i - neighbor_count):i]:
+                if neighbor not in missing and neighbor not in neighbor_lines:
+                    neighbor_lines.append(neighbor)
+
+        result = self.request_batch_translation(f"{label}-漏译", missing_lines, neighbor_lines, line_sink, memory_scope,
+                                                check_coverage=False)
+        if result[0] is None:
+            self.log(f"{label}-漏译 补充请求失败，{len(missing_lines)} 行仍未翻译")
+            return current_lines, translation_line, result[2]
+        merged_lines = sorted(
+            current_lines + result[0],
+            key=lambda line: self.ass_time_to_seconds(line.split(',', 2)[1])
+        )
+        return merged_lines, translation_line + result[1], result[2]
+
+    def salvage_translated_sentences(self, translated_batch, context):
+        """从截断或格式有误的回复中找出所有完整且能对应到本批原文的句子，返回展开成relatedInputItems形式的句子对象"""
+        sentences = []
+        for sentence_obj in salvage_sentence_objects(translated_batch or "", clean=self.clean_json_string):
+            try:
+                sentence_obj = self.expand_sentence_obj(sentence_obj, context)
+                related_items = sentence_obj['relatedInputItems']
+                if not isinstance(sentence_obj['sentence'], str) or not related_items:
+                    continue
+                if all(item['timestamp'] in context and isinstance(item['text'], str) for item in related_items):
+                    sentences.append(sentence_obj)
+            except (KeyError, TypeError):
+                continue
+        return sentences
+
+    def log_reply_stats(self):
+        """输出当前服务商/模型按回复格式累计的回复解析统计，两种格式都有记录时比较每次回复额外发出的请求数"""
+        provider, model = self.provider_var.get(), self.ai_model
+        extra_per_reply = {}
+        for mode in ("json_object", "json_schema"):
+            stats = self.llm_reply_stats.get(provider, model, mode)
+            replies = stats.get('replies', 0)
+            if not replies:
+                continue
+            problems = replies - stats.get('parsed', 0)
+            extra_requests = (stats.get('retries', 0) + stats.get('splits', 0)
+                              + stats.get('followups', 0) + stats.get('coverage_followups', 0))
+            extra_per_reply[mode] = extra_requests / replies
+            coverage_text = ""
+            if stats.get('input_lines'):
+                coverage_text = (f"，原文覆盖率 {stats.get('covered_lines', 0) / stats['input_lines']:.1%}"
+                                 f"(漏译补充请求 {stats.get('coverage_followups', 0)} 次，{stats.get('missing_lines', 0)} 行)")
+            self.log(
+                f"{provider}/{model}({mode}) 累计回复 {replies} 次，直接解析 {stats.get('parsed', 0)} 次，"
+                f"修复后解析 {stats.get('repaired', 0)} 次，部分恢复 {stats.get('salvaged', 0)} 次(共 {stats.get('salvaged_lines', 0)} 行)，"
+                f"无法恢复 {stats.get('unrecoverable', 0)} 次，其中截断 {stats.get('truncated', 0)} 次；"
+                f"补充请求 {stats.get('followups', 0)} 次({stats.get('followup_lines', 0)} 行)，"
+                f"整批重试 {stats.get('retries', 0)} 次，拆分 {stats.get('splits', 0)} 次，问题回复占 {problems / replies:.1%}{coverage_text}"
+            )
+        if len(extra_per_reply) == 2:
+            saved = extra_per_reply["json_object"] - extra_per_reply["json_schema"]
+            self.log(f"结构化输出平均每次回复额外请求 {extra_per_reply['json_schema']:.2f} 次，"
+                     f"json_object为 {extra_per_reply['json_object']:.2f} 次，每次回复少发 {saved:.2f} 次重试类请求")
+
+    def log_summary_reply_stats(self):
+        """在时间段总结选项卡输出当前服务商/模型的总结回复解析统计，与翻译回复分开记录"""
+        provider, model = self.provider_var.get(), self.ai_model
+        for mode in ("json_object", "json_schema"):
+            stats = self.llm_reply_stats.get(provider, model, f"summary-{mode}")
+            if not stats:
+                continue
+            message = (f"{provider}/{model}(总结，{mode}) 累计回复 {stats.get('replies', 0)} 次，"
+                       f"直接解析 {stats.get('parsed', 0)} 次，修复后解析 {stats.get('repaired', 0)} 次，"
+                       f"无法解析 {stats.get('unrecoverable', 0)} 次，请求失败 {stats.get('request_failures', 0)} 次")
+            self.root.after(0, lambda message=message: self.log_segment(message))
+
+    def estimate_line_output_tokens(self, line, compact=None):
+        """
+        估算一行字幕在AI返回中占用的输出token：译文和句子对象的结构，
+        原有格式还要加上原样回填的时间戳和原文，紧凑协议只回填行号
+        """
+        dialogue = self.parse_ass_dialogue(line)
+        if not dialogue:
+            return 0
+        if compact is None:
+            compact = self.is_compact_protocol.get()
+        if compact:
+            return estimate_tokens(dialogue['Text']) + 6
+        item = json.dumps({"timestamp": dialogue['Start'], "text": dialogue['Text']}, ensure_ascii=False)
+        return estimate_tokens(item) + estimate_tokens(dialogue['Text']) + 8
+
+    def estimate_prompt_tokens(self, batch_text, context_lines=None, term_prompt=""):
+        """估算一次请求的提示token：系统提示词、本批命中的预设术语、对话历史(逐批模式的概要、术语表和最近一轮)和本批原文"""
+        total = estimate_tokens(self.system_prompt) + estimate_tokens(term_prompt) + estimate_tokens(batch_text)
+        if context_lines is None:
+            total += estimate_tokens(self.get_glossary_request_prompt()) + self.translation_history.token_count()
+        else:
+            total += sum(estimate_tokens(line) for line in context_lines)
+        return total
+
+    def get_translation_token_budget(self):
+        """当前模型每批的预计输出token上限，0表示只按行数分批"""
+        return self.model_token_budgets.get(self.ai_model, self.translation_token_budget)
+
+    def postprocess_translated_lines(self, current_batch_lines):
+        """用当前预设的改写规则处理重建后的ASS行的文本部分，格式不对的行保持原样"""
+        translated_lines = [str(line).strip() for line in current_batch_lines if str(line).strip()]
+        return self.current_rewriter().rewrite_ass_lines(translated_lines)
+
+    def iter_concurrent_translations(self, indexed_batches, total_batches, concurrency, control=None, all_batches=None):
+        """
+        并发翻译：最多concurrency个批次同时请求，按批次顺序产出(批次序号, 原文行, 翻译结果)；
+        每批附带上一批末尾context_overlap_lines行原文作为上下文，代替串行模式的对话历史；
+        断点续传时只提交部分批次，传入all_batches以便从完整批次列表中取上一批
+        """
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        pending = deque()
+        previous_lines = []
+
+        def collect(item):
+            batch_num, batch_lines, future = item
+            return batch_num, batch_lines, future.result()
+
+        try:
+            for batch_num, batch_lines in indexed_batches:
+                if all_batches is not None:
+                    previous_lines = all_batches[batch_num - 1] if batch_num > 0 else []
+                context_lines = previous_lines[-self.context_overlap_lines:] if self.context_overlap_lines > 0 else []
+                pending.append((batch_num, batch_lines,
+                                executor.submit(self.translate_batch, batch_num, batch_lines, total_batches,
+                                                context_lines, control)))
+                previous_lines = batch_lines
+                # 先完成的批次只要前面的批次都已写出就立即产出
+                while pending and pending[0][2].done():
+                    yield collect(pending.popleft())
+                # 排队的批次过多时等待最早的批次，流水线模式下不会一次提交过多
+                while len(pending) >= concurrency * 2:
+                    yield collect(pending.popleft())
+            while pending:
+                yield collect(pending.popleft())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_translation_concurrency(self):
+        try:
+            return max(int(self.translation_concurrency_var.get()), 1)
+        except ValueError:
+            return 1
+
+    def store_translation_concurrency(self):
+        """把界面上的并发数写回当前服务商配置，切换服务商前调用，避免未保存的修改丢失"""
+        provider_config = self.providers.get(self.provider_var.get())
+        if provider_config is not None:
+            provider_config["max_concurrency"] = self.get_translation_concurrency()
+
+    def load_translation_concurrency(self):
+        """把当前服务商配置中的并发数显示到界面"""
+        provider_config = self.providers.get(self.provider_var.get(), {})
+        self.translation_concurrency_var.set(str(provider_config.get("max_concurrency", 4)))
+
+    def on_concurrent_translation_toggle(self):
+        """并发翻译勾选框切换事件"""
+        if self.is_concurrent_translation.get():
+            self.log(f"并发翻译已启用，当前服务商同时翻译 {self.get_translation_concurrency()} 批")
+        else:
+            self.log("并发翻译未启用，逐批翻译并保留对话历史")
+
+    def on_streaming_response_toggle(self):
+        """流式输出勾选框切换事件"""
+        if self.is_streaming_response.get():
+            self.log(f"流式输出已启用，逐批翻译时每句译文一返回就写入字幕，超过 {self.llm_stall_timeout} 秒没有新内容则重试")
+        else:
+            self.log("流式输出未启用，等待完整回复后再处理")
+
+    def on_translation_memory_toggle(self):
+        """翻译记忆勾选框切换事件"""
+        if self.is_translation_memory.get():
+            self.log("翻译记忆已启用，当前预设下翻译过的字幕行将直接复用译文，只把新行发给AI")
+        else:
+            self.log("翻译记忆未启用")
+
+    def on_compact_protocol_toggle(self):
+        """紧凑协议勾选框切换事件"""
+        if self.is_compact_protocol.get():
+            self.log("紧凑协议已启用，字幕以行号收发，AI只回填行号；提示词后会自动附加格式说明")
+        else:
+            self.log("紧凑协议未启用，按预设提示词中的时间戳格式收发")
+
+    def on_structured_output_toggle(self):
+        """结构化输出勾选框切换事件"""
+        provider = self.provider_var.get()
+        if not self.is_structured_output.get():
+            self.log("结构化输出未启用，按json_object格式请求，回复结构由提示词约束")
+        elif self.response_format_mode(provider) == "json_schema":
+            self.log(f"结构化输出已启用，{provider} 的翻译和总结请求将附带json_schema，回复结构由服务商保证")
+        else:
+            self.log(f"结构化输出已启用，但 {provider} 未标记支持json_schema，仍按json_object请求")
+
+    def response_format_mode(self, provider=None, model=None):
+        """
+        启用结构化输出且服务商配置中json_schema为True时返回json_schema，否则返回json_object；
+        本次运行中已被服务商拒绝过json_schema的模型也返回json_object
+        """
+        provider = provider or self.provider_var.get()
+        provider_config = self.providers.get(provider, {})
+        if (self.is_structured_output.get() and provider_config.get("json_schema", False)
+                and (provider, model or self.ai_model) not in self.schema_unsupported_models):
+            return "json_schema"
+        return "json_object"
+
+    def show_translation_memory_stats(self):
+        """在日志中输出翻译记忆的命中情况和条目数"""
+        stats = self.translation_memory.stats(self.current_preset)
+        limit = stats['max_entries'] if stats['max_entries'] else "不限"
+        self.log(f"翻译记忆: 本次命中{stats['hits']}行，未命中{stats['misses']}行，"
+                 f"当前预设{stats['preset_entries']}条，共{stats['entries']}条/{limit}")
+
+    def current_glossary(self):
+        """当前预设的术语表{原文: 译文}"""
+        return self.glossaries.get(self.current_preset) or {}
+
+    def current_glossary_index(self):
+        """返回(当前预设术语表的匹配索引, 整张术语表注入时的预计token)，术语表替换后重新构建"""
+        glossary = self.current_glossary()
+        cached = self._glossary_index
+        if cached is None or cached[0] is not glossary:
+            index = GlossaryIndex(glossary)
+            cached = self._glossary_index = (glossary, index, estimate_tokens(self.format_term_prompt(index.entries)))
+        return cached[1], cached[2]
+
+    def format_term_prompt(self, entries):
+        """附加在系统提示词后的预设术语，没有条目时为空字符串"""
+        if not entries:
+            return ""
+        terms = "\n".join(f"{source} → {target}" for source, target in entries.items())
+        return f"\n\n**本批原文中出现的固定译名，请严格按此翻译：**\n{terms}"
+
+    def build_term_prompt(self, label, texts):
+        """扫描本批原文，只把出现的预设术语拼成提示，并记录注入条数和比附带整表节省的token"""
+        index, full_tokens = self.current_glossary_index()
+        if not len(index):
+            return ""
+        matched = index.find(texts)
+        term_prompt = self.format_term_prompt({source: index.entries[source] for source in matched})
+        injected_tokens = estimate_tokens(term_prompt)
+        self.log(f"{label}: 术语表命中 {len(matched)}/{len(index)} 条，注入约 {injected_tokens} token，"
+                 f"比附带整张术语表少约 {full_tokens - injected_tokens} token")
+        return term_prompt
+
+    def edit_glossary(self):
+        """编辑当前预设的术语表，每行一条 原文=译文"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"术语表 - {self.current_preset}")
+
+        # 将对话框居中显示在主窗口
+        dialog.transient(self.root)
+        dialog.grab_set()
+        dialog.update_idletasks()
+        x = self.root.winfo_x() + (self.root.winfo_width() // 2) - (600 // 2)
+        y = self.root.winfo_y() + (self.root.winfo_height() // 2) - (500 // 2)
+        dialog.geometry(f"600x500+{x}+{y}")
+
+        ttk.Label(dialog, text="每行一条，格式为 原文=译文（也可用制表符或→分隔），#开头的行为注释。\n"
+                               "翻译时每批只附带原文中出现的条目，不必再把整张术语表写进提示词。").pack(pady=10)
+        text_frame = ttk.Frame(dialog)
+        text_frame.pack(fill="both", expand=True, padx=10)
+        glossary_text = tk.Text(text_frame, wrap="none", font=("苹方 中等", 10))
+        scrollbar = ttk.Scrollbar(text_frame, orient="vertical", command=glossary_text.yview)
+        glossary_text.configure(yscrollcommand=scrollbar.set)
+        glossary_text.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        glossary_text.insert("1.0", format_glossary(self.current_glossary()))
+
+        def save_and_close():
+            entries = parse_glossary(glossary_text.get("1.0", tk.END))
+            if entries:
+                self.glossaries[self.current_preset] = entries
+            else:
+                self.glossaries.pop(self.current_preset, None)
+            self.save_config()
+            dialog.destroy()
+            self.log(f"预设 '{self.current_preset}' 的术语表已保存，共 {len(entries)} 条")
+
+        ttk.Button(dialog, text="保存", command=save_and_close).pack(pady=5)
+        dialog.update_idletasks()
+
+    def current_rewrite_rules(self):
+        """当前预设的译文改写规则，没有设置时为默认的标点处理；保存为空列表表示不做任何改写"""
+        if self.current_preset in self.rewrite_rules:
+            return self.rewrite_rules[self.current_preset]
+        return GUI_DEFAULT_RULES
+
+    def current_rewriter(self):
+        """编译后的当前预设改写规则，规则替换后重新编译"""
+        rules = self.current_rewrite_rules()
+        cached = self._rewriter
+        if cached is None or cached[0] is not rules:
+            cached = self._rewriter = (rules, RewriteRules(rules))
+        return cached[1]
+
+    def edit_rewrite_rules(self):
+        """编辑当前预设的译文改写规则，可先对已有的_readytogo.ass试运行预览效果"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title(f"译文改写规则 - {self.current_preset}")
+
+        # 将对话框居中显示在主窗口
+        dialog.transient(self.root)
+        dialog.grab_set()
+        dialog.update_idletasks()
+        x = self.root.winfo_x() + (self.root.winfo_width() // 2) - (700 // 2)
+        y = self.root.winfo_y() + (self.root.winfo_height() // 2) - (600 // 2)
+        dialog.geometry(f"700x600+{x}+{y}")
+
+        ttk.Label(dialog, text="每行一条，格式为 模式 => 替换，re:开头的模式为正则表达式，#开头的行为注释。\n"
+                               "首尾有空格或为空的内容用双引号括起，如 ， => \" \"；同一位置按顺序取第一条能匹配的规则。").pack(pady=10)
+        text_frame = ttk.Frame(dialog)
+        text_frame.pack(fill="both", expand=True, padx=10)
+        rules_text = tk.Text(text_frame, wrap="none", font=("苹方 中等", 10), height=12)
+        scrollbar = ttk.Scrollbar(text_frame, orient="vertical", command=rules_text.yview)
+        rules_text.configure(yscrollcommand=scrollbar.set)
+        rules_text.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        rules_text.insert("1.0", format_rules(self.current_rewrite_rules()))
+
+        preview_text = tk.Text(dialog, wrap="none", font=("苹方 中等", 9), height=10, state="disabled")
+        preview_text.pack(fill="both", expand=True, padx=10, pady=(5, 0))
+
+        def read_rules():
+            try:
+                return parse_rules(rules_text.get("1.0", tk.END))
+            except ValueError as e:
+                messagebox.showerror("规则有误", str(e), parent=dialog)
+                return None
+
+        def preview():
+            rules = read_rules()
+            if rules is None:
+                return
+            file_path = filedialog.askopenfilename(
+                parent=dialog,
+                title="选择要预览的字幕",
+                filetypes=[("翻译结果", "*_readytogo.ass"), ("ASS字幕", "*.ass"), ("所有文件", "*.*")]
+            )
+            if not file_path:
+                return
+            with open(file_path, 'r', encoding='utf-8') as f:
+                _, dialogue_lines = self.split_ass_header(f.readlines())
+            lines = [line.rstrip('\r\n') for line in dialogue_lines]
+
+            # 只改写译文(对话样式)的行，不写回文件
+            start = time.perf_counter()
+            rewritten = RewriteRules(rules).rewrite_ass_lines(lines, style="对话")
+            elapsed = (time.perf_counter() - start) * 1000
+            changes = [(old, new) for old, new in zip(lines, rewritten) if old != new]
+
+            summary = f"试运行: {len(lines)} 行中有 {len(changes)} 行会被改写，编译和改写共用时 {elapsed:.1f} ms"
+            samples = "\n".join(f"- {old.split(',', 9)[-1]}\n+ {new.split(',', 9)[-1]}" for old, new in changes[:50])
+            preview_text.configure(state="normal")
+            preview_text.delete("1.0", tk.END)
+            preview_text.insert("1.0", f"{summary}\n\n{samples}")
+            preview_text.configure(state="disabled")
+            self.log(f"{os.path.basename(file_path)} {summary}")
+
+        def restore_defaults():
+            rules_text.delete("1.0", tk.END)
+            rules_text.insert("1.0", format_rules(GUI_DEFAULT_RULES))
+
+        def save_and_close():
+            rules = read_rules()
+            if rules is None:
+                return
+            if rules != GUI_DEFAULT_RULES:
+                self.rewrite_rules[self.current_preset] = rules
+            else:
+                self.rewrite_rules.pop(self.current_preset, None)
+            self.save_config()
+            dialog.destroy()
+            self.log(f"预设 '{self.current_preset}' 的译文改写规则已保存，共 {len(rules)} 条")
+
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(pady=5)
+        ttk.Button(button_frame, text="试运行预览", command=preview).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="恢复默认", command=restore_defaults).pack(side="left", padx=5)
+        ttk.Button(button_frame, text="保存", command=save_and_close).pack(side="left", padx=5)
+        dialog.update_idletasks()
+
+    def translation_memory_scope(self):
+        """翻译记忆按预设、服务商、模型和提示词隔离，术语表改动也视为提示词改动"""
+        return TranslationMemory.make_scope(self.current_preset, self.provider_var.get(), self.ai_model,
+                                            self.system_prompt + format_glossary(self.current_glossary()))
+
+    def apply_translation_memory(self, batch_lines, scope):
+        """
+        用翻译记忆预填本批字幕，返回(未命中的原文行, 命中行重建的ASS行, 命中行的翻译日志)
+        """
+        dialogues = [(line, self.parse_ass_dialogue(line)) for line in batch_lines]
+        found = self.translation_memory.lookup(scope, [dialogue['Text'] for _, dialogue in dialogues if dialogue])
+        if not found:
+            return batch_lines, [], []
+
+        miss_lines = []
+        sentences = []
+        context = {}
+        for index, (line, dialogue) in enumerate(dialogues):
+            if dialogue and dialogue['Text'] in found:
+                # 按行序号关联，开始时间相同的行互不覆盖
+                sentences.append({
+                    'sentence': found[dialogue['Text']],
+                    'relatedInputItems': [{'timestamp': index, 'text': dialogue['Text']}]
+                })
+                context[index] = dialogue
+            else:
+                miss_lines.append(line)
+        memory_lines, memory_log = self.reconstruct_ass_from_response({'translatedSentences': sentences}, context)
+        return miss_lines, memory_lines, memory_log
+
+    def learn_translation_memory(self, scope, translated_batch, context):
+        """把AI返回中一句对应一行原文的译文存入翻译记忆，多行合并的句子不记录"""
+        try:
+            parsed_response = json.loads(translated_batch) if isinstance(translated_batch, str) else translated_batch
+            pairs = []
+            for sentence_obj in parsed_response.get('translatedSentences', []):
+                sentence_obj = self.expand_sentence_obj(sentence_obj, context)
+                related_items = sentence_obj.get('relatedInputItems') or []
+                if len(related_items) != 1:
+                    continue
+                timestamp = related_items[0].get('timestamp')
+                if timestamp in context and sentence_obj.get('sentence'):
+                    pairs.append((context[timestamp]['Text'], sentence_obj['sentence']))
+            self.translation_memory.store(scope, pairs)
+        except Exception as e:
+            self.log(f"写入翻译记忆失败: {str(e)}")
+
+    def split_ass_header(self, lines):
+        """以第一个Dialogue行为界，把ASS文件分成头部和对话两部分"""
+        # 找到第一个 Dialogue 行出现的位置
+        first_dialogue_index = -1
+        # 1. 遍历列表，找到第一个Dialogue行的索引
+        for i, line in enumerate(lines):
+            if line.strip().startswith('Dialogue:'):
+                first_dialogue_index = i
+                break
+                
+        # 2. 根据索引分割列表
+        if first_dialogue_index == -1:
+            # 文件中没有Dialogue行，整个文件都是头部
+            return lines, []
+        # 分别存储头部信息和原文用于最后输出
+        return lines[:first_dialogue_index], lines[first_dialogue_index:]
+
+    def iter_queued_lines(self, line_queue, received_lines):
+        """流水线模式：从队列逐行产出听写出的Dialogue行，收到None表示听写结束"""
+        while True:
+            line = line_queue.get()
+            if line is None:
+                break
+            received_lines.append(line)
+            yield line
+
+    def call_ai_translation_api(self, content, context_lines=None, on_sentence=None, compact=False, term_prompt=""):
+        """
+        调用AI翻译API，经服务商限流器发出，失败时按错误类型退避重试
+        context_lines为None时带上对话历史；否则为并发模式，不使用对话历史，非空时先附上上文原文
+        compact为True时在系统提示词后附加紧凑协议的格式说明，term_prompt为本批命中的预设术语，附加在系统提示词后
+        流式输出模式下on_sentence(sentence_obj)在每个translatedSentences对象闭合时调用，重试时会重复收到已返回过的句子
+        启用结构化输出且服务商支持时以json_schema约束回复结构
+        返回(清理后的回复, token消耗, {finish_reason, prompt_tokens, completion_tokens, raw_valid, response_format})，失败时回复为None
+        """
         # 获取当前服务商配置
         selected_provider = self.provider_var.get()
         provider_config = self.providers.get(selected_provider, self.providers["DeepSeek"])
         api_url = provider_config["api_url"]
         ai_model = self.ai_model
 
-        for attempt in range(max_retries):
-            # 全都用OpenAI SDK库调用            
+        # 全都用OpenAI SDK库调用            
+        client = self.llm_clients.get(selected_provider, api_url, self.current_api_key)
+        system_prompt = self.system_prompt + self.get_compact_protocol_prompt() if compact else self.system_prompt
+        system_prompt += term_prompt
+        structured = self.response_format_mode(selected_provider) == "json_schema"
+        if context_lines is not None:
+            messages = [{"role": "system", "content": system_prompt}]
+            context_text = "\n".join(
+                dialogue['Text'] for dialogue in map(self.parse_ass_dialogue, context_lines) if dialogue
+            )
+            if context_text:
+                messages.append({"role": "user", "content": f"以下是上文的原文，仅供理解语境，不需要翻译：\n{context_text}"})
+            messages.append({"role": "user", "content": content})
+        else:
+            # 逐批模式：较早的轮次折叠成剧情概要和术语表附在系统提示词后，只原样带上最近一轮
+            history = self.translation_history
+            messages = [{"role": "system",
+                         "content": system_prompt + self.get_glossary_request_prompt(structured)
+                                    + history.summary_prompt() + history.glossary_prompt()}]
+            # 添加历史消息
+            messages.extend(history.messages())
+            # 添加当前用户消息
+            messages.append({"role": "user", "content": content})
+        request = {
+            "model": ai_model,
+            "messages": messages,
+            # "reasoning_effort": "medium",
+            # 结构化输出模式下由服务商按json_schema保证回复结构，逐批模式的术语表一并约束
+            "response_format": (translation_response_format(compact, glossary=context_lines is None)
+                                if structured else {"type": "json_object"}),
+            "temperature": self.temperature
+        }
+        if "gemini" not in self.ai_model:
+            request["max_tokens"] = 8192
+
+        def make_sentence_parser():
+            # 每次请求(含重试)都用新的解析器，从头解析流式回复
+            parser = SentenceStreamParser(clean=self.clean_json_string)
+            return lambda text: [on_sentence(obj) for obj in parser.feed(text)]
+
+        make_on_text = make_sentence_parser if on_sentence else None
+
+        # 译文和回填的原文大致与本批原文等长，预计用量按提示加一份本批原文估算
+        estimated_tokens = sum(estimate_tokens(message['content']) for message in messages) + estimate_tokens(content)
+        try:
+            response_text, usage, finish_reason = self.request_llm(
+                selected_provider, client, request, estimated_tokens, make_on_text
+            )
+        except Exception:
+            return None, 0, {}
+        try:
+            json.loads(response_text)
+            raw_valid = True
+        except (TypeError, ValueError):
+            raw_valid = False
+        reply_info = {
+            "finish_reason": finish_reason,
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "raw_valid": raw_valid,  # 为False时说明回复需要经clean_json_string修复或部分恢复
+            "response_format": request["response_format"]["type"]  # 服务商不支持json_schema时会回退为json_object
+        }
+        # 合法的JSON不再经过clean_json_string，避免空字符串等内容被误修复
+        return response_text if raw_valid else self.clean_json_string(response_text), usage["total_tokens"], reply_info
+
+    def request_llm(self, provider, client, request, estimated_tokens=0, make_on_text=None, log=None):
+        """
+        发出一次对话补全请求，返回(回复文本, token用量字典, finish_reason)
+        流式输出模式下流式接收，make_on_text()为每次尝试生成接收增量文本的回调；
+        录制模式下保存原始回复，回放模式下直接返回录制的回复，不经过限流器也不发出网络请求；
+        json_schema格式被服务商拒绝时回退为json_object，request中的response_format会被替换
+        """
+        log = log or self.log
+        fingerprint = LLMReplayCache.fingerprint(provider, request)
+        if self.llm_replay.replaying:
             try:
-                client = OpenAI(api_key=self.current_api_key, base_url=api_url)
-                if self.conversation_history:
-                    # 构建包含历史的消息列表
-                    messages = [{"role": "system", "content": self.system_prompt}]
-                    # 添加历史消息
-                    messages.extend(self.conversation_history)
-                    # 添加当前用户消息
-                    messages.append({"role": "user", "content": content})
-                else:
-                    messages = [
-                            {"role": "system", "content": self.system_prompt},
-                            {"role": "user", "content": content}            
-                    ] 
-                if "gemini" in self.ai_model:
-                    response = client.chat.completions.create(
-                        model=ai_model,
-                        messages=messages, 
-                        # reasoning_effort="medium", 
-                        response_format={"type": "json_object"},                    
-                        temperature=self.temperature,                        
-                        stream=False
-                    ) 
-                else:
-                    response = client.chat.completions.create(
-                        model=ai_model,
-                        messages=messages, 
-                        max_tokens=8192,                                           
-                        temperature=self.temperature,
-                        response_format={"type": "json_object"},
-                        stream=False
-                    )         
-                cleaned_string = self.clean_json_string(response.choices[0].message.content)                              
-                return cleaned_string, response.usage.total_tokens
-
-            except AuthenticationError as e:
-                if attempt < max_retries - 1:
-                    self.log(f"身份验证失败: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"身份验证失败: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-            except RateLimitError as e:
-                if attempt < max_retries - 1:
-                    self.log(f"请求频率限制: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"请求频率限制: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-            except APIError as e:
-                if attempt < max_retries - 1:
-                    self.log(f"API服务错误: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"API服务错误: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    self.log(f"未知错误: {str(e)}，{retry_delay}秒后重试...")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    self.log(f"未知错误: {str(e)}，重试{max_retries}次后仍失败")
-                    return None, 0
-        
-        self.log(f"重试{max_retries}次后仍失败")
-        return None
+                record = self.llm_replay.load(fingerprint)
+            except ReplayMiss as e:
+                log(str(e))
+                raise
+            if make_on_text:
+                make_on_text()(record["response"])
+            return record["response"], record["usage"], record["finish_reason"]
+
+        def send():
+            if self.is_streaming_response.get():
+                response_text, usage, finish_reason = stream_chat_completion(
+                    client, stall_timeout=self.llm_stall_timeout, connect_timeout=self.llm_connect_timeout,
+                    on_text=make_on_text() if make_on_text else None, **request
+                )
+            else:
+                response = client.chat.completions.create(stream=False, **request)
+                response_text, usage = response.choices[0].message.content, response.usage
+                finish_reason = response.choices[0].finish_reason
+            usage = usage_to_dict(usage)
+            return (response_text, usage, finish_reason), usage["total_tokens"]
+
+        try:
+            result = self.call_llm(provider, send, estimated_tokens, log=log)
+        except Exception as e:
+            if request["response_format"]["type"] != "json_schema" or not is_schema_unsupported(e):
+                raise
+            # 服务商或模型不接受json_schema：本次运行中该模型改用json_object重发，不改动保存的配置
+            self.schema_unsupported_models.add((provider, request["model"]))
+            log(f"{provider}/{request['model']} 不支持json_schema结构化输出，本次运行中回退为json_object")
+            request["response_format"] = {"type": "json_object"}
+            return self.request_llm(provider, client, request, estimated_tokens, make_on_text, log)
+        if self.llm_replay.recording:
+            self.llm_replay.save(fingerprint, provider, request, *result)
+        return result
+
+    def call_llm(self, provider, request, estimated_tokens=0, max_attempts=None, log=None):
+        """所有LLM请求的统一出口：按服务商配置的RPM/TPM限流，失败时指数退避重试，不可重试的错误立即抛出"""
+        provider_config = self.providers.get(provider, {})
+        return self.rate_limits.call(
+            provider, request,
+            estimated_tokens=estimated_tokens,
+            rpm=provider_config.get("rpm", 0),
+            tpm=provider_config.get("tpm", 0),
+            max_attempts=max_attempts,
+            describe=describe_llm_error,
+            log=log or self.log
+        )
 
     def parse_ass_dialogue(self, line):
         """分离ASS字幕行各元素"""
@@ -1199,8 +2270,11 @@ class TranscriptionApp:
             'MarginL': parts[5], 'MarginR': parts[6], 'MarginV': parts[7], 'Effect': parts[8], 'Text': parts[9]
         }
 
-    def prepare_input_for_api(self, dialogue_lines):   
-        """提取开始时间和文本内容喂给AI，并且准备好本地时间轴映射信息"""
+    def prepare_input_for_api(self, dialogue_lines, compact=False):   
+        """
+        提取开始时间和文本内容喂给AI，并且准备好本地时间轴映射信息
+        compact为True时用从1开始的行号代替时间戳，AI只需返回行号，开始时间相同的行也不会互相覆盖
+        """
         api_input_items = []
         context_map = {}
         
@@ -1209,20 +2283,54 @@ class TranscriptionApp:
             if dialogue_parts:
                 start_time = dialogue_parts['Start']
                 text = dialogue_parts['Text']
+                key = len(api_input_items) + 1 if compact else start_time
                 
-                api_input_items.append({
-                    "timestamp": start_time,
-                    "text": text
-                })
+                if compact:
+                    api_input_items.append({"id": key, "text": text})
+                else:
+                    api_input_items.append({
+                        "timestamp": start_time,
+                        "text": text
+                    })
                 
-                # 此处注意，我们将解析出的字典存入context，而不是原始行
-                context_map[start_time] = dialogue_parts
+                # 此处注意，我们将解析出的字典存入context，而不是原始行；原始行另存一份供拆分批次时使用
+                context_map[key] = dict(dialogue_parts, Line=line)
                 
         return api_input_items, context_map
 
-    def reconstruct_ass_from_response(self, api_response, context_map):
+    def format_api_input(self, api_input, compact=False):
+        """紧凑协议不缩进、不留空格"""
+        if compact:
+            return json.dumps(api_input, ensure_ascii=False, separators=(',', ':'))
+        return json.dumps(api_input, indent=2, ensure_ascii=False)
+
+    def get_compact_protocol_prompt(self):
+        """紧凑协议的格式说明，附加在预设提示词之后，覆盖其中关于输入输出格式的描述"""
+        return """
+
+**本次请求使用紧凑格式，以下格式说明优先于上文：**
+输入是JSON数组，每项为{"id":行号,"text":原文}。
+输出JSON对象：{"translatedSentences":[{"sentence":"译文","ids":[该句对应的行号,...]}]}
+ids按顺序列出该句译文覆盖的全部行号，不要回填原文和时间戳，不要输出多余的空格和换行。"""
+
+    def expand_sentence_obj(self, sentence_obj, context_map):
+        """把紧凑协议返回的{"sentence","ids"}展开成{"sentence","relatedInputItems"}，原有格式原样返回"""
+        if 'ids' not in sentence_obj:
+            return sentence_obj
+        related_items = []
+        for line_id in sentence_obj['ids']:
+            try:
+                line_id = int(line_id)
+            except (TypeError, ValueError):
+                continue
+            if line_id in context_map:
+                related_items.append({'timestamp': line_id, 'text': context_map[line_id]['Text']})
+        return {'sentence': sentence_obj['sentence'], 'relatedInputItems': related_items}
+
+    def reconstruct_ass_from_response(self, api_response, context_map, skip_timestamps=None):
         """
         根据API返回结果重建ASS,直接将原始头部和新生成的Dialogue行拼接。
+        skip_timestamps中的时间戳为首的句子已经流式写出，跳过；紧凑协议下时间戳即行号
         """
         if isinstance(api_response, str):
             try:
@@ -1245,6 +2353,7 @@ class TranscriptionApp:
             return None, None # 返回 None, None 表示解析失败
         
         for sentence_obj in parsed_response['translatedSentences']:
+            sentence_obj = self.expand_sentence_obj(sentence_obj, context_map)
             translated_text = sentence_obj['sentence']
             related_items = sentence_obj['relatedInputItems']
             
@@ -1252,6 +2361,8 @@ class TranscriptionApp:
                 continue
                 
             first_item_timestamp = related_items[0]['timestamp']
+            if skip_timestamps and first_item_timestamp in skip_timestamps:
+                continue
             last_item_timestamp = related_items[-1]['timestamp']
             
             # 确保时间戳在context_map中存在
@@ -1279,6 +2390,8 @@ class TranscriptionApp:
  
     def ask_is_available(self):
         """查询当前API密钥余额状态"""
+        if self.llm_replay.replaying:
+            return "回放模式未查询"
         try:
             selected_provider = self.provider_var.get()
             provider_config = self.providers.get(selected_provider, self.providers["DeepSeek"])
@@ -1309,14 +2422,20 @@ class TranscriptionApp:
         except Exception as e:
             return f"查询余额异常: {str(e)}"
         
-    def add_to_conversation_history(self, role, content):
-        """添加消息到对话历史，并限制历史长度"""
-        self.conversation_history.append({"role": role, "content": content})
-        
-        # 限制历史长度
-        if len(self.conversation_history) > self.max_history :  
-            # 保留最新的消息，移除最旧的消息
-            self.conversation_history = self.conversation_history[-self.max_history:]
+    def get_glossary_request_prompt(self, structured=False):
+        """
+        逐批翻译时要求AI顺带返回本批确定的术语译法和更新后的剧情概要，供后续批次的术语表和概要使用；
+        结构化输出的schema中术语表为数组形式
+        """
+        summary_request = """
+**并在"summary"字段中结合前文剧情概要(如有)和本批内容，用不超过150字概括截至本批的剧情、人物关系和话题，供翻译后续批次参考。**"""
+        if structured:
+            return """
+
+**另外请在返回的JSON对象的"glossary"字段中以[{"source": "原文", "target": "译文"}]列出本批中新出现或首次确定译法的人名、地名、作品名和专有术语，没有则返回[]。**""" + summary_request
+        return """
+
+**另外请在返回的JSON对象中加入"glossary"字段：{"原文": "译文"}，只列出本批中新出现或首次确定译法的人名、地名、作品名和专有术语，没有则返回{}。**""" + summary_request
 
     def clean_json_string(self, raw_string: str) -> str:
         """
@@ -1417,27 +2536,46 @@ class TranscriptionApp:
             self.log("用户取消解密，分段分析未启动")
             return
   
-    def run_segment_summary_analysis(self):
-        """执行分段分析"""
+    def run_segment_summary_analysis(self, subtitle_file=None, line_queue=None, control=None):
+        """
+        执行分段分析
+        传入line_queue时为流水线模式：听写进度越过某个时间窗口的结束时间后立即分析该窗口
+        每个时间段开始前检查暂停和取消，取消时导出已完成的时间段
+        全部时间段分析成功时返回True，出错、取消或有时间段分析失败时返回False
+        """
+        failed_windows = 0
+        cancelled = False
+        control = self.start_job_control("summary", control)
         try:
-            ass_file_path = self.subtitle_file_var.get()
+            ass_file_path = subtitle_file or self.subtitle_file_var.get()
             time_window_minutes = int(self.time_window_var.get())
             
-            # 解析ASS文件
-            segments = self.parse_ass_file(ass_file_path)
-            if not segments:
-                self.root.after(0, lambda: self.log_segment("错误: 无法解析ASS文件或文件中没有对话内容"))
-                return
-            
-            # 按时间窗口分段
-            time_windows = self.segment_by_time_window(segments, time_window_minutes)
-            self.log_segment(f"已将文件分为 {len(time_windows)} 个 {time_window_minutes} 分钟的时间段")
+            if line_queue is None:
+                # 解析ASS文件
+                segments = self.parse_ass_file(ass_file_path)
+                if not segments:
+                    self.root.after(0, lambda: self.log_segment("错误: 无法解析ASS文件或文件中没有对话内容"))
+                    return False
+                
+                # 按时间窗口分段
+                time_windows = self.segment_by_time_window(segments, time_window_minutes)
+                self.log_segment(f"已将文件分为 {len(time_windows)} 个 {time_window_minutes} 分钟的时间段")
+            else:
+                time_windows = self.iter_queued_time_windows(line_queue, time_window_minutes)
+                self.log_segment(f"流水线总结已就绪，听写每越过一个 {time_window_minutes} 分钟时间段就开始分析")
             
             # 清空之前的结果
             self.segment_results = []
             
             # 对每个时间段进行分析
             for i, window_segments in enumerate(time_windows):
+                try:
+                    control.checkpoint()
+                except JobCancelled:
+                    self.root.after(0, lambda: self.log_segment("分段总结已取消，导出已完成的时间段"))
+                    cancelled = True
+                    break
+
                 # 构建时间段文本
                 window_text = self.build_window_text(window_segments)
                 
@@ -1452,10 +2590,11 @@ class TranscriptionApp:
                     # 在UI中显示结果（包含时间段编号信息）
                     self.root.after(0, lambda idx=i+1, summary=segment_summary: self.display_segment_results(idx, summary))
                 else:
+                    failed_windows += 1
                     self.root.after(0, lambda idx=i+1: self.log_segment(f"第 {idx} 个时间段分析失败"))
 
             self.root.after(0, lambda: self.log_segment(f"分析完成！共分析了 {len(self.segment_results)} 个时间段"))
-            subtitle_file = self.subtitle_file_var.get()
+            subtitle_file = ass_file_path
             base_name = os.path.splitext(os.path.basename(subtitle_file))[0]
             output_dir = os.path.dirname(subtitle_file)
             output_file = os.path.join(output_dir, f"{base_name}_segment_summary.txt") 
@@ -1481,9 +2620,13 @@ class TranscriptionApp:
                 
                 normalized_path = output_file.replace('/', '\\')
                 self.log_segment(f"结果已导出到: {normalized_path}")
+            self.log_summary_reply_stats()
+            return not (failed_windows or cancelled)
         except Exception as e:
             self.root.after(0, lambda: self.log_segment(f"分析过程中出错: {str(e)}"))
-        # finally:
+            return False
+        finally:
+            self.finish_job_control("summary", control)
         #     self.root.after(0, lambda: self.start_segment_btn.config(state=tk.NORMAL))
     
     def parse_ass_file(self, file_path):
@@ -1540,6 +2683,49 @@ class TranscriptionApp:
         
         return windows
     
+    def iter_queued_time_windows(self, line_queue, window_minutes):
+        """
+        流水线模式：从队列接收听写出的Dialogue行，某个时间窗口的结束时间被越过后产出该窗口的对话，
+        窗口划分与segment_by_time_window一致（跨窗口的对话会同时出现在相邻两个窗口）
+        """
+        window_seconds = window_minutes * 60
+        window_start = None
+        pending = []  # 可能还属于当前及之后窗口的对话
+
+        def current_window():
+            window_end = window_start + window_seconds
+            return [segment for segment in pending
+                    if self.ass_time_to_seconds(segment['End']) > window_start
+                    and self.ass_time_to_seconds(segment['Start']) < window_end]
+
+        while True:
+            line = line_queue.get()
+            if line is None:
+                break
+            segment = self.parse_ass_dialogue(line)
+            if not segment:
+                continue
+            seg_start = self.ass_time_to_seconds(segment['Start'])
+            if window_start is None:
+                window_start = seg_start
+
+            # 听写结果按时间顺序到达，开始时间越过窗口结束说明该窗口内容已完整
+            while seg_start >= window_start + window_seconds:
+                window_segments = current_window()
+                if window_segments:
+                    yield window_segments
+                window_start += window_seconds
+                pending = [s for s in pending if self.ass_time_to_seconds(s['End']) > window_start]
+            pending.append(segment)
+
+        # 听写结束，分析剩余的窗口
+        while pending:
+            window_segments = current_window()
+            if window_segments:
+                yield window_segments
+            window_start += window_seconds
+            pending = [s for s in pending if self.ass_time_to_seconds(s['End']) > window_start]
+
     def ass_time_to_seconds(self, ass_time):
         """将ASS时间格式转换为秒数"""
         try:
@@ -1592,28 +2778,43 @@ class TranscriptionApp:
             ]
             
             # 调用API
-            client = OpenAI(api_key=self.current_api_key, base_url=api_url)
-            if "gemini" in self.ai_model:
-                response = client.chat.completions.create(
-                    model=ai_model,
-                    messages=messages, 
-                    # reasoning_effort="medium",
-                    response_format={"type": "json_object"},                    
-                    temperature=0.7,                        
-                    stream=False
-                )
-            else:
-                response = client.chat.completions.create(
-                    model=ai_model,
-                    messages=messages, 
-                    max_tokens=8192,                                           
-                    temperature=0.7,
-                    response_format={"type": "json_object"},
-                    stream=False                
+            client = self.llm_clients.get(selected_provider, api_url, self.current_api_key)
+            mode = self.response_format_mode(selected_provider)
+            request = {
+                "model": ai_model,
+                "messages": messages,
+                # "reasoning_effort": "medium",
+                "response_format": summary_response_format() if mode == "json_schema" else {"type": "json_object"},
+                "temperature": 0.7
+            }
+            if "gemini" not in self.ai_model:
+                request["max_tokens"] = 8192
+
+            # 总结输出较短，预计用量按提示加约2000 token估算；总结结果是单个对象，流式只用于及早发现停滞
+            estimated_tokens = sum(estimate_tokens(message['content']) for message in messages) + 2000
+            try:
+                response_text, _, _ = self.request_llm(
+                    selected_provider, client, request, estimated_tokens,
+                    log=lambda message: self.root.after(0, lambda: self.log_segment(message))
                 )
-            # 清理并解析json响应
-            cleaned_string = self.clean_json_string(response.choices[0].message.content)
-            function_args = json.loads(cleaned_string)
+            except Exception:
+                self.llm_reply_stats.record(selected_provider, ai_model, f"summary-{mode}", request_failures=1)
+                raise
+            # 总结回复单独统计，服务商不支持json_schema时request中的格式已回退为json_object
+            stats_mode = f"summary-{request['response_format']['type']}"
+            # 合法的JSON直接解析，解析失败时才经clean_json_string修复
+            try:
+                function_args = json.loads(response_text)
+                raw_valid = True
+            except (TypeError, ValueError):
+                raw_valid = False
+                try:
+                    function_args = json.loads(self.clean_json_string(response_text))
+                except (TypeError, ValueError):
+                    self.llm_reply_stats.record(selected_provider, ai_model, stats_mode, replies=1, unrecoverable=1)
+                    raise
+            self.llm_reply_stats.record(selected_provider, ai_model, stats_mode, replies=1,
+                                        parsed=int(raw_valid), repaired=int(not raw_valid))
             
             # 返回完整的时间段总结结果
             return {
@@ -1715,7 +2916,25 @@ class TranscriptionApp:
         if not self.input_file.get():
             messagebox.showerror("错误", "请先选择输入文件")
             return
+        if self.job_queue.is_active():
+            messagebox.showerror("错误", "任务队列正在运行，请等待队列结束")
+            return
+        
+        if not self.ensure_post_processing_ready():
+            return
+        
+        self.start_btn.config(state=tk.DISABLED)
+        self.log("听写任务开始...")
+        self.save_preset()
+        self.save_config()
+        # 启动后台线程
+        threading.Thread(target=self.run_transcription, daemon=True).start()
         
+        # 启动进度更新检查
+        self.root.after(100, self.check_progress)
+
+    def ensure_post_processing_ready(self):
+        """勾选了AI翻译或分段总结时先准备好API密钥，返回是否可以开始任务"""
         # 检查是否需要密码验证
         need_password = False
         if self.enable_ai_translation.get() or self.enable_segment_summary.get():
@@ -1727,116 +2946,563 @@ class TranscriptionApp:
             if not success:
                 if message == "用户取消解密":
                     self.log("用户取消解密，任务未启动")
-                    return
+                    return False
                 else:
                     messagebox.showerror("错误", f"API密钥准备失败: {message}")
-                    return
-        
-        self.start_btn.config(state=tk.DISABLED)
-        self.log("听写任务开始...")
-        self.save_preset()
-        self.save_config()
-        # 启动后台线程
-        threading.Thread(target=self.run_transcription, daemon=True).start()
-        
-        # 启动进度更新检查
-        self.root.after(100, self.check_progress)
+                    return False
+        return True
 
     def run_transcription(self):
+        journal = None
+        model_options = None  # 借用了常驻模型时记录模型参数，取消后只释放这个模型
+        control = self.start_job_control("transcription")
         try:
-            model_path = self.model_path 
-
-            # 加载模型
-            if not self.model:
-                self.model = WhisperModel(model_size_or_path=model_path)
-            
             # 准备ASS字幕文件名和完成后输出地址
             file_path = self.input_file.get()
-            base_name = os.path.splitext(os.path.basename(file_path))[0] 
-            
-            # 判断文件类型，视频还是音频
-            streams = ffmpeg.probe(file_path).get('streams', [])
-            file_type = None
-            for stream in streams:
-                codec_type = stream.get('codec_type', '')
-                if codec_type == 'video':
-                    file_type = "video"
-                    break  # 找到视频流后退出循环
-                else:
-                    file_type = "audio"
-            if file_type == "video": 
-                temp_audio_path_undenoise = self.extract_audio(file_path)
-                self.log("提取视频文件音频中...")
-            elif file_type == "audio":
-                temp_audio_path_undenoise = file_path
-            
-            # 定义增强后的音频文件路径
-            enhanced_audio_path = f"{os.path.splitext(file_path)[0]}_enhanced.mp3"          
-            self.log("语音增强处理中...")
+            base_name = os.path.splitext(os.path.basename(file_path))[0]
+
+            # 断点续传日志，同一任务中途退出后重新开始时跳过已完成的阶段
+            journal = self.open_transcription_journal(file_path, base_name)
 
-            # 调用语音增强函数
-            self.enhance_voice_comprehensive(temp_audio_path_undenoise, enhanced_audio_path)
-            
             def update_transcription_progress(progress):
                 self.progress_queue.put(("progress", progress))
-            
+
+            # 内存直读模式：ffmpeg解码+增强后以16kHz单声道float PCM经管道直接送入模型，不生成任何临时MP3
+            if self.is_stream_audio.get():
+                audio = None
+                if not journal.done:
+                    self.log("音频解码和语音增强处理中(内存直读)...")
+                    audio = self.load_audio_pcm(file_path, control=control)
+
+                self.progress_queue.put(("progress", 0))  # 开始转录
+                line_sinks = self.start_pipeline_consumers(file_path, base_name)
+                self.log("语音识别模型加载中...")
+                if self.uses_resident_model(journal):
+                    model_options = self.get_whisper_model_options()
+                self.transcribe_with_resident_model(audio, base_name, file_path,
+                                        progress_callback=update_transcription_progress, journal=journal,
+                                        line_sinks=line_sinks, control=control)
+                del audio
+                torch.cuda.empty_cache()
+                journal.close(remove=True)
+
+                if not line_sinks:
+                    self.start_post_transcription_tasks()
+                self.progress_queue.put(("progress", 100))
+                return
+
+            file_type, temp_audio_path_undenoise = self.prepare_source_audio(file_path, journal, control)
+            enhanced_audio_path = self.enhance_source_audio(file_path, temp_audio_path_undenoise, journal, control)
+
             # 执行语音识别，传入进度回调
             self.progress_queue.put(("progress", 0))  # 开始转录
+            line_sinks = self.start_pipeline_consumers(file_path, base_name)
             self.log("语音识别模型加载中...")
-            self.transcribe_audio_to_ass(enhanced_audio_path, base_name, file_path, 
-                                    progress_callback=update_transcription_progress)
+            if self.uses_resident_model(journal):
+                model_options = self.get_whisper_model_options()
+            self.transcribe_with_resident_model(enhanced_audio_path, base_name, file_path,
+                                    progress_callback=update_transcription_progress, journal=journal,
+                                    line_sinks=line_sinks, control=control)
             torch.cuda.empty_cache()
+            journal.close(remove=True)
 
-            # 如果启用AI翻译，执行翻译
-            if self.enable_ai_translation.get():
-                # 不再需要调用 ensure_api_key_ready()，因为已经在 start_transcription 中验证过
-                # 直接启动翻译线程
-                self.log("API密钥准备就绪，开始翻译...")
-                threading.Thread(target=self.run_batch_translation, daemon=True).start()
-
-            if self.enable_segment_summary.get():
-                # 同样，不再需要调用 ensure_api_key_ready()
-                self.log("API密钥准备就绪，开始分段总结...")
-                threading.Thread(target=self.run_segment_summary_analysis, daemon=True).start()
+            if not line_sinks:
+                self.start_post_transcription_tasks()
 
             self.progress_queue.put(("progress", 100))
-            
-            # 如果是视频文件，删除临时音频文件
-            if file_type == "video":
-                os.remove(temp_audio_path_undenoise)
-            # 删除增强后的临时音频文件
-            if os.path.exists(enhanced_audio_path):
-                os.remove(enhanced_audio_path)
+            self.remove_temp_audio(file_type, temp_audio_path_undenoise, enhanced_audio_path)
                 
+        except JobCancelled:
+            self.log("听写已取消，已完成的部分保留在断点续传日志中，重新开始同一任务时继续")
+            if model_options:
+                self.release_gpu_after_cancel(model_options)
         except Exception as e:
             self.progress_queue.put(("error", str(e)))
         finally:            
+            # 未完成的任务保留日志，下次可以续传
+            if journal:
+                journal.close()
+            self.finish_job_control("transcription", control)
             self.progress_queue.put(("reset_btn", None))
 
-    def extract_audio(self, file_path):
-        """提取音频"""
-        temp_audio_path = f"{os.path.splitext(file_path)[0]}.mp3"
+    def start_job_control(self, kind, control=None):
+        """登记一个后台任务的取消/暂停令牌，未传入时新建"""
+        control = control or JobControl(kind)
+        with self.job_controls_lock:
+            self.job_controls.append((kind, control))
+        return control
+
+    def finish_job_control(self, kind, control):
+        with self.job_controls_lock:
+            if (kind, control) in self.job_controls:
+                self.job_controls.remove((kind, control))
+
+    def control_jobs(self, kinds, action):
+        """对指定类型的正在运行的任务执行pause/resume/cancel"""
+        with self.job_controls_lock:
+            controls = [control for kind, control in self.job_controls if kind in kinds]
+        for control in controls:
+            getattr(control, action)()
+        return len(controls)
+
+    def pause_transcription_jobs(self):
+        """暂停听写、翻译、总结和任务队列，正在处理的段落/批次完成后暂停"""
+        count = self.control_jobs(("transcription", "translation", "summary"), "pause")
+        if self.job_queue.is_active():
+            self.job_queue.pause()
+            count += 1
+        self.log("已暂停，当前段落/批次完成后停止" if count else "当前没有运行中的任务")
+
+    def resume_transcription_jobs(self):
+        self.control_jobs(("transcription", "translation", "summary"), "resume")
+        if self.job_queue.paused:
+            self.job_queue.resume()
+        self.log("任务继续")
+
+    def cancel_transcription_jobs(self):
+        """取消听写、翻译、总结和任务队列，正在运行的ffmpeg会被终止"""
+        count = self.control_jobs(("transcription", "translation", "summary"), "cancel")
+        if self.job_queue.is_active():
+            self.job_queue.cancel_all()
+            count += 1
+        self.log("正在取消任务..." if count else "当前没有运行中的任务")
+
+    def release_gpu_after_cancel(self, model_options):
+        """取消后释放该任务借用过的常驻模型和显存，其他任务仍在借用时由管理器保留"""
+        self.model_manager.release(model_options['model_path'], model_options['device'], model_options['compute_type'])
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def prepare_source_audio(self, file_path, journal, control=None):
+        """判断文件类型，视频文件先提取音轨，返回(文件类型, 待增强的音频路径)"""
+        # 判断文件类型，视频还是音频
+        streams = ffmpeg.probe(file_path).get('streams', [])
+        file_type = None
+        for stream in streams:
+            codec_type = stream.get('codec_type', '')
+            if codec_type == 'video':
+                file_type = "video"
+                break  # 找到视频流后退出循环
+            else:
+                file_type = "audio"
+        temp_audio_path_undenoise = None
+        if file_type == "video": 
+            temp_audio_path_undenoise = journal.get_artifact('extract')
+            if temp_audio_path_undenoise:
+                self.log("已跳过音频提取(断点续传)")
+            elif not journal.done:
+                self.log("提取视频文件音频中...")
+                temp_audio_path_undenoise = self.extract_audio(file_path, control=control)
+                journal.commit_artifact('extract', temp_audio_path_undenoise)
+        elif file_type == "audio":
+            temp_audio_path_undenoise = file_path
+        return file_type, temp_audio_path_undenoise
+
+    def enhance_source_audio(self, file_path, temp_audio_path_undenoise, journal, control=None):
+        """对提取出的音频做语音增强，返回增强后的音频路径"""
+        # 定义增强后的音频文件路径
+        enhanced_audio_path = f"{os.path.splitext(file_path)[0]}_enhanced.mp3"          
+        if journal.get_artifact('enhance'):
+            self.log("已跳过语音增强(断点续传)")
+        elif not journal.done:
+            self.log("语音增强处理中...")
+
+            # 调用语音增强函数，失败时抛出异常，只有成功生成的文件才记入日志
+            self.enhance_voice_comprehensive(temp_audio_path_undenoise, enhanced_audio_path, control=control)
+            journal.commit_artifact('enhance', enhanced_audio_path)
+        return enhanced_audio_path
+
+    def remove_temp_audio(self, file_type, temp_audio_path_undenoise, enhanced_audio_path):
+        """听写完成后删除提取和增强产生的临时音频"""
+        # 如果是视频文件，删除临时音频文件
+        if file_type == "video" and temp_audio_path_undenoise and os.path.exists(temp_audio_path_undenoise):
+            os.remove(temp_audio_path_undenoise)
+        # 删除增强后的临时音频文件
+        if enhanced_audio_path and os.path.exists(enhanced_audio_path):
+            os.remove(enhanced_audio_path)
+
+    def add_files_to_queue(self):
+        """多选媒体文件加入任务队列"""
+        file_paths = filedialog.askopenfilenames(
+            title="选择媒体文件",
+            filetypes=[("媒体文件", "*.mp4 *.avi *.mkv *.ts *.mp3 *.wav *.aac *.m4a"), ("所有文件", "*.*")]
+        )
+        if file_paths:
+            added = self.job_queue.add(list(file_paths))
+            self.log(f"已加入任务队列: {len(added)}个文件")
+            self.refresh_job_list()
+
+    def add_folder_to_queue(self):
+        """把文件夹内的媒体文件按文件名顺序加入任务队列"""
+        folder_path = filedialog.askdirectory(title="选择媒体文件夹")
+        if not folder_path:
+            return
+        media_extensions = ('.mp4', '.avi', '.mkv', '.ts', '.mp3', '.wav', '.aac', '.m4a')
+        file_paths = [
+            os.path.join(folder_path, name) for name in sorted(os.listdir(folder_path))
+            if name.lower().endswith(media_extensions) and not name.lower().endswith('_enhanced.mp3')
+        ]
+        added = self.job_queue.add(file_paths)
+        self.log(f"已加入任务队列: {len(added)}个文件")
+        self.refresh_job_list()
+
+    def get_selected_job_ids(self):
+        return [int(item) for item in self.job_tree.selection()]
+
+    def move_selected_jobs(self, offset):
+        """上移/下移选中的任务，同一资源内按队列顺序处理"""
+        job_ids = self.get_selected_job_ids()
+        # 下移时从后往前移动，避免相邻的选中项互相交换
+        for job_id in (reversed(job_ids) if offset > 0 else job_ids):
+            self.job_queue.move(job_id, offset)
+        self.refresh_job_list()
+
+    def cancel_selected_jobs(self):
+        for job_id in self.get_selected_job_ids():
+            self.job_queue.cancel(job_id)
+        self.refresh_job_list()
+
+    def clear_finished_jobs(self):
+        self.job_queue.clear_finished()
+        self.refresh_job_list()
+
+    def refresh_job_list(self):
+        """按队列当前状态刷新任务列表"""
+        selection = self.job_tree.selection()
+        self.job_tree.delete(*self.job_tree.get_children())
+        for item in self.job_queue.snapshot():
+            status = item['status']
+            if item['error']:
+                status = f"{status}: {item['error']}"
+            self.job_tree.insert("", "end", iid=str(item['job_id']), values=(
+                item['file_path'].replace('/', '\\'),
+                item['stage'],
+                status,
+                f"{item['progress']}%"
+            ))
+        self.job_tree.selection_set([iid for iid in selection if self.job_tree.exists(iid)])
+
+    def start_job_queue(self):
+        """开始处理任务队列"""
+        if all(item['status'] in FINISHED_STATUSES for item in self.job_queue.snapshot()):
+            messagebox.showerror("错误", "请先添加文件到任务队列")
+            return
+        if self.job_queue.is_active():
+            self.log("任务队列正在运行，新加入的文件会自动排队处理")
+            self.job_queue.start()
+            return
+        if str(self.start_btn['state']) == tk.DISABLED:
+            messagebox.showerror("错误", "当前有听写任务进行中，请等待完成后再开始队列")
+            return
+        if not self.ensure_post_processing_ready():
+            return
+
+        self.start_btn.config(state=tk.DISABLED)
+        self.log("任务队列开始...")
+        self.save_preset()
+        self.save_config()
+        self.job_queue.start()
+        threading.Thread(target=self.wait_job_queue, daemon=True).start()
+
+        # 启动进度更新检查
+        self.root.after(100, self.check_progress)
+
+    def wait_job_queue(self):
+        """队列中所有任务结束后恢复开始按钮"""
+        self.job_queue.join()
+        self.log("任务队列已全部结束")
+        self.progress_queue.put(("reset_btn", None))
+
+    def run_job_extract(self, job):
+        """队列阶段：打开断点续传日志，内存直读模式下直接解码+增强到内存，否则提取视频音轨"""
+        base_name = os.path.splitext(os.path.basename(job.file_path))[0]
+        journal = self.open_transcription_journal(job.file_path, base_name)
+        job.context['base_name'] = base_name
+        job.context['journal'] = journal
+        job.context['stream'] = self.is_stream_audio.get()
+        if job.context['stream']:
+            if not journal.done:
+                self.log(f"[{base_name}] 音频解码和语音增强处理中(内存直读)...")
+                job.context['audio'] = self.load_audio_pcm(job.file_path, control=job.control)
+        else:
+            job.context['file_type'], job.context['source_audio'] = self.prepare_source_audio(job.file_path, journal,
+                                                                                              job.control)
+
+    def run_job_enhance(self, job):
+        """队列阶段：语音增强，内存直读模式下已在上一阶段完成"""
+        if job.context['stream']:
+            return
+        job.context['audio'] = self.enhance_source_audio(job.file_path, job.context['source_audio'],
+                                                         job.context['journal'], job.control)
+
+    def run_job_transcribe(self, job):
+        """队列阶段：占用Whisper模型听写生成原文ASS"""
+        base_name = job.context['base_name']
+        journal = job.context['journal']
+
+        def update_job_progress(progress):
+            self.job_queue.set_progress(job, progress)
+            self.progress_queue.put(("progress", progress))
+
+        self.log(f"[{base_name}] 语音识别开始...")
+        if self.uses_resident_model(journal):
+            job.context['model_options'] = self.get_whisper_model_options()
+        # 内存直读的PCM交给模型后不再保留，听写期间只占一份内存
+        audio = job.context.pop('audio', None) if job.context['stream'] else job.context.get('audio')
+        self.transcribe_with_resident_model(audio, base_name, job.file_path,
+                                            progress_callback=update_job_progress, journal=journal,
+                                            control=job.control)
+        del audio
+        journal.close(remove=True)
+        job.context['subtitle_file'] = self.get_origin_sub_file_path(job.file_path, base_name)
+        if not job.context['stream']:
+            self.remove_temp_audio(job.context['file_type'], job.context['source_audio'], job.context['audio'])
+
+    def run_job_translate(self, job):
+        """队列阶段：AI翻译"""
+        if not self.enable_ai_translation.get():
+            return
+        self.log(f"[{job.context['base_name']}] 开始翻译...")
+        if not self.run_batch_translation(subtitle_file=job.context['subtitle_file'], control=job.control):
+            raise Exception("翻译未全部完成，详见日志")
+
+    def run_job_summary(self, job):
+        """队列阶段：AI分段总结"""
+        if not self.enable_segment_summary.get():
+            return
+        self.log_segment(f"[{job.context['base_name']}] 开始分段总结...")
+        if not self.run_segment_summary_analysis(subtitle_file=job.context['subtitle_file'], control=job.control):
+            raise Exception("分段总结未全部完成，详见日志")
+
+    def release_job_resources(self, job):
+        """任务结束(含失败和取消)后关闭日志、释放内存中的音频，未完成的日志保留用于续传"""
+        journal = job.context.pop('journal', None)
+        if journal:
+            journal.close()
+        if job.context.get('stream'):
+            job.context.pop('audio', None)
+        if job.cancelled and job.context.get('model_options'):
+            self.release_gpu_after_cancel(job.context['model_options'])
+
+    def open_transcription_journal(self, file_path, base_name):
+        """打开输入文件旁的断点续传日志，参数一致时加载已完成的进度"""
+        journal_path = os.path.join(os.path.dirname(file_path), f"{base_name}_transcribe_journal.jsonl")
+        model_options = self.get_whisper_model_options()
+        job_key = TranscriptionJournal.make_job_key(
+            file_path,
+            {'model_path': model_options['model_path']},
+            self.get_transcribe_options(),
+            {**self.get_decoding_mode(), 'stream': self.is_stream_audio.get()}
+        )
+        journal = TranscriptionJournal(journal_path, job_key)
+        if journal.open():
+            if journal.done:
+                self.log("检测到已完成的听写记录，直接重建字幕文件")
+            else:
+                self.log(f"检测到未完成的听写任务，已完成{journal.completed_windows}个解码窗口共{len(journal.segments)}段，"
+                         f"将从第{journal.completed_windows + 1}个窗口继续")
+        return journal
+
+    def get_whisper_model_options(self):
+        """读取界面上的Whisper推理参数"""
         try:
-            (
-                ffmpeg.input(file_path)
-                .output(temp_audio_path, acodec='mp3', audio_bitrate='192k')
-                .overwrite_output()
-                .run(cmd=self.ffmpeg_exe_path, capture_stdout=True, capture_stderr=True) # 指定 ffmpeg 路径
-            )
-            return temp_audio_path
-        except ffmpeg.Error as e:
-            raise Exception(f"音频提取失败: {e.stderr.decode()}")
+            cpu_threads = int(self.whisper_cpu_threads_var.get())
+        except ValueError:
+            cpu_threads = 0
+        try:
+            num_workers = max(int(self.whisper_num_workers_var.get()), 1)
+        except ValueError:
+            num_workers = 1
+        return {
+            'model_path': self.model_path,
+            'device': self.whisper_device_var.get(),
+            'compute_type': self.whisper_compute_type_var.get(),
+            'cpu_threads': cpu_threads,
+            'num_workers': num_workers
+        }
+
+    def get_whisper_settings(self):
+        """Whisper推理参数，用于保存到配置文件和预设"""
+        return {
+            'whisper_device': self.whisper_device_var.get(),
+            'whisper_compute_type': self.whisper_compute_type_var.get(),
+            'whisper_cpu_threads': self.whisper_cpu_threads_var.get(),
+            'whisper_num_workers': self.whisper_num_workers_var.get(),
+            'whisper_batched': self.is_batched_inference.get(),
+            'whisper_batch_size': self.whisper_batch_size_var.get(),
+            'whisper_parallel_workers': self.parallel_workers_var.get()
+        }
+
+    def apply_whisper_settings(self, settings):
+        """从配置文件或预设恢复Whisper推理参数，缺失的项保持当前值"""
+        self.whisper_device_var.set(settings.get('whisper_device', self.whisper_device_var.get()))
+        self.whisper_compute_type_var.set(settings.get('whisper_compute_type', self.whisper_compute_type_var.get()))
+        self.whisper_cpu_threads_var.set(str(settings.get('whisper_cpu_threads', self.whisper_cpu_threads_var.get())))
+        self.whisper_num_workers_var.set(str(settings.get('whisper_num_workers', self.whisper_num_workers_var.get())))
+        self.is_batched_inference.set(settings.get('whisper_batched', self.is_batched_inference.get()))
+        self.whisper_batch_size_var.set(str(settings.get('whisper_batch_size', self.whisper_batch_size_var.get())))
+        self.parallel_workers_var.set(str(settings.get('whisper_parallel_workers', self.parallel_workers_var.get())))
+
+    def transcribe_with_resident_model(self, audio, base_name, file_path, progress_callback=None, journal=None,
+                                       line_sinks=None, control=None):
+        """
+        从模型管理器借用常驻模型执行转录，结束后只释放引用，模型由管理器按策略回收
+        启用听写缓存时先按音频内容和参数查缓存，命中则直接用缓存段落生成字幕，不加载模型
+        """
+        cache_key = None
+        if self.is_transcription_cache.get() and not (journal and journal.done):
+            if isinstance(audio, str):
+                # 解码一次用于计算哈希，之后直接把PCM交给模型，避免重复解码
+                audio = decode_audio(audio, sampling_rate=16000)
+            cache_key = TranscriptionCache.make_key(audio, self.model_path, self.get_transcribe_options(),
+                                                    self.get_decoding_mode())
+            cached_segments = self.transcription_cache.get(cache_key)
+            if cached_segments is not None:
+                self.log(f"命中听写缓存，直接用缓存的{len(cached_segments)}段结果生成字幕")
+                self.transcribe_audio_to_ass(audio, base_name, file_path, progress_callback=progress_callback,
+                                             line_sinks=line_sinks, cached_segments=cached_segments, control=control)
+                return
+
+        if not self.uses_resident_model(journal):
+            segments = self.transcribe_audio_to_ass(audio, base_name, file_path, progress_callback=progress_callback,
+                                                    journal=journal, line_sinks=line_sinks, control=control)
+        else:
+            with self.model_manager.borrow(**self.get_whisper_model_options()) as model:
+                self.model = model
+                try:
+                    segments = self.transcribe_audio_to_ass(audio, base_name, file_path,
+                                                            progress_callback=progress_callback,
+                                                            journal=journal, line_sinks=line_sinks, control=control)
+                finally:
+                    self.model = None
+
+        # 按窗口续传的结果与一次跑完的逐字节一致，续传的任务同样写入缓存
+        if cache_key:
+            try:
+                self.transcription_cache.put(cache_key, segments)
+            except OSError as e:
+                self.log(f"写入听写缓存失败: {str(e)}")
+
+    def uses_resident_model(self, journal=None):
+        """是否借用主进程的常驻模型：分块并行时每个工作进程自己加载模型，已完成的任务只需重建字幕，都不借用"""
+        return self.get_parallel_workers() <= 1 and not (journal and journal.done)
+
+    def show_cache_stats(self):
+        """在日志中输出听写缓存的命中情况和占用"""
+        stats = self.transcription_cache.stats()
+        limit = f"{stats['max_bytes'] / 1024 / 1024:.0f}MB" if stats['max_bytes'] else "不限"
+        self.log(f"听写缓存: 本次命中{stats['hits']}次，未命中{stats['misses']}次，"
+                 f"共{stats['entries']}条，占用{stats['bytes'] / 1024 / 1024:.1f}MB/{limit}")
+
+    def on_transcription_cache_toggle(self):
+        """听写缓存勾选框切换事件"""
+        if self.is_transcription_cache.get():
+            self.log("听写缓存已启用，相同音频和参数将直接复用上次的听写结果")
+        else:
+            self.log("听写缓存未启用")
 
-    def enhance_voice_comprehensive(self, input_file, output_file):
+    def show_model_status(self):
+        """在日志中输出常驻模型的加载耗时和占用"""
+        stats = self.model_manager.stats()
+        if not stats:
+            self.log("当前没有常驻的Whisper模型")
+            return
+        for item in stats:
+            state = "使用中" if item['in_use'] else f"空闲{item['idle_seconds']:.0f}s"
+            self.log(f"常驻模型: {item['model_path']} ({item['device']}/{item['compute_type']}) "
+                     f"加载耗时{item['load_time']:.1f}s，占用约{item['memory_mb']:.0f}MB，复用{item['hits']}次，{state}")
+
+    def start_pipeline_consumers(self, file_path, base_name):
+        """
+        流水线模式下在听写开始前启动翻译和总结的消费线程，返回需要推送字幕行的队列列表；
+        未启用流水线时返回空列表，由听写结束后的start_post_transcription_tasks处理
+        """
+        if not self.enable_pipeline.get():
+            return []
+        subtitle_path = self.get_origin_sub_file_path(file_path, base_name)
+        line_sinks = []
+        if self.enable_ai_translation.get():
+            translation_queue = queue.Queue()
+            line_sinks.append(translation_queue)
+            self.log("API密钥准备就绪，听写的同时开始翻译...")
+            threading.Thread(target=self.run_batch_translation, daemon=True,
+                             kwargs={'subtitle_file': subtitle_path, 'line_queue': translation_queue}).start()
+
+        if self.enable_segment_summary.get():
+            summary_queue = queue.Queue()
+            line_sinks.append(summary_queue)
+            self.log("API密钥准备就绪，听写的同时开始分段总结...")
+            threading.Thread(target=self.run_segment_summary_analysis, daemon=True,
+                             kwargs={'subtitle_file': subtitle_path, 'line_queue': summary_queue}).start()
+        return line_sinks
+
+    def start_post_transcription_tasks(self):
+        """听写完成后按勾选项启动AI翻译和分段总结线程"""
+        # 如果启用AI翻译，执行翻译
+        if self.enable_ai_translation.get():
+            # 不再需要调用 ensure_api_key_ready()，因为已经在 start_transcription 中验证过
+            # 直接启动翻译线程
+            self.log("API密钥准备就绪，开始翻译...")
+            threading.Thread(target=self.run_batch_translation, daemon=True).start()
+
+        if self.enable_segment_summary.get():
+            # 同样，不再需要调用 ensure_api_key_ready()
+            self.log("API密钥准备就绪，开始分段总结...")
+            threading.Thread(target=self.run_segment_summary_analysis, daemon=True).start()
+
+    def load_audio_pcm(self, file_path, sampling_rate=16000, control=None):
+        """
+        用一条ffmpeg命令完成解码+语音增强+重采样，通过管道输出16kHz单声道float32 PCM，
+        返回的numpy数组与faster-whisper自身decode_audio的格式一致，可直接传给transcribe
+        """
+        control = control or JobControl()
+        cmd = [
+            self.ffmpeg_exe_path,
+            '-nostdin',
+            '-i', file_path,
+            '-vn',  # 视频文件只取音轨
+            '-af', self.get_voice_enhance_filter(),
+            '-ac', '1',
+            '-ar', str(sampling_rate),
+            '-f', 'f32le',
+            'pipe:1'
+        ]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with control.track_process(process):
+            pcm_bytes, stderr = process.communicate()
+        control.checkpoint()
+        if process.returncode != 0:
+            raise Exception(f"音频解码失败: {stderr.decode(errors='ignore')}")
+
+        audio = np.frombuffer(pcm_bytes, dtype=np.float32)
+        if audio.size == 0:
+            raise Exception("音频解码失败: 未读取到音频数据")
+        self.log(f"音频解码完成，时长{audio.size / sampling_rate:.0f}s，占用内存{audio.nbytes / 1024 / 1024:.0f}MB")
+        return audio
+
+    def extract_audio(self, file_path, control=None):
+        """提取音频，取消时终止ffmpeg，不完整的文件不会记入断点续传日志"""
+        control = control or JobControl()
+        temp_audio_path = f"{os.path.splitext(file_path)[0]}.mp3"
+        process = (
+            ffmpeg.input(file_path)
+            .output(temp_audio_path, acodec='mp3', audio_bitrate='192k')
+            .overwrite_output()
+            .run_async(cmd=self.ffmpeg_exe_path, pipe_stdout=True, pipe_stderr=True) # 指定 ffmpeg 路径
+        )
+        with control.track_process(process):
+            _, stderr = process.communicate()
+        control.checkpoint()
+        if process.returncode != 0:
+            raise Exception(f"音频提取失败: {stderr.decode(errors='ignore')}")
+        return temp_audio_path
+
+    def enhance_voice_comprehensive(self, input_file, output_file, control=None):
         """
         综合语音增强：降噪 + 低频切除 + 均衡器
         """
-        filter_chain = (
-            "afftdn=nf=-25,"
-            "asubcut=cutoff=80,"
-            "asupercut=cutoff=20000,"
-            "equalizer=f=1000:width_type=h:width=2000:g=3"
-        )        
+        control = control or JobControl()
+        filter_chain = self.get_voice_enhance_filter()
 
         # 确保 output_file 的路径也使用正斜杠
         formatted_output_file = output_file.replace('\\', '/')
@@ -1849,13 +3515,25 @@ class TranscriptionApp:
             formatted_output_file
         ]
         
-        try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"错误: {e.stderr.decode()}")
-            return output_file
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        with control.track_process(process):
+            _, stderr = process.communicate()
+        # 取消或失败时输出文件不完整，在记入断点续传日志之前抛出
+        control.checkpoint()
+        if process.returncode != 0:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise Exception(f"语音增强失败: {stderr.decode(errors='ignore')}")
+        return True
+
+    def get_voice_enhance_filter(self):
+        """语音增强滤镜链，临时文件模式和内存直读模式共用"""
+        return (
+            "afftdn=nf=-25,"
+            "asubcut=cutoff=80,"
+            "asupercut=cutoff=20000,"
+            "equalizer=f=1000:width_type=h:width=2000:g=3"
+        )
 
     def create_ass_header(self):
         """创建ASS文件头部信息"""
@@ -1881,102 +3559,244 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
     
         return header
 
-    def transcribe_audio_to_ass(self, audio_path, base_name, file_path, progress_callback=None):
+    def transcribe_audio_to_ass(self, audio_path, base_name, file_path, progress_callback=None, journal=None,
+                                line_sinks=None, cached_segments=None, control=None):
         """
-        使用Faster-Whisper转录音频并生成ASS字幕文件  
+        使用Faster-Whisper转录音频并生成ASS字幕文件，返回全部段落列表
+        audio_path可以是音频文件路径，也可以是load_audio_pcm返回的PCM数组
+        传入journal时先用已完成窗口的段落重建字幕，再从下一个解码窗口继续转录，每段结果都先提交到日志
+        传入line_sinks时每写出一行Dialogue也推送到各队列，结束(含出错)时推送None
+        传入cached_segments时直接用缓存的段落生成字幕，不再转录
+        传入control时每段之间检查暂停和取消，取消时已提交的段落留在日志中可续传
         """
         tic = time.time()
-        origin_sub_file_name = base_name+'.ass'
-        origin_sub_file_path = os.path.join(os.path.dirname(file_path), origin_sub_file_name)
+        control = control or JobControl()
+        origin_sub_file_path = self.get_origin_sub_file_path(file_path, base_name)
+        line_sinks = line_sinks or []
+
+        def write_lines(f, lines):
+            f.writelines(lines)
+            for sink in line_sinks:
+                for line in lines:
+                    sink.put(line)
+
+        # 边转录边写入：表头先落盘，每产出一段就写入对应的Dialogue行，定期刷新到磁盘
+        # 内存占用不随时长增长，任务进行中磁盘上始终有一份可查看的部分ASS
+        flush_interval = 5  # 秒
+        last_flush = time.time()
+        try:
+            with open(origin_sub_file_path, 'w', encoding='utf-8-sig', buffering=1024 * 1024) as f:
+                f.write(self.create_ass_header())
+                if cached_segments is not None:
+                    segments = cached_segments
+                else:
+                    # 续传时已完成窗口的段落完全由日志重建，之后的窗口各自独立解码，结果与不中断时逐字节一致
+                    segments = list(journal.segments) if journal else []
+                for seg in segments:
+                    write_lines(f, self.segment_to_ass_lines(seg))
+                f.flush()
+
+                if cached_segments is None and not (journal and journal.done):
+                    start_window = journal.completed_windows if journal else 0
+                    for index, window_segments in self.iter_transcription_windows(
+                            audio_path, progress_callback, start_window=start_window, control=control):
+                        for seg in window_segments:
+                            if journal:
+                                journal.commit_segment(seg)
+                            segments.append(seg)
+                            write_lines(f, self.segment_to_ass_lines(seg))
+                            control.checkpoint()
+                            if time.time() - last_flush >= flush_interval:
+                                f.flush()
+                                last_flush = time.time()
+                        if journal:
+                            journal.commit_window(index)
+                    if journal:
+                        journal.mark_done()
+        finally:
+            # 通知流水线消费者听写已结束
+            for sink in line_sinks:
+                sink.put(None)
 
-        segments, info = self.model.transcribe(
-            audio=audio_path,
-            language= "ja" if self.language_combo.get() == "日语" else "en" if self.language_combo.get() == "英语" else "zh",
+        toc = time.time()
+        self.log(f"听写任务完成，耗时{round(toc-tic)}s")
 
+        # 处理好的ASS文件地址放入全局变量，如果要AI翻译就直接读取地址 
+        normalized_path = origin_sub_file_path.replace('/', '\\')
+        self.subtitle_file_var.set(normalized_path)        
+        self.log(f"已生成字幕文件: {normalized_path}")
+        return segments
+
+    def get_origin_sub_file_path(self, file_path, base_name):
+        """听写生成的原文ASS路径：与输入文件同目录同名"""
+        return os.path.join(os.path.dirname(file_path), base_name + '.ass')
+
+    def segment_to_ass_lines(self, seg):
+        """把一段转录结果按日语标点分行，平均分配时长后生成对应的Dialogue行"""
+        lines = []
+        start_s = float(seg['start'])
+        end_s = float(seg['end'])
+        text = seg['text'].strip()
+
+        # 精确转换为 centisecond
+        seg_start_cs = self.seconds_to_centiseconds(start_s)
+        seg_end_cs = self.seconds_to_centiseconds(end_s)
+        total_cs = max(seg_end_cs - seg_start_cs, 0)
+        if total_cs == 0:
+            total_cs = 1
+
+        # 日语文本自动分行
+        text_segments = self.segment_text_japanese(text)
+        
+        # 如果有多个文本段，创建多行字幕
+        if len(text_segments) > 1:
+            n = len(text_segments)
+            base = total_cs // n
+            remainder = total_cs % n  # 平均分配余数
+            cur_cs = seg_start_cs
+            
+            for i, t in enumerate(text_segments):
+                #如果t内容为空那就直接不添加内容
+                if not t.strip():
+                    continue
+                this_dur = base + (1 if i < remainder else 0)
+                line_start_cs = cur_cs
+                line_end_cs = cur_cs + this_dur
+
+                start_time = self.centiseconds_to_ass_time(line_start_cs)
+                end_time = self.centiseconds_to_ass_time(line_end_cs)
+                lines.append(f"Dialogue: 0,{start_time},{end_time},原文,,0,0,0,,{t}\n")
+
+                cur_cs = line_end_cs
+        else:
+            #如果text_segments内容为空那就直接不添加内容
+            if text_segments and text_segments[0].strip():
+                start_time = self.centiseconds_to_ass_time(seg_start_cs)
+                end_time = self.centiseconds_to_ass_time(seg_end_cs)
+                lines.append(f"Dialogue: 0,{start_time},{end_time},原文,,0,0,0,,{text_segments[0]}\n")
+        return lines
+
+    def get_transcribe_options(self):
+        """转录参数，顺序推理和批量推理共用"""
+        return dict(
+            language= "ja" if self.language_combo.get() == "日语" else "en" if self.language_combo.get() == "英语" else "zh",
             beam_size=None if self.beam_size_off else self.set_beam_size,
-            vad_filter=self.is_vad_filter,           
+            vad_filter=self.is_vad_filter.get(),
             vad_parameters=dict(
                 min_silence_duration_ms=500,  # 核心参数，控制切分粒度
                 speech_pad_ms=400,            # 保证词句完整
                 threshold=0.4,                # 平衡敏感度，过滤背景音
                 min_speech_duration_ms=250    # 过滤短噪音 
-            )                 
-        )        
-        total_duration = round(info.duration, 2)  # Same precision as the Whisper timestamps.
-        results= []
-        processed_duration = 0
-
-        with tqdm(total=total_duration, unit=" seconds", disable=True) as pbar:
-            for s in segments:
-                segment_dict = {
-                    'start': s.start,
-                    'end': s.end,
-                    'text': s.text
-                }
-                results.append(segment_dict)
-                segment_duration = s.end - s.start
-                processed_duration += segment_duration
+            )
+        )
 
-                if progress_callback:
-                    current_progress = min(100, int((s.end / total_duration) * 100))
-                    progress_callback(current_progress)
+    def get_decoding_mode(self):
+        """当前的推理方式：批量推理(含批大小)、分块并行和解码窗口时长，不同方式的断句和时间戳会有差异"""
+        parallel_workers = self.get_parallel_workers()
+        batched = self.is_batched_inference.get()
+        return {
+            'batched': batched,
+            'batch_size': self.get_whisper_batch_size() if batched else 0,
+            'parallel_workers': parallel_workers if parallel_workers > 1 else 1,
+            'window_seconds': self.get_window_seconds()
+        }
 
-        toc = time.time()
-        self.log(f"听写任务完成，耗时{round(toc-tic)}s")
+    def get_window_seconds(self):
+        """解码窗口的目标时长(秒)：分块并行时即每块的时长，否则为顺序/批量推理的窗口时长"""
+        minutes = self.parallel_chunk_minutes if self.get_parallel_workers() > 1 else self.transcribe_window_minutes
+        return minutes * 60
 
-        # 创建ASS文件
-        ass_content = self.create_ass_header()
-        
-        #处理转录结果
-        for seg in results:           
-            start_s = float(seg['start'])
-            end_s = float(seg['end'])
-            text = seg['text'].strip()
-
-            # 精确转换为 centisecond
-            seg_start_cs = self.seconds_to_centiseconds(start_s)
-            seg_end_cs = self.seconds_to_centiseconds(end_s)
-            total_cs = max(seg_end_cs - seg_start_cs, 0)
-            if total_cs == 0:
-                total_cs = 1
-
-            # 日语文本自动分行
-            text_segments = self.segment_text_japanese(text)
-            
-            # 如果有多个文本段，创建多行字幕
-            if len(text_segments) > 1:
-                n = len(text_segments)
-                base = total_cs // n
-                remainder = total_cs % n  # 平均分配余数
-                cur_cs = seg_start_cs
-                
-                for i, t in enumerate(text_segments):
-                    #如果t内容为空那就直接不往ass_content添加内容
-                    if not t.strip():
-                        continue
-                    this_dur = base + (1 if i < remainder else 0)
-                    line_start_cs = cur_cs
-                    line_end_cs = cur_cs + this_dur
-
-                    start_time = self.centiseconds_to_ass_time(line_start_cs)
-                    end_time = self.centiseconds_to_ass_time(line_end_cs)
-                    ass_content += f"Dialogue: 0,{start_time},{end_time},原文,,0,0,0,,{t}\n"
-
-                    cur_cs = line_end_cs
-            else:
-                #如果text_segments内容为空那就直接不往ass_content添加内容
-                if text_segments and text_segments[0].strip():
-                    start_time = self.centiseconds_to_ass_time(seg_start_cs)
-                    end_time = self.centiseconds_to_ass_time(seg_end_cs)
-                    ass_content += f"Dialogue: 0,{start_time},{end_time},原文,,0,0,0,,{text_segments[0]}\n"
-        # 写入ASS文件
-        with open(origin_sub_file_path, 'w', encoding='utf-8-sig') as f:
-            f.write(ass_content)
-        
-        # 处理好的ASS文件地址放入全局变量，如果要AI翻译就直接读取地址 
-        normalized_path = origin_sub_file_path.replace('/', '\\')
-        self.subtitle_file_var.set(normalized_path)        
-        self.log(f"已生成字幕文件: {normalized_path}")
+    def get_parallel_workers(self):
+        """读取分块并行的进程数，0或1表示不启用"""
+        try:
+            return max(int(self.parallel_workers_var.get()), 0)
+        except ValueError:
+            return 0
+
+    def transcribe_audio_parallel(self, audio, windows, start_window, transcribe_options, progress_callback=None,
+                                  control=None):
+        """把切好的窗口交给进程池并行转录，某窗口及其之前的窗口都完成后立即按顺序产出(窗口序号, 全局时间轴的段落列表)"""
+        options = self.get_whisper_model_options()
+        worker_specs = build_worker_specs(
+            self.get_parallel_workers(),
+            options['device'],
+            options['compute_type'],
+            options['cpu_threads'],
+            torch.cuda.is_available()
+        )
+        devices = "、".join(f"{spec['device']}/{spec['compute_type']}" for spec in worker_specs)
+        self.log(f"使用分块并行模式: {devices}")
+        return transcribe_in_parallel(
+            audio,
+            options['model_path'],
+            worker_specs,
+            transcribe_options,
+            windows,
+            start_chunk=start_window,
+            progress_callback=progress_callback,
+            log=self.log,
+            checkpoint=control.checkpoint if control else None
+        )
+
+    def get_whisper_batch_size(self):
+        """读取批量推理的批大小，非法输入时使用默认值16"""
+        try:
+            return max(int(self.whisper_batch_size_var.get()), 1)
+        except ValueError:
+            return 16
+
+    def iter_transcription_windows(self, audio_path, progress_callback=None, start_window=0, control=None):
+        """
+        把音频在静音处切成解码窗口，按顺序产出(窗口序号, 该窗口段落{'start','end','text'}的迭代器)，
+        顺序推理、批量推理和分块并行三种模式统一出口，时间戳和进度都按整段音频计算
+        每个窗口从零上下文独立解码，切分只取决于音频和参数，从第start_window个窗口续传时结果与一次跑完时一致
+        """
+        if isinstance(audio_path, str):
+            audio_path = decode_audio(audio_path, sampling_rate=16000)
+        transcribe_options = self.get_transcribe_options()
+        parallel_workers = self.get_parallel_workers()
+        windows = split_audio_at_silence(audio_path, self.get_window_seconds(),
+                                         transcribe_options.get('vad_parameters') or {},
+                                         min_chunks=parallel_workers if parallel_workers > 1 else 1)
+        if start_window:
+            self.log(f"共{len(windows)}个解码窗口，从第{start_window + 1}个继续转录")
+
+        if parallel_workers > 1:
+            # 分块并行：多个进程各自持有模型，每块即一个窗口，按块顺序边完成边产出，进度由各块完成情况汇报
+            for index, window_segments in self.transcribe_audio_parallel(audio_path, windows, start_window,
+                                                                         transcribe_options, progress_callback,
+                                                                         control):
+                yield index, iter(window_segments)
+            return
+
+        if self.is_batched_inference.get():
+            # 批量推理：窗口内VAD切出的语音块按batch_size成批送入模型，结果仍按时间顺序逐段产出
+            batch_size = self.get_whisper_batch_size()
+            self.log(f"使用批量推理模式，批大小{batch_size}")
+            batched_model = BatchedInferencePipeline(model=self.model)
+
+            def transcribe_window(window_audio):
+                return batched_model.transcribe(window_audio, batch_size=batch_size, **transcribe_options)[0]
+        else:
+            def transcribe_window(window_audio):
+                return self.model.transcribe(audio=window_audio, **transcribe_options)[0]
+
+        for index in range(start_window, len(windows)):
+            yield index, self.decode_audio_window(audio_path, windows[index], transcribe_window, progress_callback)
+
+    def decode_audio_window(self, audio, bounds, transcribe_window, progress_callback=None):
+        """独立解码一个窗口，逐段产出加上窗口起点偏移后的全局时间轴结果"""
+        start, end = bounds
+        offset = start / 16000
+        total_duration = len(audio) / 16000
+        for s in transcribe_window(audio[start:end]):
+            yield {
+                'start': s.start + offset,
+                'end': s.end + offset,
+                'text': s.text
+            }
+            if progress_callback:
+                progress_callback(min(100, int((s.end + offset) / total_duration * 100)))
 
     def seconds_to_centiseconds(self, seconds: float) -> int:
         """
@@ -2034,6 +3854,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                         messagebox.showerror("错误", value)
                     elif item_type == "reset_btn":
                         self.start_btn.config(state=tk.NORMAL)
+                    elif item_type == "jobs":
+                        self.refresh_job_list()
                 except queue.Empty:
                     break
         except Exception as e:
@@ -2141,6 +3963,13 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
         else:
             self.log("AI分时段总结未启用")
 
+    def on_pipeline_toggle(self):
+        """边听写边处理勾选框切换事件"""
+        if self.enable_pipeline.get():
+            self.log("边听写边处理已启用，翻译和总结将与听写同时进行")
+        else:
+            self.log("边听写边处理未启用，听写完成后再开始翻译和总结")
+
     def on_VAD_toggle(self):
         """AI翻译勾选框切换事件"""
         if self.is_vad_filter.get():           
@@ -2148,6 +3977,20 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
         else:
             self.log("VAD翻译未选项启用")
 
+    def on_stream_audio_toggle(self):
+        """内存直读音频勾选框切换事件"""
+        if self.is_stream_audio.get():
+            self.log("内存直读音频已启用，不再生成临时MP3文件")
+        else:
+            self.log("内存直读音频未启用，使用临时MP3文件")
+
+    def on_batched_inference_toggle(self):
+        """批量推理勾选框切换事件"""
+        if self.is_batched_inference.get():
+            self.log(f"批量推理已启用，批大小{self.get_whisper_batch_size()}")
+        else:
+            self.log("批量推理未启用")
+
     def show_api_key_dialog(self):
         """显示API密钥输入对话框"""
         dialog = tk.Toplevel(self.root)
@@ -2375,7 +4218,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
         api_url = provider_config["api_url"]  
        
         try:
-            client = OpenAI(api_key=api_key, base_url=api_url)
+            client = self.llm_clients.get(current_provider, api_url, api_key)
+            # 验证在界面线程上进行，不经过限流器：RPM用尽或Retry-After推迟时限流器会等待，界面会卡住
             models = client.models.list()
             
             if models and len(list(models)) > 0:
@@ -2577,6 +4421,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
     def select_provider(self, provider_name):
         """选择服务商"""
         if provider_name in self.providers:
+            self.store_translation_concurrency()
             self.provider_var.set(provider_name)
             provider_config = self.providers[provider_name]
             
@@ -2591,6 +4436,9 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             # 更新模型菜单
             self.update_model_menu()
             
+            # 加载该服务商的并发数
+            self.load_translation_concurrency()
+
             # 加载该服务商的API密钥
             self.current_api_key = self.api_keys.get(provider_name, "")
             
@@ -2627,10 +4475,40 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                     # 加载模型路径
                     self.model_path = config.get('model_path', '')
                     self.model_path_var.set(self.model_path)
+                    self.apply_whisper_settings(config)
+                    self.whisper_max_models = config.get('whisper_max_models', 1)
+                    self.whisper_idle_timeout = config.get('whisper_idle_timeout', 600)
+                    self.whisper_memory_budget_mb = config.get('whisper_memory_budget_mb', 0)
+                    self.parallel_chunk_minutes = config.get('parallel_chunk_minutes', 10)
+                    self.transcribe_window_minutes = config.get('transcribe_window_minutes', 10)
+                    self.is_transcription_cache.set(config.get('transcription_cache', True))
+                    self.transcription_cache_dir = config.get('transcription_cache_dir', "transcription_cache")
+                    self.transcription_cache_max_mb = config.get('transcription_cache_max_mb', 1024)
+                    self.is_translation_memory.set(config.get('translation_memory', False))
+                    self.is_compact_protocol.set(config.get('compact_protocol', False))
+                    self.is_structured_output.set(config.get('structured_output', False))
+                    self.translation_memory_path = config.get('translation_memory_path', "translation_memory.db")
+                    self.translation_memory_max_entries = config.get('translation_memory_max_entries', 50000)
+                    self.llm_reply_stats_path = config.get('llm_reply_stats_path', "llm_reply_stats.json")
+                    self.translation_token_budget = config.get('translation_token_budget', 6000)
+                    self.model_token_budgets = config.get('model_token_budgets', {})
+                    self.history_token_budget = config.get('history_token_budget', 4000)
                     
                     # 加载AI翻译设置
                     self.enable_ai_translation.set(config.get('enable_ai_translation', False))
                     self.enable_segment_summary.set(config.get('enable_segment_summary', False))
+                    self.is_stream_audio.set(config.get('stream_audio', True))
+                    self.enable_pipeline.set(config.get('enable_pipeline', False))
+                    self.is_concurrent_translation.set(config.get('concurrent_translation', False))
+                    self.context_overlap_lines = config.get('context_overlap_lines', 5)
+                    self.llm_timeout = config.get('llm_timeout', 300)
+                    self.llm_connect_timeout = config.get('llm_connect_timeout', 10)
+                    self.llm_max_connections = config.get('llm_max_connections', 20)
+                    self.llm_max_keepalive = config.get('llm_max_keepalive', 10)
+                    self.is_streaming_response.set(config.get('streaming_response', False))
+                    self.llm_stall_timeout = config.get('llm_stall_timeout', 60)
+                    self.llm_replay_mode = config.get('llm_replay_mode', "off")
+                    self.llm_replay_dir = config.get('llm_replay_dir', "llm_replay")
 
                     # 加载服务商设置
                     self.provider_var.set(config.get('provider', 'DeepSeek'))
@@ -2648,6 +4526,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
 
                     # 加载预设信息
                     self.presets = config.get('presets', {})
+                    self.glossaries = config.get('glossaries', {})
+                    self.rewrite_rules = config.get('rewrite_rules', {})
                     self.current_preset = config.get('current_preset')
                     self.batch_size = config.get('batch_size', 80)  # 从配置文件加载，如果不存在则默认80
                     
@@ -2656,6 +4536,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
 
                     # 加载providers配置
                     self.providers = config.get('providers')
+                    self.load_translation_concurrency()
 
                     # 更新UI
                     self.api_key_entry.delete(0, tk.END)
@@ -2700,10 +4581,41 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
         """保存配置文件"""
         config_file = "transby2_config.json"
         try:
+            self.store_translation_concurrency()
             config = {
                 'model_path': self.model_path,
+                **self.get_whisper_settings(),
+                'whisper_max_models': self.whisper_max_models,
+                'whisper_idle_timeout': self.whisper_idle_timeout,
+                'whisper_memory_budget_mb': self.whisper_memory_budget_mb,
+                'parallel_chunk_minutes': self.parallel_chunk_minutes,
+                'transcribe_window_minutes': self.transcribe_window_minutes,
+                'transcription_cache': self.is_transcription_cache.get(),
+                'transcription_cache_dir': self.transcription_cache_dir,
+                'transcription_cache_max_mb': self.transcription_cache_max_mb,
+                'translation_memory': self.is_translation_memory.get(),
+                'compact_protocol': self.is_compact_protocol.get(),
+                'structured_output': self.is_structured_output.get(),
+                'translation_memory_path': self.translation_memory_path,
+                'translation_memory_max_entries': self.translation_memory_max_entries,
+                'llm_reply_stats_path': self.llm_reply_stats_path,
+                'translation_token_budget': self.translation_token_budget,
+                'model_token_budgets': self.model_token_budgets,
+                'history_token_budget': self.history_token_budget,
                 'enable_ai_translation': self.enable_ai_translation.get(),
                 'enable_segment_summary': self.enable_segment_summary.get(),
+                'stream_audio': self.is_stream_audio.get(),
+                'enable_pipeline': self.enable_pipeline.get(),
+                'concurrent_translation': self.is_concurrent_translation.get(),
+                'context_overlap_lines': self.context_overlap_lines,
+                'llm_timeout': self.llm_timeout,
+                'llm_connect_timeout': self.llm_connect_timeout,
+                'llm_max_connections': self.llm_max_connections,
+                'llm_max_keepalive': self.llm_max_keepalive,
+                'streaming_response': self.is_streaming_response.get(),
+                'llm_stall_timeout': self.llm_stall_timeout,
+                'llm_replay_mode': self.llm_replay_mode,
+                'llm_replay_dir': self.llm_replay_dir,
                 'api_keys': self.api_keys,  # 保存所有服务商的API密钥
                 'ai_model': self.ai_model,
                 'temperature': self.temperature,
@@ -2712,6 +4624,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                 'provider': self.provider_var.get(),
                 'batch_size': self.batch_size,
                 'presets': self.presets,
+                'glossaries': self.glossaries,
+                'rewrite_rules': self.rewrite_rules,
                 'providers': self.providers  # 保存服务商配置
             }
             with open(config_file, 'w', encoding='utf-8') as f:
@@ -2740,7 +4654,6 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             self.save_config()
             normalized_path = folder_path.replace('/', '\\')
             self.log(f"已选择模型文件夹: {normalized_path}")
-            self.model = None
 
     def log(self, message):
         """听写选项卡的日志输出"""
@@ -2771,6 +4684,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             self.preset_menu.add_command(label="新建", command=self.create_preset)
             self.preset_menu.add_command(label="重命名", command=self.rename_preset)
             self.preset_menu.add_command(label="删除当前预设", command=self.delete_preset)
+            self.preset_menu.add_command(label="编辑术语表", command=self.edit_glossary)
+            self.preset_menu.add_command(label="编辑改写规则", command=self.edit_rewrite_rules)
             self.preset_menu.add_command(label="导出预设集", command=self.export_presets)
             self.preset_menu.add_command(label="导入预设集", command=self.import_presets) 
 
@@ -2823,9 +4738,15 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                 'temperature': self.temperature,
                 'system_prompt': self.system_prompt,
                 'provider': self.provider_var.get(),
-                'batch_size': self.batch_size # 保存batch_size
+                'batch_size': self.batch_size, # 保存batch_size
+                **self.get_whisper_settings()
             }
             
+            # 新预设沿用当前预设的术语表和改写规则
+            if self.current_preset in self.glossaries:
+                self.glossaries[preset_name] = dict(self.glossaries[self.current_preset])
+            if self.current_preset in self.rewrite_rules:
+                self.rewrite_rules[preset_name] = [dict(rule) for rule in self.rewrite_rules[self.current_preset]]
             self.current_preset = preset_name
             self.update_preset_menu()
             self.save_preset()
@@ -2842,12 +4763,19 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
         
         old_name = self.current_preset        
         new_name = tk.simpledialog.askstring("  ", "请输入新的预设名称:")       
+        if not new_name:
+            return  # 取消输入时不改名
         if new_name in self.presets:
             messagebox.showwarning("警告", f"预设 '{new_name}' 已存在")
             return
         else:
             # 重命名预设
             self.presets[new_name] = self.presets.pop(old_name)
+            if old_name in self.glossaries:
+                self.glossaries[new_name] = self.glossaries.pop(old_name)
+            if old_name in self.rewrite_rules:
+                self.rewrite_rules[new_name] = self.rewrite_rules.pop(old_name)
+            self.translation_memory.rename_preset(old_name, new_name)
             
             # 更新当前预设            
             self.current_preset = new_name            
@@ -2870,6 +4798,9 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             if messagebox.askyesno("确认删除", f"确定要删除预设 '{preset_name}' 吗？"):
                 # 删除预设
                 del self.presets[preset_name]
+                self.glossaries.pop(preset_name, None)
+                self.rewrite_rules.pop(preset_name, None)
+                self.translation_memory.clear(preset_name)
                 self.log(f"已删除预设: {preset_name}")
                 # 更新当前预设和UI  
                 self.current_preset = list(self.presets.keys())[0]
@@ -2878,8 +4809,11 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                 self.ai_model = preset['ai_model']
                 self.temperature = preset['temperature']
                 self.system_prompt = preset['system_prompt']
+                self.store_translation_concurrency()
                 self.provider_var.set(preset['provider'])
+                self.load_translation_concurrency()
                 self.batch_size = preset.get('batch_size', 80) # 从新的当前预设加载batch_size
+                self.apply_whisper_settings(preset)
                 self.current_preset = preset_name
                 
             # 更新UI
@@ -2931,8 +4865,11 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             self.ai_model = preset['ai_model']
             self.temperature = preset['temperature']
             self.system_prompt = preset['system_prompt']
+            self.store_translation_concurrency()
             self.provider_var.set(preset['provider'])
+            self.load_translation_concurrency()
             self.batch_size = preset.get('batch_size', 80) # 从预设加载batch_size，如果不存在则默认80
+            self.apply_whisper_settings(preset)
             self.current_preset = preset_name
             
             # 更新UI
@@ -2980,7 +4917,9 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             try:
                 # 只导出预设信息
                 export_data = {
-                    "presets": self.presets
+                    "presets": self.presets,
+                    "glossaries": {name: glossary for name, glossary in self.glossaries.items() if name in self.presets},
+                    "rewrite_rules": {name: rules for name, rules in self.rewrite_rules.items() if name in self.presets}
                 }
                 
                 with open(file_path, 'w', encoding='utf-8') as f:
@@ -3003,6 +4942,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                     import_data = json.load(f)
                 
                 imported_presets = import_data.get("presets", {})
+                imported_glossaries = import_data.get("glossaries", {})
+                imported_rewrite_rules = import_data.get("rewrite_rules", {})
                 
                 if not imported_presets:
                     messagebox.showwarning("警告", "导入的文件中没有预设数据")
@@ -3019,6 +4960,10 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
                         counter += 1
                     
                     self.presets[new_name] = preset_data                
+                    if preset_name in imported_glossaries:
+                        self.glossaries[new_name] = imported_glossaries[preset_name]
+                    if preset_name in imported_rewrite_rules:
+                        self.rewrite_rules[new_name] = imported_rewrite_rules[preset_name]
                 
                 self.log(f"已导入预设集，共 {len(imported_presets)} 个预设")
                 self.save_preset()
@@ -3043,7 +4988,8 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
             "ai_model": current_model,
             "temperature": current_temperature,
             'provider': self.provider_var.get(),
-            'batch_size': current_batch_size 
+            'batch_size': current_batch_size,
+            **self.get_whisper_settings()
         }
         
         # 更新当前实例的配置
@@ -3079,6 +5025,7 @@ Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\
 
 def main():
     """主程序入口"""
+    multiprocessing.freeze_support()  # 打包后分块并行的工作进程需要
     root = tk.Tk()
     app = TranscriptionApp(root)
     root.mainloop()
@@ -0,0 +1,185 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from faster_whisper import WhisperModel
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class WhisperModelManager:
+    """
+    常驻Whisper模型管理器
+    以(模型路径, 设备, 精度)为键缓存已加载的模型，最近使用的模型保持常驻，
+    超出数量/显存内存预算或空闲超时的模型会被回收
+    """
+
+    def __init__(self, max_models=1, idle_timeout=600, memory_budget_mb=0, log=print):
+        self.max_models = max_models              # 最多同时常驻的模型数量
+        self.idle_timeout = idle_timeout          # 空闲多少秒后回收，0表示不按时间回收
+        self.memory_budget_mb = memory_budget_mb  # 常驻模型总占用上限(MB)，0表示不限制
+        self.log = log
+        self._models = OrderedDict()  # key -> 模型信息，按最近使用排序
+        self._lock = threading.RLock()
+        self._timer = None
+
+    def get_model(self, model_path, device="auto", compute_type="default", cpu_threads=0, num_workers=1):
+        """获取模型，已常驻则直接复用，否则加载并登记"""
+        key = (model_path, device, compute_type)
+        with self._lock:
+            entry = self._models.get(key)
+            # 线程参数变化时需要重新加载才能生效
+            if entry and (entry['cpu_threads'] != cpu_threads or entry['num_workers'] != num_workers):
+                self._evict(key, "线程参数变化")
+                entry = None
+
+            if entry:
+                self._models.move_to_end(key)
+                entry['last_used'] = time.time()
+                entry['hits'] += 1
+                return entry['model']
+
+            memory_before = self._measure_memory(device)
+            tic = time.time()
+            model = WhisperModel(
+                model_size_or_path=model_path,
+                device=device,
+                compute_type=compute_type,
+                cpu_threads=cpu_threads,
+                num_workers=num_workers
+            )
+            load_time = time.time() - tic
+            memory_mb = max(self._measure_memory(device) - memory_before, 0)
+
+            self._models[key] = {
+                'model': model,
+                'load_time': load_time,
+                'memory_mb': memory_mb,
+                'cpu_threads': cpu_threads,
+                'num_workers': num_workers,
+                'last_used': time.time(),
+                'hits': 0,
+                'in_use': 0
+            }
+            self.log(f"Whisper模型已加载({device}/{compute_type})，耗时{load_time:.1f}s，常驻占用约{memory_mb:.0f}MB")
+
+            self._enforce_limits(keep=key)
+            self._schedule_idle_check()
+            return model
+
+    @contextmanager
+    def borrow(self, model_path, device="auto", compute_type="default", cpu_threads=0, num_workers=1):
+        """借用模型，使用期间不会被空闲回收，归还后开始计算空闲时间"""
+        key = (model_path, device, compute_type)
+        with self._lock:
+            model = self.get_model(model_path, device, compute_type, cpu_threads, num_workers)
+            self._models[key]['in_use'] += 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry:
+                    entry['in_use'] -= 1
+                    entry['last_used'] = time.time()
+
+    def release(self, model_path=None, device=None, compute_type=None):
+        """释放指定模型，不传参数则释放全部；仍被借用的模型保留，归还后按空闲策略回收"""
+        with self._lock:
+            for key, entry in list(self._models.items()):
+                if model_path is not None and key != (model_path, device, compute_type):
+                    continue
+                if entry['in_use']:
+                    self.log(f"Whisper模型({key[1]}/{key[2]})仍有{entry['in_use']}个任务在使用，暂不释放")
+                    continue
+                self._evict(key, "手动释放")
+
+    def evict_idle(self):
+        """回收空闲超时的模型"""
+        if not self.idle_timeout:
+            return
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._models.items()):
+                if not entry['in_use'] and now - entry['last_used'] >= self.idle_timeout:
+                    self._evict(key, f"空闲超过{self.idle_timeout}s")
+
+    def stats(self):
+        """返回常驻模型的加载耗时、占用和使用情况"""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    'model_path': key[0],
+                    'device': key[1],
+                    'compute_type': key[2],
+                    'load_time': entry['load_time'],
+                    'memory_mb': entry['memory_mb'],
+                    'idle_seconds': now - entry['last_used'],
+                    'hits': entry['hits'],
+                    'in_use': entry['in_use']
+                }
+                for key, entry in self._models.items()
+            ]
+
+    def _enforce_limits(self, keep):
+        """按数量和内存预算从最久未使用的模型开始回收，当前模型和正在使用的模型始终保留"""
+        def evictable():
+            return [k for k, entry in self._models.items() if k != keep and not entry['in_use']]
+
+        while len(self._models) > max(self.max_models, 1) and evictable():
+            self._evict(evictable()[0], "超出常驻数量")
+
+        if self.memory_budget_mb:
+            while self._total_memory_mb() > self.memory_budget_mb and evictable():
+                self._evict(evictable()[0], "超出内存预算")
+
+    def _total_memory_mb(self):
+        return sum(entry['memory_mb'] for entry in self._models.values())
+
+    def _evict(self, key, reason):
+        entry = self._models.pop(key, None)
+        if entry is None:
+            return
+        del entry['model']
+        gc.collect()
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.log(f"已回收Whisper模型({key[1]}/{key[2]})：{reason}")
+
+    def _schedule_idle_check(self):
+        """启动空闲回收定时器，没有常驻模型时自动停止"""
+        if not self.idle_timeout or (self._timer and self._timer.is_alive()):
+            return
+        interval = min(self.idle_timeout, 60)
+
+        def check():
+            self.evict_idle()
+            with self._lock:
+                self._timer = None
+                if self._models:
+                    self._schedule_idle_check()
+
+        self._timer = threading.Timer(interval, check)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _measure_memory(self, device):
+        """测量当前占用(MB)：GPU看整卡已用显存，CPU看进程常驻内存"""
+        if device != "cpu" and torch is not None and torch.cuda.is_available():
+            free, total = torch.cuda.mem_get_info()
+            return (total - free) / 1024 / 1024
+        if psutil is not None:
+            return psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+        return 0